@@ -9,7 +9,7 @@
 #
 
 import sys
-import matplotlib.pyplot as plt
+import os
 import numpy as np
 from netCDF4 import Dataset
 import mmap
@@ -117,3 +117,144 @@ def getPlaneSampleAtTime(ncdat, group, var, itime, kplane):
             s1mesh[i,j] = s1
             s2mesh[i,j] = s2
     return xmesh, ymesh, zmesh, s1mesh, s2mesh, vmesh
+
+
+# ----------------------------------------------------------------------
+# Time index for sets of sampling files
+# ----------------------------------------------------------------------
+
+# Sidecar file (one per directory) which caches the time vectors of
+# the sampling files in that directory.  It only holds plain arrays
+# (loaded with allow_pickle=False), since the directory may be shared.
+timeindexfile = '.ppsample_timeindex.npz'
+
+def loadTimeCache(cachefile):
+    """
+    Load the time cache in cachefile as a dict of
+    name:((size, mtime), times), or {} if it can't be read
+    """
+    try:
+        with np.load(cachefile, allow_pickle=False) as data:
+            names   = [str(n) for n in data['names']]
+            keys    = data['keys']
+            offsets = data['offsets']
+            times   = data['times']
+    except Exception:
+        return {}
+    cache = {}
+    for i, name in enumerate(names):
+        cache[name] = ((int(keys[i,0]), int(keys[i,1])),
+                       times[offsets[i]:offsets[i+1]])
+    return cache
+
+def saveTimeCache(cachefile, cache):
+    names   = sorted(cache)
+    keys    = np.array([cache[n][0] for n in names], dtype=np.int64).reshape(-1, 2)
+    lengths = [len(cache[n][1]) for n in names]
+    offsets = np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)
+    times   = np.concatenate([np.zeros(0)]+[cache[n][1] for n in names])
+    # The directory may be read-only, in which case the cache is
+    # simply not kept
+    try:
+        tmpfile = cachefile+'.%i.tmp'%os.getpid()
+        with open(tmpfile, 'wb') as f:
+            np.savez(f, names=np.array(names, dtype=str), keys=keys,
+                     offsets=offsets, times=times.astype(np.float64))
+        os.replace(tmpfile, cachefile)
+    except OSError:
+        pass
+
+def getFileTimes(filelist, usecache=True, verbose=False):
+    """
+    Return a list with the time vector of each file in filelist.
+
+    The time vectors are cached in a sidecar file in each directory,
+    keyed by file name, size and mtime, so a file is only opened again
+    when it changes.
+    """
+    caches   = {}
+    modified = set()
+    filetimes = []
+    for fname in filelist:
+        path = os.path.realpath(fname)
+        dirname, basename = os.path.split(path)
+        stat = os.stat(path)
+        key  = (stat.st_size, stat.st_mtime_ns)
+        cachefile = os.path.join(dirname, timeindexfile)
+        if usecache and (cachefile not in caches):
+            caches[cachefile] = loadTimeCache(cachefile)
+        entry = caches[cachefile].get(basename, None) if usecache else None
+        if (entry is not None) and (entry[0] == key):
+            times = entry[1]
+        else:
+            if verbose: print("Reading times from "+fname)
+            ncdat = Dataset(fname, 'r')
+            times = np.array(ncdat.variables['time'][:], dtype=np.float64)
+            ncdat.close()
+            if usecache:
+                caches[cachefile][basename] = (key, times)
+                modified.add(cachefile)
+        filetimes.append(times)
+    for cachefile in modified:
+        saveTimeCache(cachefile, caches[cachefile])
+    return filetimes
+
+class timeIndex():
+    """
+    Map the global time vector of a set of sampling files to the file
+    and local index each time comes from.  Times which appear in more
+    than one file (e.g., the overlap after a restart) are taken from
+    the first file in the list which contains them.
+    """
+    def __init__(self, filelist, usecache=True, verbose=False):
+        self.filelist  = list(filelist)
+        self.filetimes = getFileTimes(self.filelist, usecache=usecache,
+                                      verbose=verbose)
+        nfiles = len(self.filelist)
+        if nfiles == 0:
+            self.alltimes = np.array([])
+            self.allfile  = np.array([], dtype=int)
+            self.alllocal = np.array([], dtype=int)
+        else:
+            self.alltimes = np.concatenate(self.filetimes)
+            self.allfile  = np.concatenate([np.full(len(t), i, dtype=int)
+                                            for i, t in enumerate(self.filetimes)])
+            self.alllocal = np.concatenate([np.arange(len(t))
+                                            for t in self.filetimes])
+        # np.unique returns the first occurrence of each time, which is
+        # the earliest file in the list
+        self.times, ifirst = np.unique(self.alltimes, return_index=True)
+        self.ifile  = self.allfile[ifirst]
+        self.ilocal = self.alllocal[ifirst]
+        return
+
+    def __len__(self):
+        return len(self.times)
+
+    def select(self, itimevec):
+        """
+        Split the global time indices in itimevec by file.  Returns a
+        list (one per file) of [itime, ilocal] pairs, in the order given
+        by itimevec, with repeated indices dropped.
+        """
+        itimes = np.asarray(itimevec, dtype=int).reshape(-1)
+        _, ifirst = np.unique(itimes, return_index=True)
+        itimes = itimes[np.sort(ifirst)]
+        fileselect = [[] for f in self.filelist]
+        for itime in itimes:
+            fileselect[self.ifile[itime]].append([int(itime), int(self.ilocal[itime])])
+        return fileselect
+
+    def filter(self, t1, t2):
+        """
+        Return a list (one per file) of the local indices of times in
+        (t1, t2].  Files are walked in order and a time is only taken
+        if it is later than every time taken before it.
+        """
+        tin   = np.where(self.alltimes <= t2, self.alltimes, -np.inf)
+        tprev = np.empty_like(tin)
+        tprev[:1] = -np.inf
+        tprev[1:] = np.maximum.accumulate(tin)[:-1]
+        keep  = (self.alltimes <= t2) & (self.alltimes > np.maximum(t1, tprev))
+        return [[int(i) for i in self.alllocal[keep & (self.allfile == ifile)]]
+                for ifile in range(len(self.filelist))]
@@ -2,24 +2,269 @@
 import postproamrwindsample as ppsample
 import numpy             as np
 import sys
+import os
+import tempfile
 import xarray as xr
 import pickle
-import matplotlib.pyplot as plt
 import glob
 import itertools
+import importlib.util
+import collections.abc
+import json
+import hashlib
 from postproengine import get_mapping_xyz_to_axis1axis2
 from postproengine import apply_coordinate_transform
-from mpl_toolkits.axes_grid1 import make_axes_locatable
+
+# Check for the dask package used by the lazy backend
+usedask = importlib.util.find_spec('dask') is not None
+if usedask:
+    import dask
+    import dask.array as da
 
 extractvar = lambda xrds, var, i : xrds[var][i,:].data.reshape(tuple(xrds.attrs['ijk_dims'][::-1]))
 nonan = lambda x, doreplace: np.nan_to_num(x) if doreplace else x
 
-def find_2nearest(a, a0):
-    asort = np.argsort(np.abs(np.array(a)-a0))
-    return asort[0], asort[1]
+# Target size (in bytes) of a block of timesteps read in one call
+blockbytes = 64*1024**2
+
+# Largest number of contiguous point runs to read one slice at a time
+maxpointruns = 256
+
+# Running totals of the bytes and timesteps read from the sample files
+# (used by the postproengine profiler)
+iostats = {'bytesread':0, 'timesteps':0}
+
+def countIO(nbytes=0, ntimes=0):
+    """
+    Add nbytes read and ntimes timesteps processed to iostats
+    """
+    iostats['bytesread'] += int(nbytes)
+    iostats['timesteps'] += int(ntimes)
+    return
+
+def getPointSelection(ijk_dims, iplanes=None, i_range=None, j_range=None):
+    """
+    Work out which num_points indices cover the planes in iplanes and
+    the inclusive index ranges i_range=[imin, imax] and
+    j_range=[jmin, jmax] of each plane.
 
-def interpfields(t1, t2, v1, v2):
-    return (v2-v1)/(t2-t1)+v1
+    Returns None if the whole plane stack is selected, otherwise a
+    dict with the point indices, the contiguous runs of points as
+    [start, stop) pairs, and the (k, j, i) shape of the selection.
+    """
+    if (iplanes is None) and (i_range is None) and (j_range is None):
+        return None
+    ni, nj, nk = [int(n) for n in ijk_dims]
+    if iplanes is None:
+        kk = np.arange(nk)
+    else:
+        kk = np.atleast_1d(np.asarray(iplanes, dtype=int))
+    jj = np.arange(nj) if j_range is None else np.arange(j_range[0], j_range[1]+1)
+    ii = np.arange(ni) if i_range is None else np.arange(i_range[0], i_range[1]+1)
+    for name, ind, n in [('iplanes', kk, nk), ('j_range', jj, nj), ('i_range', ii, ni)]:
+        if (len(ind) == 0) or (ind.min() < 0) or (ind.max() >= n):
+            raise ValueError('%s is outside of the plane dimensions %s'%(name, repr(list(ijk_dims))))
+    points = ((kk[:,None,None]*nj + jj[None,:,None])*ni + ii[None,None,:]).ravel()
+    breaks = np.where(np.diff(points) != 1)[0]+1
+    starts = np.concatenate(([0], breaks))
+    stops  = np.concatenate((breaks, [len(points)]))
+    runs   = [[int(points[a]), int(points[b-1])+1] for a, b in zip(starts, stops)]
+    return {'points':points, 'runs':runs, 'shape':(len(kk), len(jj), len(ii)),
+            'iplanes':[int(k) for k in kk]}
+
+def getWorkingDtype(dtype=None):
+    """
+    Check the working precision for plane data.  None keeps the
+    precision of the file, otherwise dtype is float32 or float64.
+    """
+    if dtype is None:
+        return None
+    workdtype = np.dtype(dtype)
+    if workdtype not in [np.dtype(np.float32), np.dtype(np.float64)]:
+        raise ValueError('Unknown dtype %s, options are: float32, float64'%repr(dtype))
+    return workdtype
+
+def extractvarblock(xrds, var, itimes, roi=None, dtype=None):
+    """
+    Read the timesteps in itimes for var as one (N, k, j, i) array.  If
+    roi is given (see getPointSelection), only those points are read.
+    If dtype is given, the block is converted to that precision.
+    """
+    if itimes[-1]-itimes[0]+1 == len(itimes):
+        tsel = slice(itimes[0], itimes[-1]+1)
+    else:
+        tsel = np.asarray(itimes)
+    if roi is None:
+        vblock = xrds[var][tsel,:].values
+        shape  = tuple(xrds.attrs['ijk_dims'][::-1])
+    elif len(roi['runs']) <= maxpointruns:
+        vblock = np.concatenate([xrds[var][tsel,slice(a, b)].values
+                                 for a, b in roi['runs']], axis=1)
+        shape  = roi['shape']
+    else:
+        vblock = xrds[var][tsel,roi['points']].values
+        shape  = roi['shape']
+    countIO(nbytes=vblock.nbytes)
+    if dtype is not None:
+        vblock = vblock.astype(dtype, copy=False)
+    return vblock.reshape((len(itimes),)+tuple(shape))
+
+def getPointIndices(ijk_dims, ptlist):
+    """
+    Convert a list of (k, j, i) plane points into flat point indices
+    """
+    shape = tuple(ijk_dims[::-1])
+    return np.ravel_multi_index(tuple(np.asarray(ptlist, dtype=int).T),
+                                shape)
+
+def extractpoints(xrds, var, itimes, idx):
+    """
+    Read var at the flat point indices idx for all timesteps in itimes
+    in one call, returned as an (npts, ntimes) array.
+    """
+    if len(itimes) == 0:
+        return np.zeros((len(idx), 0), dtype=xrds[var].dtype)
+    if itimes[-1]-itimes[0]+1 == len(itimes):
+        tsel = slice(itimes[0], itimes[-1]+1)
+    else:
+        tsel = np.asarray(itimes)
+    # The backends want sorted, unique point indices
+    uidx, inv = np.unique(idx, return_inverse=True)
+    vblock = xrds[var][tsel,uidx].values
+    countIO(nbytes=vblock.nbytes)
+    return vblock[:,inv].T
+
+def getBlockSize(xrds, var, blocksize=None):
+    """
+    Number of timesteps to read per block.  If blocksize is not given,
+    use the largest multiple of the time chunk size in the file which
+    stays under blockbytes.
+    """
+    if blocksize is not None:
+        return max(1, int(blocksize))
+    chunks  = xrds[var].encoding.get('chunksizes', None)
+    tchunk  = chunks[0] if chunks else 1
+    stepbytes = xrds[var].shape[1]*xrds[var].dtype.itemsize
+    nblock  = max(1, blockbytes//stepbytes)
+    return max(tchunk, (nblock//tchunk)*tchunk)
+
+def splitBlocks(itimes, blocksize):
+    """
+    Split a list of time indices into blocks of at most blocksize
+    """
+    return [itimes[i:i+blocksize] for i in range(0, len(itimes), blocksize)]
+
+# ----------------------------------------------------------------------
+# Snapshot cache
+# ----------------------------------------------------------------------
+class snapshotCache():
+    """
+    Least recently used cache of decoded plane snapshots, holding at
+    most maxbytes of data.  Entries are keyed by (file, group, var,
+    time index, point selection, dtype), see snapshotKey.
+    """
+    def __init__(self, maxbytes):
+        self.maxbytes = int(maxbytes)
+        self.nbytes   = 0
+        self.hits     = 0
+        self.misses   = 0
+        self.data     = collections.OrderedDict()
+        return
+
+    def get(self, key):
+        """
+        Return the cached snapshot for key, or None
+        """
+        if key not in self.data:
+            self.misses += 1
+            return None
+        self.data.move_to_end(key)
+        self.hits += 1
+        return self.data[key]
+
+    def put(self, key, snapshot):
+        """
+        Store a copy of snapshot, evicting the least recently used
+        entries to stay under maxbytes
+        """
+        if snapshot.nbytes > self.maxbytes:
+            return
+        if key in self.data:
+            self.nbytes -= self.data.pop(key).nbytes
+        self.data[key] = np.array(snapshot)
+        self.nbytes   += snapshot.nbytes
+        while self.nbytes > self.maxbytes:
+            oldkey, old = self.data.popitem(last=False)
+            self.nbytes -= old.nbytes
+        return
+
+    def clear(self):
+        self.data.clear()
+        self.nbytes = 0
+        return
+
+# The cache used by getPlaneXR, None when caching is off
+planecache = None
+
+def setPlaneCache(maxbytes):
+    """
+    Turn on the snapshot cache with a budget of maxbytes (a number of
+    bytes, or a string like '512MB' or '2GB').  maxbytes of None or 0
+    turns the cache off.  Returns the new cache.
+    """
+    global planecache
+    if planecache is not None:
+        planecache.clear()
+    maxbytes  = parseBytes(maxbytes)
+    planecache = snapshotCache(maxbytes) if maxbytes else None
+    return planecache
+
+def parseBytes(size):
+    """
+    Convert a size like 1000000, '512MB', or '2GB' into bytes
+    """
+    if size is None:
+        return 0
+    if isinstance(size, str):
+        units = {'KB':1024, 'MB':1024**2, 'GB':1024**3, 'TB':1024**4, 'B':1}
+        s = size.strip().upper()
+        for u, scale in units.items():
+            if s.endswith(u):
+                return int(float(s[:-len(u)])*scale)
+        return int(float(s))
+    return int(size)
+
+def snapshotKey(ncfile, group, roi, dtype):
+    """
+    The part of the cache key shared by all snapshots read from ncfile
+    with the point selection roi.  The file size and modification
+    time are included so changed files are read again.
+    """
+    stat   = os.stat(ncfile)
+    roikey = None if roi is None else \
+        hashlib.sha1(np.ascontiguousarray(roi['points']).tobytes()).hexdigest()
+    return (os.path.abspath(ncfile), stat.st_size, stat.st_mtime, group,
+            roikey, None if dtype is None else np.dtype(dtype).name)
+
+def extractvarblockcached(xrds, var, itimes, basekey, roi=None, dtype=None):
+    """
+    Same as extractvarblock, but reuses snapshots in planecache, and
+    only reads the timesteps which are missing
+    """
+    if planecache is None:
+        return extractvarblock(xrds, var, itimes, roi=roi, dtype=dtype)
+    keys    = [basekey+(var, int(i)) for i in itimes]
+    cached  = [planecache.get(k) for k in keys]
+    missing = [i for i, c in enumerate(cached) if c is None]
+    if len(missing) > 0:
+        vblock = extractvarblock(xrds, var, [itimes[i] for i in missing],
+                                 roi=roi, dtype=dtype)
+        for ib, i in enumerate(missing):
+            cached[i] = vblock[ib]
+            planecache.put(keys[i], vblock[ib])
+        if len(missing) == len(itimes):
+            return vblock
+    return np.stack(cached)
 
 def getFileList(ncfileinput):
     ncfilelist = []
@@ -38,10 +283,342 @@ def getFileList(ncfileinput):
 
     return ncfilelist
 
+# Mapping from variable names to the labels used in correlation names
+corr_mapping = {
+    'velocityx': 'u',
+    'velocityy': 'v',
+    'velocityz': 'w',
+    'velocitya1': 'ua1',
+    'velocitya2': 'ua2',
+    'velocitya3': 'ua3'
+}
+
+# Mapping from natural plane velocities to the cartesian velocities
+natural_velocity_mapping = {
+    'velocitya1': 'velocityx',
+    'velocitya2': 'velocityy',
+    'velocitya3': 'velocityz'
+}
+
+# Suffixes used to label each statistic in the output db
+statsuffix      = {'avg':'_avg',   'rs':'_avg',  'std':'_std',
+                   'min':'_min',   'max':'_max',
+                   'm3':'_m3',     'skew':'_skew',
+                   'm4':'_m4',     'kurt':'_kurt', 'triple':'_avg'}
+phasestatsuffix = {'avg':'_phavg', 'rs':'_phrs', 'std':'_phstd',
+                   'min':'_phmin', 'max':'_phmax',
+                   'm3':'_phm3',   'skew':'_phskew',
+                   'm4':'_phm4',   'kurt':'_phkurt', 'triple':'_phrs'}
+
+# Velocity components used for the TKE and its turbulent transport
+tkecomponents = [['velocityx','velocityy','velocityz'],
+                 ['velocitya1','velocitya2','velocitya3']]
+
+def parseStats(stats):
+    """
+    Expand and check a list of requested statistics
+
+    Besides the averages ('avg'), these are the Reynolds stresses
+    ('rs'), standard deviation ('std'), min and max, skewness and third
+    central moment ('skew'), kurtosis and fourth central moment
+    ('kurt'), and the triple correlations like u'u'w' ('triple').
+    'minmax' and 'moments' (std, skew, kurt) select several at once.
+    """
+    validstats = ['avg', 'rs', 'std', 'min', 'max', 'skew', 'kurt', 'triple']
+    groups     = {'minmax':['min', 'max'], 'moments':['std', 'skew', 'kurt']}
+    statlist   = ['avg']
+    for s in ([stats] if isinstance(stats, str) else stats):
+        expanded = groups.get(s, [s])
+        for e in expanded:
+            if e not in validstats:
+                raise ValueError('Unknown statistic %s, options are: %s'%(e, repr(validstats+list(groups))))
+            if e not in statlist: statlist.append(e)
+    return statlist
+
+def splitVarnames(varnames):
+    """
+    Split varnames into the variables to read from the file, and the
+    natural plane velocities (velocitya1-3) to construct from them
+    """
+    readlist  = []
+    transform = False
+    for v in varnames:
+        if v in natural_velocity_mapping:
+            transform = True
+        elif v not in readlist:
+            readlist.append(v)
+    if transform:
+        for v in ['velocityx','velocityy','velocityz']:
+            if v not in readlist: readlist.append(v)
+    natlist = ['velocitya1','velocitya2','velocitya3'] if transform else []
+    return readlist, natlist
+
+def transformVelocity(R, vdat):
+    """
+    Add the natural plane velocities velocitya1,a2,a3 to vdat, using
+    the rotation R.  Works on single snapshots or blocks of snapshots,
+    and keeps the precision of the velocities.
+    """
+    uvw = np.stack((vdat['velocityx'], vdat['velocityy'], vdat['velocityz']))
+    ua  = np.einsum('ij,j...->i...', np.asarray(R, dtype=uvw.dtype), uvw)
+    vdat['velocitya1'], vdat['velocitya2'], vdat['velocitya3'] = ua[0], ua[1], ua[2]
+    return vdat
+
+class planeStatsAccumulator():
+    """
+    Streaming accumulator for plane statistics
+
+    Keeps the running count, mean, min/max, the sums of powers of the
+    deviations from the mean (M2, M3, M4), the co-moments between the
+    variables in corrvars (C), and the triple co-moments (C3).  Blocks
+    of samples are combined using the pairwise updates of Chan, Golub &
+    LeVeque and Pebay (2008), which are also used to merge two partial
+    accumulators.
+    """
+    def __init__(self, varnames, stats=['avg'], extrafuncs=[],
+                 corrvars=None, suffix=statsuffix):
+        self.stats      = parseStats(stats)
+        self.varnames   = list(varnames)
+        self.extrafuncs = extrafuncs
+        self.suffix     = suffix
+        self.corrvars   = self.varnames if corrvars is None else list(corrvars)
+        # Highest power of the deviations needed for each variable
+        self.order      = 1
+        if 'std' in self.stats:  self.order = 2
+        if 'skew' in self.stats: self.order = 3
+        if 'kurt' in self.stats: self.order = 4
+        self.corrlist   = []
+        self.triplelist = []
+        cname = lambda vlist: ''.join([corr_mapping.get(v, v) for v in vlist])
+        if ('rs' in self.stats) or ('triple' in self.stats):
+            combinations  = itertools.combinations_with_replacement(self.corrvars, 2)
+            self.corrlist = [[cname([v1, v2]), v1, v2] for v1, v2 in combinations]
+        if 'triple' in self.stats:
+            combinations  = itertools.combinations_with_replacement(self.corrvars, 3)
+            self.triplelist = [[cname(vlist)]+list(vlist) for vlist in combinations]
+        self.count = 0
+        self.mean  = {}
+        self.M2    = {}
+        self.M3    = {}
+        self.M4    = {}
+        self.vmin  = {}
+        self.vmax  = {}
+        self.C     = {}
+        self.C3    = {}
+        return
+
+    def add(self, vdat):
+        """
+        Add a block of samples, where vdat[v] has shape (N, ...)
+        """
+        vals = {}
+        for v in self.varnames:
+            vals[v] = np.asarray(vdat[v], dtype=np.float64)
+        for f in self.extrafuncs:
+            vals[f['name']] = np.asarray(f['func'](vdat), dtype=np.float64)
+        nb = vals[self.varnames[0]].shape[0]
+        if nb == 0: return
+        block = {'count':nb, 'mean':{}, 'M2':{}, 'M3':{}, 'M4':{},
+                 'C':{}, 'C3':{}, 'vmin':{}, 'vmax':{}}
+        dev = {}
+        for k, x in vals.items():
+            block['mean'][k] = x.mean(axis=0)
+            dev[k] = x - block['mean'][k]
+            if self.order >= 2: block['M2'][k] = (dev[k]**2).sum(axis=0)
+            if self.order >= 3: block['M3'][k] = (dev[k]**3).sum(axis=0)
+            if self.order >= 4: block['M4'][k] = (dev[k]**4).sum(axis=0)
+        for name, v1, v2 in self.corrlist:
+            block['C'][name] = (dev[v1]*dev[v2]).sum(axis=0)
+        for name, v1, v2, v3 in self.triplelist:
+            block['C3'][name] = (dev[v1]*dev[v2]*dev[v3]).sum(axis=0)
+        if 'min' in self.stats:
+            block['vmin'] = {k:x.min(axis=0) for k, x in vals.items()}
+        if 'max' in self.stats:
+            block['vmax'] = {k:x.max(axis=0) for k, x in vals.items()}
+        self.merge(block)
+        return
+
+    def narrays(self):
+        """
+        Number of snapshot sized arrays kept by the accumulator (used to
+        estimate its memory)
+        """
+        nvars = len(self.varnames) + len(self.extrafuncs)
+        nmin  = nvars if 'min' in self.stats else 0
+        nmax  = nvars if 'max' in self.stats else 0
+        return nvars*self.order + len(self.corrlist) + len(self.triplelist) + nmin + nmax
+
+    def getstate(self):
+        """
+        Return the partial statistics as a dict of plain arrays
+        """
+        return {'count':self.count, 'mean':self.mean, 'M2':self.M2,
+                'M3':self.M3, 'M4':self.M4, 'C':self.C, 'C3':self.C3,
+                'vmin':self.vmin, 'vmax':self.vmax}
+
+    def merge(self, other):
+        """
+        Merge the partial statistics from another accumulator, or from a
+        dict returned by getstate()
+        """
+        state = other if isinstance(other, dict) else other.getstate()
+        self.combine(state['count'], state['mean'], state['M2'],
+                     state['C'], state['vmin'], state['vmax'],
+                     bM3=state.get('M3', {}), bM4=state.get('M4', {}),
+                     bC3=state.get('C3', {}))
+        return
+
+    def combine(self, nb, bmean, bM2, bC, vmin, vmax, bM3={}, bM4={}, bC3={}):
+        if nb == 0: return
+        na = self.count
+        n  = na + nb
+        zeros = lambda store, k, x: store[k] if k in store else np.zeros_like(x)
+        delta = {}
+        for k in bmean:
+            delta[k] = bmean[k] - zeros(self.mean, k, bmean[k])
+        # Update the higher moments first, as they use the old M2 and M3
+        for k in bM4:
+            aM2, aM3 = zeros(self.M2, k, bM4[k]), zeros(self.M3, k, bM4[k])
+            d = delta[k]
+            self.M4[k] = zeros(self.M4, k, bM4[k]) + bM4[k] \
+                + d**4*(na*nb*(na*na - na*nb + nb*nb)/n**3) \
+                + 6*d**2*(na*na*bM2[k] + nb*nb*aM2)/n**2 \
+                + 4*d*(na*bM3[k] - nb*aM3)/n
+        for k in bM3:
+            aM2 = zeros(self.M2, k, bM3[k])
+            d = delta[k]
+            self.M3[k] = zeros(self.M3, k, bM3[k]) + bM3[k] \
+                + d**3*(na*nb*(na - nb)/n**2) \
+                + 3*d*(na*bM2[k] - nb*aM2)/n
+        for name, v1, v2, v3 in self.triplelist:
+            if name not in bC3: continue
+            pair = lambda va, vb: self.corrname(va, vb)
+            dx, dy, dz = delta[v1], delta[v2], delta[v3]
+            aC = lambda va, vb: zeros(self.C, pair(va, vb), bC3[name])
+            self.C3[name] = zeros(self.C3, name, bC3[name]) + bC3[name] \
+                + dx*dy*dz*(na*nb*(na - nb)/n**2) \
+                + (na*(dx*bC[pair(v2, v3)] + dy*bC[pair(v1, v3)] + dz*bC[pair(v1, v2)])
+                   - nb*(dx*aC(v2, v3) + dy*aC(v1, v3) + dz*aC(v1, v2)))/n
+        for k in bM2:
+            self.M2[k] = zeros(self.M2, k, bM2[k]) + bM2[k] + delta[k]**2*(na*nb/n)
+        for name, v1, v2 in self.corrlist:
+            if name not in bC: continue
+            self.C[name] = zeros(self.C, name, bC[name]) + bC[name] + delta[v1]*delta[v2]*(na*nb/n)
+        for k in vmin:
+            self.vmin[k] = vmin[k].copy() if k not in self.vmin else np.minimum(self.vmin[k], vmin[k])
+        for k in vmax:
+            self.vmax[k] = vmax[k].copy() if k not in self.vmax else np.maximum(self.vmax[k], vmax[k])
+        for k in bmean:
+            self.mean[k] = zeros(self.mean, k, bmean[k]) + delta[k]*(nb/n)
+        self.count = n
+        return
+
+    def corrname(self, v1, v2):
+        """
+        Name of the co-moment between v1 and v2 in corrlist
+        """
+        for name, va, vb in self.corrlist:
+            if (va, vb) in [(v1, v2), (v2, v1)]: return name
+        raise KeyError((v1, v2))
+
+    def todb(self, db):
+        """
+        Write the normalized statistics into db
+        """
+        if self.count == 0: return db
+        N = float(self.count)
+        for k in self.mean:
+            db[k+self.suffix['avg']] = self.mean[k].copy()
+        if 'std' in self.stats:
+            for k in self.M2:
+                db[k+self.suffix['std']] = np.sqrt(self.M2[k]/N)
+        # Skewness and kurtosis are nan where the variance is zero
+        with np.errstate(divide='ignore', invalid='ignore'):
+            if 'skew' in self.stats:
+                for k in self.M3:
+                    db[k+self.suffix['m3']]   = self.M3[k]/N
+                    db[k+self.suffix['skew']] = np.sqrt(N)*self.M3[k]/self.M2[k]**1.5
+            if 'kurt' in self.stats:
+                for k in self.M4:
+                    db[k+self.suffix['m4']]   = self.M4[k]/N
+                    db[k+self.suffix['kurt']] = N*self.M4[k]/self.M2[k]**2
+        for k in self.vmin:
+            db[k+self.suffix['min']] = self.vmin[k].copy()
+        for k in self.vmax:
+            db[k+self.suffix['max']] = self.vmax[k].copy()
+        if 'rs' in self.stats:
+            for name, v1, v2 in self.corrlist:
+                db[name+self.suffix['rs']] = self.C[name]/N
+        if 'triple' in self.stats:
+            for name, v1, v2, v3 in self.triplelist:
+                db[name+self.suffix['triple']] = self.C3[name]/N
+            tkeFluxes(db, self.corrvars,
+                      {name:self.C[name]/N for name, v1, v2 in self.corrlist},
+                      {name:self.C3[name]/N for name, v1, v2, v3 in self.triplelist},
+                      suffix=self.suffix)
+        return db
+
+def tkeFluxes(db, corrvars, rs, triple, suffix=statsuffix):
+    """
+    Add the turbulent kinetic energy tke = <u_i'u_i'>/2 and its
+    turbulent transport flux tkefluxu_j = <u_i'u_i'u_j'>/2 to db, for
+    each set of velocity components in tkecomponents which are all in
+    corrvars.  rs and triple hold the stresses and triple correlations,
+    keyed by name (e.g., uw and uuw).
+    """
+    name = lambda vlist: ''.join([corr_mapping.get(v, v) for v in sorted(vlist, key=corrvars.index)])
+    for comps in tkecomponents:
+        if not all([v in corrvars for v in comps]): continue
+        prefix = '' if comps[0] == 'velocityx' else 'a'
+        db['tke'+prefix+suffix['rs']] = 0.5*sum([rs[name([v, v])] for v in comps])
+        for vj in comps:
+            db['tkeflux'+corr_mapping.get(vj, vj)+suffix['triple']] = \
+                0.5*sum([triple[name([v, v, vj])] for v in comps])
+    return db
+
+def allocPlaneArray(shape, dtype, scratchdir=None, name='plane'):
+    """
+    Allocate an array for plane data, optionally backed by a np.memmap
+    in scratchdir
+    """
+    if scratchdir is None:
+        return np.empty(shape, dtype=dtype)
+    if not os.path.exists(scratchdir):
+        os.makedirs(scratchdir)
+    fd, fname = tempfile.mkstemp(prefix=name+'_', suffix='.dat', dir=scratchdir)
+    os.close(fd)
+    mmarray = np.memmap(fname, dtype=dtype, mode='w+', shape=shape)
+    try:
+        # The mapping stays valid, and the file is removed once it is closed
+        os.unlink(fname)
+    except OSError:
+        pass
+    return mmarray
+
 def getPlaneXR(ncfileinput, itimevec, varnames, groupname=None,
-               verbose=0, includeattr=False, gettimes=False,timerange=None,axis_rotation=0):
+               verbose=0, includeattr=False, gettimes=False,timerange=None,axis_rotation=0,
+               contiguous=False, scratchdir=None, blocksize=None,
+               iplanes=None, i_range=None, j_range=None, dtype=None):
+    """
+    Extract the plane snapshots at itimevec (or in timerange)
 
+    By default db[var] is a dict of (k, j, i) arrays keyed by time
+    index.  With contiguous=True, db[var] is one preallocated
+    (time, k, j, i) array ordered like db['timesteps'], which is backed
+    by a np.memmap in scratchdir if given.
+
+    iplanes, i_range=[imin, imax], and j_range=[jmin, jmax] restrict
+    the read to those planes and (inclusive) index ranges, in which
+    case db['iplanes'] lists the planes read along k.
+
+    dtype (float32 or float64) sets the precision the snapshots are
+    stored in (Default: the precision in the file).
+
+    Snapshots already in the snapshot cache (see setPlaneCache) are
+    reused instead of being read again.
+    """
     ncfilelist = getFileList(ncfileinput)
+    dtype      = getWorkingDtype(dtype)
 
     # Create a fresh db dictionary
     db = {}
@@ -50,16 +627,13 @@ def getPlaneXR(ncfileinput, itimevec, varnames, groupname=None,
 
     #Apply transformation after computing cartesian average
     transform=False
+    outnames = list(varnames)
     if varnames == ['velocitya1','velocitya2','velocitya3']:
         transform = True
         varnames = ['velocityx','velocityy','velocityz']
 
-    timevec = []
-    times   = []
-    for ncfileiter,ncfile in enumerate(ncfilelist):
-        times.append(ppsample.getVar(ppsample.loadDataset(ncfile), 'time')[:])
-        timevec = np.concatenate((timevec, times[ncfileiter]))               
-        timevec = np.unique(timevec)
+    tindex  = ppsample.timeIndex(ncfilelist)
+    timevec = tindex.times
 
     if timerange is not None:
         if len(timerange) != 2:
@@ -69,12 +643,20 @@ def getPlaneXR(ncfileinput, itimevec, varnames, groupname=None,
         itimevec = [find_nearest(timevec, t) for t in timerange]
         itimevec = np.arange(itimevec[0],itimevec[1]+1)
 
-    itime_processed = []
+    # Work out which file and local index each time comes from
+    fileselect = tindex.select(itimevec)
+    ntimes = sum([len(f) for f in fileselect])
+
+    ipos = 0
     for ncfileiter,ncfile in enumerate(ncfilelist):
         if gettimes:
             if ncfileiter == 0:
                 db['times'] = []
 
+        # No need to open files which contribute no times
+        if (ncfileiter > 0) and (len(fileselect[ncfileiter]) == 0):
+            continue
+
         # Now load the ncfile data
         if groupname is None:
             groups= ppsample.getGroups(ppsample.loadDataset(ncfile))
@@ -84,12 +666,17 @@ def getPlaneXR(ncfileinput, itimevec, varnames, groupname=None,
 
         with xr.open_dataset(ncfile, group=group) as ds:
             if ncfileiter == 0:
+                roi = getPointSelection(ds.attrs['ijk_dims'], iplanes=iplanes,
+                                        i_range=i_range, j_range=j_range)
                 reshapeijk = ds.attrs['ijk_dims'][::-1]
-                xm = ds['coordinates'].data[:,0].reshape(tuple(reshapeijk))
-                ym = ds['coordinates'].data[:,1].reshape(tuple(reshapeijk))
-                zm = ds['coordinates'].data[:,2].reshape(tuple(reshapeijk))
-                dtime=xr.open_dataset(ncfile)
-                dtime.close()
+                coords = ds['coordinates'].data
+                if roi is not None:
+                    coords     = coords[roi['points'],:]
+                    reshapeijk = roi['shape']
+                    db['iplanes'] = roi['iplanes']
+                xm = coords[:,0].reshape(tuple(reshapeijk))
+                ym = coords[:,1].reshape(tuple(reshapeijk))
+                zm = coords[:,2].reshape(tuple(reshapeijk))
                 db['x'] = xm
                 db['y'] = ym
                 db['z'] = zm        
@@ -100,30 +687,35 @@ def getPlaneXR(ncfileinput, itimevec, varnames, groupname=None,
                 except:
                     db['axis3'] = ds.attrs['axis3']
                 R=get_mapping_xyz_to_axis1axis2(db['axis1'],db['axis2'],db['axis3'],rot=axis_rotation)
-            for itime in itimevec:
-                local_ind = np.where(np.isin(times[ncfileiter], timevec[itime]))[0]
-                if itime not in itime_processed and len(local_ind)==1:
-                    if verbose>0:
-                        print("extracting iter "+repr(itime))
+                if contiguous:
+                    for v in outnames:
+                        db[v] = allocPlaneArray((ntimes,)+tuple(reshapeijk),
+                                                ds[varnames[0]].dtype if dtype is None else dtype,
+                                                scratchdir=scratchdir, name=v)
+            nblock  = getBlockSize(ds, varnames[0], blocksize)
+            basekey = None if planecache is None else snapshotKey(ncfile, group, roi, dtype)
+            for block in splitBlocks(fileselect[ncfileiter], nblock):
+                iblock = [entry[1] for entry in block]
+                if verbose>0:
+                    print("extracting iters "+repr([entry[0] for entry in block]))
+                vdat = {}
+                for v in varnames:
+                    vdat[v] = extractvarblockcached(ds, v, iblock, basekey,
+                                                    roi=roi, dtype=dtype)
+                if transform:
+                    transformVelocity(R, vdat)
+                for ib, (itime, local_ind) in enumerate(block):
                     db['timesteps'].append(itime)
                     if gettimes:
                         db['times'].append(float(timevec[itime]))
-                    if not transform:
-                        for v in varnames:
-                            vvar = extractvar(ds, v, local_ind)
-                            db[v][itime] = vvar
-                    else:
-                        vvarx = extractvar(ds, varnames[0], local_ind)
-                        vvary = extractvar(ds, varnames[1], local_ind)
-                        vvarz = extractvar(ds, varnames[2], local_ind)
-                        db['velocitya1'][itime],db['velocitya2'][itime],db['velocitya3'][itime] = apply_coordinate_transform(R,vvarx,vvary,vvarz)
-                    #vx = extractvar(ds, vxvar, itime)
-                    #vy = extractvar(ds, vyvar, itime)
-                    #vz = extractvar(ds, vzvar, itime)
-                    itime_processed.append(itime)
-                else:
-                    if verbose>0:
-                        print("Already processed itime: ",itime)
+                    if not contiguous:
+                        for v in outnames:
+                            db[v][itime] = vdat[v][ib]
+                if contiguous:
+                    for v in outnames:
+                        db[v][ipos:ipos+len(block)] = vdat[v]
+                ipos += len(block)
+                countIO(ntimes=len(block))
             if ncfileiter == 0:
                 if includeattr:
                     for k, g in ds.attrs.items():
@@ -147,22 +739,20 @@ def getPlanePtsXR(ncfile, itimevec, ptlist,
                   groupname=None,
                   verbose=0, includeattr=False, gettimes=False):
     """
-    Extract specific points from a plane given in the netcdf file
+    Extract specific points from a plane given in the netcdf file.
+    Each point in ptlist is a (k, j, i) index into the plane.  The
+    values are returned both as db[v], an (npts, ntimes) array in the
+    order of ptlist, and as db[pt][v] for each point.
     """
-    # Create a fresh db dictionary
     db = {}
-    for pt in ptlist: 
-        db[pt] = {}
-        for v in varnames:
-            db[pt][v] = []
-    db['timesteps'] = []
-    Ntimes = len(ppsample.getVar(ppsample.loadDataset(ncfile), 'time'))
-    timevec = None
-    if gettimes:
-        timevec = ppsample.getVar(ppsample.loadDataset(ncfile), 'time')
-        db['times'] = []
+    timevec = ppsample.getFileTimes([ncfile])[0]
+    Ntimes  = len(timevec)
     if len(itimevec)==0:
         itimevec = list(range(Ntimes))
+    itimes = [Ntimes+i if i<0 else i for i in itimevec]
+    db['timesteps'] = itimes
+    if gettimes:
+        db['times'] = [float(timevec[i]) for i in itimes]
     # Now load the ncfile data
     if groupname is None:
         groups= ppsample.getGroups(ppsample.loadDataset(ncfile))
@@ -174,55 +764,244 @@ def getPlanePtsXR(ncfile, itimevec, ptlist,
         xm = ds['coordinates'].data[:,0].reshape(tuple(reshapeijk))
         ym = ds['coordinates'].data[:,1].reshape(tuple(reshapeijk))
         zm = ds['coordinates'].data[:,2].reshape(tuple(reshapeijk))
-        dtime=xr.open_dataset(ncfile)
-        dtime.close()
         db['x'] = xm
         db['y'] = ym
         db['z'] = zm
-        for ind, itimeraw in enumerate(itimevec):
-            itime = Ntimes+itimeraw if itimeraw<0 else itimeraw
-            if verbose: progress(ind+1, len(itimevec))
-            db['timesteps'].append(itime)
-            if gettimes:
-                db['times'].append(float(timevec[itime]))
-            for v in varnames:
-                vvar = extractvar(ds, v, itime)
-                for pt in ptlist:
-                    db[pt][v].append(vvar[pt])
+        # Flat indices of the points, computed once
+        idx = getPointIndices(ds.attrs['ijk_dims'], ptlist)
+        for pt in ptlist:
+            db[pt] = {}
+        for iv, v in enumerate(varnames):
+            if verbose: progress(iv+1, len(varnames))
+            # (npts, ntimes) array for all points and times
+            db[v] = extractpoints(ds, v, itimes, idx)
+            for ipt, pt in enumerate(ptlist):
+                db[pt][v] = db[v][ipt,:]
+        countIO(ntimes=len(itimes))
         if includeattr:
             for k, g in ds.attrs.items():
                 db[k] = g
     return db
 
 
-def avgPlaneXR(ncfileinput, timerange,
-               extrafuncs=[],
-               varnames=['velocityx','velocityy','velocityz'],
-               savepklfile='',
-               groupname=None, verbose=False, includeattr=False, 
-               replacenan=False,axis_rotation=0):
+def getPlaneHeaderXR(ds, db, roi=None):
     """
-    Compute the average of ncfile variables
+    Copy the plane coordinates and geometry from ds into db.  If roi is
+    given (see getPointSelection), only those points are kept.
+    """
+    reshapeijk = ds.attrs['ijk_dims'][::-1]
+    coords = ds['coordinates'].data
+    if roi is not None:
+        coords     = coords[roi['points'],:]
+        reshapeijk = roi['shape']
+        db['iplanes'] = roi['iplanes']
+    db['x'] = coords[:,0].reshape(tuple(reshapeijk))
+    db['y'] = coords[:,1].reshape(tuple(reshapeijk))
+    db['z'] = coords[:,2].reshape(tuple(reshapeijk))
+    db['axis1'] = ds.attrs['axis1']
+    db['axis2'] = ds.attrs['axis2']
+    try:
+        db['axis3'] = ds.attrs['offset_vector']
+    except:
+        db['axis3'] = ds.attrs['axis3']
+    db['origin'] = ds.attrs['origin']
+    db['offsets'] = ds.attrs['offsets']
+    return db
+
+def readPlaneHeaderXR(ncfileinput, groupname=None):
+    """
+    Return a db with only the plane coordinates and geometry, read from
+    the first file in ncfileinput
+    """
+    ncfile = getFileList(ncfileinput)[0]
+    if groupname is None:
+        groups= ppsample.getGroups(ppsample.loadDataset(ncfile))
+        group = groups[0]
+    else:
+        group = groupname
+    db = {'group':group}
+    with xr.open_dataset(ncfile, group=group) as ds:
+        getPlaneHeaderXR(ds, db)
+        db['ijk_dims'] = ds.attrs['ijk_dims']
+    return db
+
+def accumulatePlaneFile(acc, ncfile, group, itimes, timevec, readlist,
+                        R=None, replacenan=False, blocksize=None,
+                        verbose=False, roi=None, dtype=None):
+    """
+    Add the timesteps itimes from ncfile into the accumulator acc,
+    reading them in the precision dtype.  Returns the list of times
+    added.
+    """
+    times  = []
+    Ntotal = len(itimes)
+    localNcount = 0
+    with xr.open_dataset(ncfile, group=group) as ds:
+        nblock = getBlockSize(ds, readlist[0], blocksize)
+        # Loop through and accumulate
+        for iblock in splitBlocks(itimes, nblock):
+            times.extend([float(t) for t in timevec[iblock]])
+            vdat = {}
+            for v in readlist:
+                vdat[v] = nonan(extractvarblock(ds, v, iblock, roi=roi, dtype=dtype), replacenan)
+            if R is not None: transformVelocity(R, vdat)
+            acc.add(vdat)
+            localNcount += len(iblock)
+            countIO(ntimes=len(iblock))
+            if verbose: progress(localNcount, Ntotal)
+    return times
+
+# Description of the statistics job being run by the worker processes.
+# This is set before the pool is forked, so extrafuncs (which are
+# usually lambdas) never need to be pickled.
+parallelstatsjob = {}
+
+def statsPlaneWorker(iunit):
+    """
+    Accumulate one unit of work in a worker process, and return the
+    partial statistics along with the times used and the bytes read
+    """
+    job = parallelstatsjob
+    ncfile, group, itimes, timevec = job['units'][iunit]
+    acc = planeStatsAccumulator(**job['accargs'])
+    nbytes = iostats['bytesread']
+    times = accumulatePlaneFile(acc, ncfile, group, itimes, timevec,
+                                job['readlist'], R=job['R'],
+                                replacenan=job['replacenan'],
+                                blocksize=job['blocksize'], roi=job['roi'],
+                                dtype=job['dtype'])
+    return acc.getstate(), times, iostats['bytesread']-nbytes
+
+def splitWorkUnits(ncfilelist, fileitimes, filetimes, group, nprocs):
+    """
+    Split the timesteps into (ncfile, group, itimes, timevec) units of
+    work, using at least nprocs units if possible
+    """
+    usefiles = [i for i in range(len(ncfilelist)) if len(fileitimes[i])>0]
+    nsplit   = max(1, int(np.ceil(nprocs/max(1, len(usefiles)))))
+    units    = []
+    for i in usefiles:
+        nchunk = int(np.ceil(len(fileitimes[i])/nsplit))
+        for itimes in splitBlocks(fileitimes[i], nchunk):
+            units.append((ncfilelist[i], group, itimes, filetimes[i]))
+    return units
+
+def runParallelStats(acc, units, readlist, R, replacenan, blocksize,
+                     nprocs, verbose=False, roi=None, dtype=None):
+    """
+    Accumulate the units of work over a pool of nprocs processes and
+    merge the partial results into acc.  Returns the list of times used.
+    """
+    global parallelstatsjob
+    import multiprocessing
+    try:
+        ctx = multiprocessing.get_context('fork')
+    except ValueError:
+        print("Warning: fork not available, computing statistics serially")
+        return None
+    parallelstatsjob = {'units':units, 'readlist':readlist, 'R':R,
+                        'replacenan':replacenan, 'blocksize':blocksize,
+                        'roi':roi, 'dtype':dtype,
+                        'accargs':{'varnames':acc.varnames,
+                                   'stats':acc.stats,
+                                   'extrafuncs':acc.extrafuncs,
+                                   'corrvars':acc.corrvars,
+                                   'suffix':acc.suffix}}
+    times = []
+    try:
+        with ctx.Pool(min(nprocs, len(units))) as pool:
+            # imap keeps the results in order, so the merge is
+            # deterministic
+            for iunit, (state, unittimes, nbytes) in enumerate(pool.imap(statsPlaneWorker, range(len(units)))):
+                acc.merge(state)
+                times.extend(unittimes)
+                countIO(nbytes=nbytes, ntimes=len(unittimes))
+                if verbose: progress(iunit+1, len(units))
+    finally:
+        parallelstatsjob = {}
+    if verbose: print()
+    return times
+
+def getStateFile(savepklfile):
+    """
+    Name of the file holding the accumulator state for savepklfile
+    """
+    return os.path.splitext(savepklfile)[0]+'_state.pkl'
+
+def loadStatsState(statefile, settings, t2):
+    """
+    Load the accumulator state saved in statefile.  Returns None if
+    there is no state, or if it was computed with different settings or
+    already goes past t2.
     """
+    if not os.path.exists(statefile):
+        return None
+    with open(statefile, 'rb') as f:
+        saved = pickle.load(f)
+    if saved['settings'] != settings:
+        print("Warning: %s was computed with different settings, recomputing"%statefile)
+        return None
+    if (len(saved['times']) > 0) and (saved['times'][-1] > t2):
+        print("Warning: %s goes past the end of the time range, recomputing"%statefile)
+        return None
+    return saved
+
+def saveStatsState(statefile, settings, acc, times):
+    """
+    Save the accumulator state (or any picklable state) and the times
+    used to statefile
+    """
+    state = acc.getstate() if hasattr(acc, 'getstate') else acc
+    saved = {'settings':settings, 'state':state, 'times':times}
+    tmpfile = statefile+'.tmp'
+    with open(tmpfile, 'wb') as f:
+        pickle.dump(saved, f, protocol=2)
+    os.replace(tmpfile, statefile)
+    return
+
+def statsPlaneXR(ncfileinput, timerange,
+                 stats=['avg'],
+                 extrafuncs=[],
+                 varnames=['velocityx','velocityy','velocityz'],
+                 savepklfile='',
+                 groupname=None, verbose=False, includeattr=False,
+                 replacenan=False, axis_rotation=0, blocksize=None,
+                 nprocs=1, iplanes=None, i_range=None, j_range=None,
+                 resume=False, dtype=None, checkpointsteps=None):
+    """
+    Compute any mix of statistics of ncfile variables in a single pass
+
+    stats is a list with any of 'avg', 'rs', 'std', 'min', 'max',
+    'skew', 'kurt', 'triple', 'minmax', or 'moments' (see parseStats).
+    The averages are always computed.  Timesteps are read
+    blocksize at a time (default: chunk aligned, see getBlockSize).
+    With nprocs > 1, the files (or pieces of files) are split over a
+    process pool and the partial statistics are merged exactly.
+    iplanes, i_range, and j_range restrict the read to part of the
+    plane stack (see getPlaneXR).
+
+    With resume=True, the accumulator state is kept next to savepklfile
+    (see getStateFile), and a later call only reads the timesteps after
+    the last time in the saved state.  With checkpointsteps, the state
+    is also saved every checkpointsteps timesteps (with nprocs=1), so
+    an interrupted run loses at most that many.
+
+    The timesteps are read in the precision dtype (float32 or float64,
+    Default: the precision in the file), while the running statistics
+    are always kept in float64.
+    """
+    dtype = getWorkingDtype(dtype)
     # make sure input is a list
     ncfilelist = getFileList(ncfileinput)
     ncfile=ncfilelist[0]
-    suf='_avg'
-
-    #Apply transformation after computing cartesian average
-    natural_velocity_mapping = {
-        'velocitya1': 'velocityx',
-        'velocitya2': 'velocityy',
-        'velocitya3': 'velocityz'
-    }
 
-    transform = False
-    for viter, v in enumerate(varnames):
-        for key, value in natural_velocity_mapping.items():
-            if key in v:
-                varnames[viter] = value
-                transform = True
-                break  
+    # Variables to read from the file, and natural plane velocities to
+    # construct from them
+    userlist  = list(varnames)
+    readlist, natlist = splitVarnames(userlist)
+    transform = len(natlist) > 0
+    acc = planeStatsAccumulator(readlist+natlist, stats=stats,
+                                extrafuncs=extrafuncs, corrvars=userlist)
 
     # Create a fresh db dictionary
     db = {}
@@ -237,123 +1016,499 @@ def avgPlaneXR(ncfileinput, timerange,
     else:
         group = groupname
     db['group'] = group
-    Ncount = 0
-    for ncfile in ncfilelist:
-        timevec     = ppsample.getVar(ppsample.loadDataset(ncfile), 'time')
-        filtertime  = np.where((t1 <= np.array(timevec)) & (np.array(timevec) <= t2))
-        Ntotal      = len(filtertime[0])
-        if verbose:
-            print("%s %i"%(ncfile, Ntotal))
-            #print("%f %f"%(t1, t2))
-        localNcount = 0
-        with xr.open_dataset(ncfile, group=group) as ds:
-            if 'x' not in ds:
-                reshapeijk = ds.attrs['ijk_dims'][::-1]
-                xm = ds['coordinates'].data[:,0].reshape(tuple(reshapeijk))
-                ym = ds['coordinates'].data[:,1].reshape(tuple(reshapeijk))
-                zm = ds['coordinates'].data[:,2].reshape(tuple(reshapeijk))
-                db['x'] = xm
-                db['y'] = ym
-                db['z'] = zm
-                db['axis1'] = ds.attrs['axis1']
-                db['axis2'] = ds.attrs['axis2']
-                try:
-                    db['axis3'] = ds.attrs['offset_vector']
-                except:
-                    db['axis3'] = ds.attrs['axis3']
-                db['origin'] = ds.attrs['origin']
-                db['offsets'] = ds.attrs['offsets']
-            # Set up the initial mean fields
-            zeroarray = extractvar(ds, varnames[0], 0)
-            for v in varnames:
-                if v+suf not in db:
-                    db[v+suf] = np.full_like(zeroarray, 0.0)
-            if len(extrafuncs)>0:
-                for f in extrafuncs:
-                    if f['name']+suf not in db:
-                        db[f['name']+suf] = np.full_like(zeroarray, 0.0)
-            # Loop through and accumulate
-            for itime, t in enumerate(timevec):
-                if (t1 < t) and (t <= t2):
-                    t1 = t
-                    if verbose: progress(localNcount+1, Ntotal)
-                    db['times'].append(float(t))
-                    vdat = {}
-                    for v in varnames:
-                        vdat[v] = nonan(extractvar(ds, v, itime), replacenan)
-                        db[v+suf] += vdat[v]
-                    if len(extrafuncs)>0:
-                        for f in extrafuncs:
-                            name = f['name']+suf
-                            func = f['func']
-                            db[name] += func(vdat)
-                    Ncount += 1
-                    localNcount += 1
-            print()  # Done with this file
-    # Normalize the result
-    if Ncount > 0:
-        for v in varnames:
-            db[v+suf] /= float(Ncount)
-        if len(extrafuncs)>0:
-            for f in extrafuncs:
-                name = f['name']+suf
-                db[name] /= float(Ncount)
 
+    # Pick up from a previously saved state
+    statefile = None
+    oldtimes  = []
+    if resume:
+        if len(savepklfile) == 0:
+            print("Warning: resume requires savepklfile, computing from scratch")
+        else:
+            statefile = getStateFile(savepklfile)
+            settings  = {'varnames':userlist, 'stats':acc.stats,
+                         'extrafuncs':[f['name'] for f in extrafuncs],
+                         'group':group, 'tstart':float(timerange[0]),
+                         'axis_rotation':axis_rotation,
+                         'replacenan':replacenan, 'iplanes':iplanes,
+                         'i_range':i_range, 'j_range':j_range}
+            if dtype is not None: settings['dtype'] = dtype.name
+            saved = loadStatsState(statefile, settings, t2)
+            if saved is not None:
+                acc.merge(saved['state'])
+                oldtimes = saved['times']
+                if len(oldtimes) > 0: t1 = max(t1, oldtimes[-1])
+                if verbose:
+                    print("Resuming from %i samples in %s"%(acc.count, statefile))
+
+    tindex     = ppsample.timeIndex(ncfilelist)
+    fileitimes = tindex.filter(t1, t2)
+
+    # Get the plane header from the first file with data
+    usefiles = [i for i in range(len(ncfilelist)) if len(fileitimes[i])>0]
+    headerfile = ncfilelist[usefiles[0]] if len(usefiles)>0 else ncfile
+    with xr.open_dataset(headerfile, group=group) as ds:
+        roi = getPointSelection(ds.attrs['ijk_dims'], iplanes=iplanes,
+                                i_range=i_range, j_range=j_range)
+        getPlaneHeaderXR(ds, db, roi=roi)
+        attrs = dict(ds.attrs)
+    R = None
     if transform:
         R=get_mapping_xyz_to_axis1axis2(db['axis1'],db['axis2'],db['axis3'],rot=axis_rotation)
-        db['velocitya1_avg'],db['velocitya2_avg'],db['velocitya3_avg'] = apply_coordinate_transform(R,db['velocityx_avg'],db['velocityy_avg'],db['velocityz_avg'])
+
+    times = None
+    if nprocs > 1:
+        units = splitWorkUnits(ncfilelist, fileitimes, tindex.filetimes,
+                               group, nprocs)
+        if verbose:
+            print("Computing statistics over %i units with %i procs"%(len(units), nprocs))
+        if len(units) > 1:
+            times = runParallelStats(acc, units, readlist, R, replacenan,
+                                     blocksize, nprocs, verbose=verbose,
+                                     roi=roi, dtype=dtype)
+    if times is None:
+        times = []
+        for ncfileiter, ncfile in enumerate(ncfilelist):
+            Ntotal = len(fileitimes[ncfileiter])
+            if verbose:
+                print("%s %i"%(ncfile, Ntotal))
+            if Ntotal == 0:
+                continue
+            checkpoint = (statefile is not None) and bool(checkpointsteps)
+            nsplit     = int(checkpointsteps) if checkpoint else Ntotal
+            for i0 in range(0, Ntotal, nsplit):
+                times += accumulatePlaneFile(acc, ncfile, group,
+                                             fileitimes[ncfileiter][i0:i0+nsplit],
+                                             tindex.filetimes[ncfileiter],
+                                             readlist, R=R,
+                                             replacenan=replacenan,
+                                             blocksize=blocksize,
+                                             verbose=verbose, roi=roi,
+                                             dtype=dtype)
+                if checkpoint:
+                    saveStatsState(statefile, settings, acc, oldtimes + times)
+            print()  # Done with this file
+    db['times'] = oldtimes + times
+    if statefile is not None:
+        saveStatsState(statefile, settings, acc, db['times'])
+    # Normalize the result
+    acc.todb(db)
 
     if verbose:
-        print("Ncount = %i"%Ncount)
+        print("Ncount = %i"%acc.count)
         print()
     # include attributes
     if includeattr:
-        for k, g in ds.attrs.items():
+        for k, g in attrs.items():
             db[k] = g
     if len(savepklfile)>0:
-        # Write out the picklefile
-        dbfile = open(savepklfile, 'wb')
-        pickle.dump(db, dbfile, protocol=2)
-        dbfile.close()
+        # Write out the picklefile (or result store)
+        saveResultDB(db, savepklfile)
 
     return db
 
+def avgPlaneXR(ncfileinput, timerange,
+               extrafuncs=[],
+               varnames=['velocityx','velocityy','velocityz'],
+               savepklfile='',
+               groupname=None, verbose=False, includeattr=False, 
+               replacenan=False,axis_rotation=0, blocksize=None):
+    """
+    Compute the average of ncfile variables
+    """
+    return statsPlaneXR(ncfileinput, timerange, stats=['avg'],
+                        extrafuncs=extrafuncs, varnames=varnames,
+                        savepklfile=savepklfile, groupname=groupname,
+                        verbose=verbose, includeattr=includeattr,
+                        replacenan=replacenan, axis_rotation=axis_rotation,
+                        blocksize=blocksize)
+
+# ----------------------------------------------------------------------
+# Lazy (dask) backend
+# ----------------------------------------------------------------------
+
+# Choices for the dask scheduler
+daskschedulers = ['threads', 'processes', 'synchronous']
+
+def openPlaneSetXR(ncfileinput, groupname=None, varnames=None,
+                   timerange=None, blocksize=None,
+                   iplanes=None, i_range=None, j_range=None, dtype=None):
+    """
+    Lazily open a set of sampling files as one xarray Dataset
+
+    Each variable is a dask array with dims (time, k, j, i), chunked
+    along time (blocksize timesteps per chunk, see getBlockSize).  Times
+    repeated across files are only taken once, and timerange=[t1, t2]
+    keeps the times in [t1, t2].  If dtype is given, the arrays are
+    converted to that precision.  Nothing is read until the arrays are
+    computed, so the files stay open until the returned Dataset is
+    closed.
+    """
+    if not usedask:
+        print("Error: dask package required for the lazy backend")
+        sys.exit()
+    ncfilelist = getFileList(ncfileinput)
+    dtype      = getWorkingDtype(dtype)
+    if groupname is None:
+        groups= ppsample.getGroups(ppsample.loadDataset(ncfilelist[0]))
+        group = groups[0]
+    else:
+        group = groupname
+    tindex = ppsample.timeIndex(ncfilelist)
+    if timerange is None:
+        fileitimes = tindex.filter(-np.inf, np.inf)
+    else:
+        eps = 1.0E-10
+        fileitimes = tindex.filter(timerange[0]-eps, timerange[1])
+
+    db    = {}
+    times = []
+    vlist = {}
+    roi   = None
+    opened = []
+    for ncfileiter, ncfile in enumerate(ncfilelist):
+        itimes = fileitimes[ncfileiter]
+        if (len(itimes) == 0) and ('x' in db):
+            continue
+        if 'x' not in db:
+            with xr.open_dataset(ncfile, group=group) as ds:
+                roi = getPointSelection(ds.attrs['ijk_dims'], iplanes=iplanes,
+                                        i_range=i_range, j_range=j_range)
+                getPlaneHeaderXR(ds, db, roi=roi)
+                attrs = dict(ds.attrs)
+                if varnames is None:
+                    varnames = [v for v in ds.data_vars if 'num_time_steps' in ds[v].dims]
+                tchunk = getBlockSize(ds, varnames[0], blocksize)
+            shape = db['x'].shape
+            for v in varnames: vlist[v] = []
+        if len(itimes) == 0:
+            continue
+        ds = xr.open_dataset(ncfile, group=group,
+                             chunks={'num_time_steps':tchunk})
+        opened.append(ds)
+        times.extend([float(t) for t in tindex.filetimes[ncfileiter][itimes]])
+        for v in varnames:
+            vdat = ds[v].data[np.asarray(itimes),:]
+            if roi is not None:
+                vdat = vdat[:,roi['points']]
+            if dtype is not None:
+                vdat = vdat.astype(dtype)
+            vlist[v].append(vdat.reshape((len(itimes),)+shape))
+
+    dims  = ('k', 'j', 'i')
+    data_vars = {}
+    for v in varnames:
+        if len(vlist[v]) > 0:
+            vdat = da.concatenate(vlist[v], axis=0).rechunk({0:tchunk})
+        else:
+            vdat = da.zeros((0,)+shape, chunks=(1,)+shape)
+        data_vars[v] = (('time',)+dims, vdat)
+    coords = {'time':np.array(times),
+              'x':(dims, db['x']), 'y':(dims, db['y']), 'z':(dims, db['z'])}
+    lazyds = xr.Dataset(data_vars=data_vars, coords=coords, attrs=attrs)
+    lazyds.attrs['group'] = group
+    if roi is not None:
+        lazyds.attrs['iplanes'] = roi['iplanes']
+    # Closing the lazy dataset closes the files behind it
+    lazyds.set_close(lambda: [ds.close() for ds in opened])
+    return lazyds
+
+def lazyStatsDask(vdat, userlist, stats, extrafuncs, suffix=statsuffix):
+    """
+    Build the lazy reductions for the statistics of the dask arrays in
+    vdat (each with a leading time axis), and return them as a dict
+    keyed like planeStatsAccumulator.todb().
+
+    The central moments are computed from the moments about the first
+    sample, which keeps everything in a single pass over the data while
+    avoiding most of the cancellation of the raw power sums.  The
+    reductions are done in float64, whatever the precision of vdat.
+    """
+    statlist = parseStats(stats)
+    vals = dict(vdat)
+    for f in extrafuncs:
+        vals[f['name']] = f['func'](vdat)
+    vals = {k:x.astype(np.float64) for k, x in vals.items()}
+    shift = {k:x[0] for k, x in vals.items()}
+    dev   = {k:x-shift[k] for k, x in vals.items()}
+    dmean = {k:d.mean(axis=0) for k, d in dev.items()}
+    out = {}
+    for k, d in dev.items():
+        x = vals[k]
+        out[k+suffix['avg']] = shift[k] + dmean[k]
+        e1 = dmean[k]
+        if any([st in statlist for st in ['std', 'skew', 'kurt']]):
+            e2  = (d**2).mean(axis=0)
+            var = da.maximum(e2 - e1**2, 0.0)
+        if 'std' in statlist:
+            out[k+suffix['std']] = da.sqrt(var)
+        if ('skew' in statlist) or ('kurt' in statlist):
+            e3 = (d**3).mean(axis=0)
+            m3 = e3 - 3*e1*e2 + 2*e1**3
+        if 'skew' in statlist:
+            out[k+suffix['m3']]   = m3
+            out[k+suffix['skew']] = m3/var**1.5
+        if 'kurt' in statlist:
+            e4 = (d**4).mean(axis=0)
+            m4 = e4 - 4*e1*e3 + 6*e1**2*e2 - 3*e1**4
+            out[k+suffix['m4']]   = m4
+            out[k+suffix['kurt']] = m4/var**2
+        if 'min' in statlist:
+            out[k+suffix['min']] = x.min(axis=0)
+        if 'max' in statlist:
+            out[k+suffix['max']] = x.max(axis=0)
+    rs     = {}
+    triple = {}
+    if ('rs' in statlist) or ('triple' in statlist):
+        for v1, v2 in itertools.combinations_with_replacement(userlist, 2):
+            name = corr_mapping.get(v1, v1)+corr_mapping.get(v2, v2)
+            rs[name] = (dev[v1]*dev[v2]).mean(axis=0) - dmean[v1]*dmean[v2]
+    if 'rs' in statlist:
+        for name, cov in rs.items():
+            out[name+suffix['rs']] = cov
+    if 'triple' in statlist:
+        e2 = lambda va, vb: (dev[va]*dev[vb]).mean(axis=0)
+        for v1, v2, v3 in itertools.combinations_with_replacement(userlist, 3):
+            name = ''.join([corr_mapping.get(v, v) for v in [v1, v2, v3]])
+            triple[name] = (dev[v1]*dev[v2]*dev[v3]).mean(axis=0) \
+                - dmean[v1]*e2(v2, v3) - dmean[v2]*e2(v1, v3) - dmean[v3]*e2(v1, v2) \
+                + 2*dmean[v1]*dmean[v2]*dmean[v3]
+            out[name+suffix['triple']] = triple[name]
+        tkeFluxes(out, userlist, rs, triple, suffix=suffix)
+    return out
+
+def lazyStatsPlaneXR(ncfileinput, timerange,
+                     stats=['avg'],
+                     extrafuncs=[],
+                     varnames=['velocityx','velocityy','velocityz'],
+                     savepklfile='',
+                     groupname=None, verbose=False, includeattr=False,
+                     replacenan=False, axis_rotation=0, blocksize=None,
+                     scheduler='threads', nprocs=None,
+                     tperiod=None, tstart=None, nphasebins=1,
+                     iplanes=None, i_range=None, j_range=None, dtype=None):
+    """
+    Compute plane statistics (see statsPlaneXR) as lazy dask
+    reductions, evaluated in one pass with the dask scheduler
+    ('threads', 'processes', or 'synchronous') over nprocs workers.
+    Only a few time chunks per worker are held in memory at a time,
+    read in the precision dtype (see openPlaneSetXR).
+
+    If tperiod is given, the statistics are instead computed over the
+    phase samples at tstart + n*tperiod/nphasebins, interpolated in
+    time like phaseAvgPlaneXR (see getPhaseSamples), per phase bin and
+    with the phase suffixes (e.g., velocityx_phavg).  With more than
+    one bin, the results have a leading bin axis.
+    """
+    if scheduler not in daskschedulers:
+        raise ValueError('scheduler %s is not one of %s'%(scheduler, repr(daskschedulers)))
+    userlist = list(varnames)
+    readlist, natlist = splitVarnames(userlist)
+    lazyds = openPlaneSetXR(ncfileinput, groupname=groupname,
+                            varnames=readlist, timerange=timerange,
+                            blocksize=blocksize, iplanes=iplanes,
+                            i_range=i_range, j_range=j_range, dtype=dtype)
+    group = lazyds.attrs['group']
+    with xr.open_dataset(getFileList(ncfileinput)[0], group=group) as ds:
+        db = {}
+        getPlaneHeaderXR(ds, db)
+    for k in ['x', 'y', 'z']:
+        db[k] = lazyds[k].values
+    if 'iplanes' in lazyds.attrs:
+        db['iplanes'] = lazyds.attrs['iplanes']
+    db['group'] = group
+    db['times'] = [float(t) for t in lazyds['time'].values]
+    countIO(nbytes=sum([lazyds[v].nbytes for v in readlist]),
+            ntimes=len(db['times']))
+
+    vdat = {}
+    for v in readlist:
+        vdat[v] = lazyds[v].data
+        if replacenan: vdat[v] = da.nan_to_num(vdat[v])
+    if len(natlist) > 0:
+        R=get_mapping_xyz_to_axis1axis2(db['axis1'],db['axis2'],db['axis3'],rot=axis_rotation)
+        transformVelocity(R, vdat)
+
+    if tperiod is None:
+        lazyout = lazyStatsDask(vdat, userlist, stats, extrafuncs)
+    else:
+        t0   = db['times'][0] if tstart is None else tstart
+        tend = db['times'][-1] if timerange is None else timerange[1]
+        tsamp, ibins, i1, i2, w = getPhaseSamples(db['times'], t0, tend,
+                                                  tperiod, nphasebins=nphasebins)
+        db['times'] = [float(t) for t in tsamp]
+        binout = []
+        for ibin in range(nphasebins):
+            isel = np.where(ibins == ibin)[0]
+            bindat = {}
+            for k, x in vdat.items():
+                wb = w[isel].reshape((-1,)+(1,)*(x.ndim-1))
+                bindat[k] = (1.0-wb)*x[i1[isel]] + wb*x[i2[isel]]
+            binout.append(lazyStatsDask(bindat, userlist, stats, extrafuncs,
+                                        suffix=phasestatsuffix))
+        if nphasebins == 1:
+            lazyout = binout[0]
+        else:
+            lazyout = {k:da.stack([b[k] for b in binout]) for k in binout[0]}
+        db['phasebins'] = t0 + (tperiod/nphasebins)*np.arange(nphasebins)
+
+    if verbose:
+        print("Computing %i statistics over %i times with the %s scheduler"
+              %(len(lazyout), len(db['times']), scheduler))
+    keys = list(lazyout.keys())
+    computekw = {'scheduler':scheduler}
+    if (nprocs is not None) and (scheduler != 'synchronous'):
+        computekw['num_workers'] = nprocs
+    try:
+        results = dask.compute(*[lazyout[k] for k in keys], **computekw)
+    finally:
+        lazyds.close()
+    for k, r in zip(keys, results):
+        db[k] = np.asarray(r)
+
+    # include attributes
+    if includeattr:
+        for k, g in lazyds.attrs.items():
+            if k not in ['group', 'iplanes']: db[k] = g
+    if len(savepklfile)>0:
+        # Write out the picklefile (or result store)
+        saveResultDB(db, savepklfile)
+    return db
+
+def getPhaseSamples(times, tstart, tend, tperiod, nphasebins=1):
+    """
+    Work out the phase sample times tstart + n*tperiod/nphasebins which
+    lie in [tstart, tend] and within times.  Returns the sample times,
+    their phase bins, and the bracketing indices i1, i2 into times and
+    weights w, so that each sample is (1-w)*v[i1] + w*v[i2].
+    """
+    times  = np.asarray(times)
+    eps    = 1.0E-10
+    dphase = tperiod/nphasebins
+    if len(times) < 2:
+        empty = np.array([], dtype=int)
+        return np.array([]), empty, empty, empty, np.array([])
+    tlast  = min(tend, times[-1])
+    nsamp  = max(0, int(np.floor((tlast-tstart)/dphase + eps)) + 1)
+    isamp  = np.arange(nsamp)
+    tsamp  = tstart + dphase*isamp
+    keep   = (times[0]-eps <= tsamp) & (tsamp <= tlast+eps)
+    isamp, tsamp = isamp[keep], tsamp[keep]
+    ibins  = np.mod(isamp, nphasebins)
+    i2     = np.clip(np.searchsorted(times, tsamp), 1, len(times)-1)
+    i1     = i2 - 1
+    w      = np.clip((tsamp-times[i1])/(times[i2]-times[i1]), 0.0, 1.0)
+    return tsamp, ibins, i1, i2, w
+
+def phaseSampleBlocks(ncfilelist, tindex, group, readlist, i1, i2, w,
+                      blocksize=None, replacenan=False, roi=None,
+                      verbose=False):
+    """
+    Yield (isamp, vdat) for blocks of phase samples, where vdat[v] holds
+    the samples isamp interpolated from the timesteps i1, i2 of tindex.
+    The timesteps needed by each block are read in sorted batches, once
+    each, and the interpolation is done for the whole block at once.
+    """
+    nsamp = len(w)
+    if nsamp == 0: return
+    datasets = {}
+    try:
+        ds0 = xr.open_dataset(ncfilelist[tindex.ifile[i1[0]]], group=group)
+        datasets[tindex.ifile[i1[0]]] = ds0
+        nblock = max(1, getBlockSize(ds0, readlist[0], blocksize)//2)
+        for start in range(0, nsamp, nblock):
+            isamp  = np.arange(start, min(start+nblock, nsamp))
+            needed = np.unique(np.concatenate((i1[isamp], i2[isamp])))
+            vread  = {}
+            for ifile, entries in enumerate(tindex.select(needed)):
+                if len(entries) == 0: continue
+                if ifile not in datasets:
+                    datasets[ifile] = xr.open_dataset(ncfilelist[ifile], group=group)
+                ds   = datasets[ifile]
+                ipos = np.searchsorted(needed, [e[0] for e in entries])
+                for v in readlist:
+                    vblock = nonan(extractvarblock(ds, v, [e[1] for e in entries], roi=roi), replacenan)
+                    if v not in vread:
+                        vread[v] = np.empty((len(needed),)+vblock.shape[1:], dtype=vblock.dtype)
+                    vread[v][ipos] = vblock
+            p1 = np.searchsorted(needed, i1[isamp])
+            p2 = np.searchsorted(needed, i2[isamp])
+            wb = w[isamp].reshape((-1,)+(1,)*(vread[readlist[0]].ndim-1))
+            vdat = {}
+            for v in readlist:
+                vdat[v] = (1.0-wb)*vread[v][p1] + wb*vread[v][p2]
+            countIO(ntimes=len(isamp))
+            if verbose: progress(isamp[-1]+1, nsamp)
+            yield isamp, vdat
+    finally:
+        for ds in datasets.values():
+            ds.close()
+    return
+
+def stackPhaseBins(bindbs):
+    """
+    Stack the results of each phase bin along a new leading axis.  Bins
+    without any samples are filled with NaN.
+    """
+    keys = []
+    for bdb in bindbs:
+        keys += [k for k in bdb if k not in keys]
+    db = {}
+    for k in keys:
+        shape = next(bdb[k] for bdb in bindbs if k in bdb).shape
+        db[k] = np.stack([bdb[k] if k in bdb else np.full(shape, np.nan)
+                          for bdb in bindbs])
+    return db
+
+def selectPhaseBin(db, ibin):
+    """
+    Return a view of the phase averaged db with the results of phase
+    bin ibin only (see phaseAvgPlaneXR with nphasebins > 1).  Results
+    without the bin axis, like the time averages, are left as they are.
+    """
+    nphasebins = len(db['phasebins']) if 'phasebins' in db else 1
+    if (ibin < 0) or (ibin >= nphasebins):
+        raise ValueError('phase bin %i is not in [0, %i)'%(ibin, nphasebins))
+    if 'phasebins' not in db:
+        return db
+    suffixes = tuple(set(phasestatsuffix.values()))
+    bindb = {}
+    for k, v in db.items():
+        bindb[k] = v[ibin] if k.endswith(suffixes) else v
+    bindb['phasebin'] = ibin
+    return bindb
+
 def phaseAvgPlaneXR(ncfileinput, tstart, tend, tperiod,
                     extrafuncs=[],
                     varnames=['velocityx','velocityy','velocityz'],
                     savepklfile='',
                     groupname=None, verbose=False, includeattr=False,
-                    replacenan=False,axis_rotation=0):
+                    replacenan=False,axis_rotation=0, stats=['avg'],
+                    nphasebins=1, blocksize=None):
     """
     Compute the phase average of ncfile variables
+
+    stats is a list with any of the statistics in parseStats, computed
+    over the phase samples.  The samples at tstart + n*tperiod are
+    linearly interpolated in time.  With nphasebins > 1, each period is
+    split into that many phase bins, and the results have a leading bin
+    axis (db['phasebins'] gives the start time of each bin).
     """
     # make sure input is a list
     ncfilelist = getFileList(ncfileinput)
     ncfile=ncfilelist[0]
-    suf='_phavg'
-
-    find_nearest = lambda a, a0: np.abs(np.array(a) - a0).argmin()
-
-    #Apply transformation after computing cartesian average
-    natural_velocity_mapping = {
-        'velocitya1': 'velocityx',
-        'velocitya2': 'velocityy',
-        'velocitya3': 'velocityz'
-    }
 
-    transform = False
-    for viter, v in enumerate(varnames):
-        for key, value in natural_velocity_mapping.items():
-            if key in v:
-                varnames[viter] = value
-                transform = True
-                break
+    # Variables to read from the file, and natural plane velocities to
+    # construct from them
+    userlist  = list(varnames)
+    readlist, natlist = splitVarnames(userlist)
+    transform = len(natlist) > 0
+    accs = [planeStatsAccumulator(readlist+natlist, stats=stats,
+                                  extrafuncs=extrafuncs, corrvars=userlist,
+                                  suffix=phasestatsuffix)
+            for ibin in range(nphasebins)]
 
     # Create a fresh db dictionary
     db = {}
-    eps = 1.0E-10
-    tnow = tstart
-    db['times'] = []
     # Now load the ncfile data
     if groupname is None:
         groups= ppsample.getGroups(ppsample.loadDataset(ncfile))
@@ -361,97 +1516,48 @@ def phaseAvgPlaneXR(ncfileinput, tstart, tend, tperiod,
     else:
         group = groupname
     db['group'] = group
-    Ncount = 0
-    for ncfile in ncfilelist:
-        timevec     = ppsample.getVar(ppsample.loadDataset(ncfile), 'time')
-        filtertime  = np.where((tnow <= np.array(timevec)) & (np.array(timevec) <= tend))
-        Ntotal      = len(filtertime[0])
-        if verbose:
-            print("%s %i"%(ncfile, Ntotal))
-            #print("%f %f"%(t1, t2))
-        localNcount = 0
-        with xr.open_dataset(ncfile, group=group) as ds:
-            if 'x' not in ds:
-                reshapeijk = ds.attrs['ijk_dims'][::-1]
-                xm = ds['coordinates'].data[:,0].reshape(tuple(reshapeijk))
-                ym = ds['coordinates'].data[:,1].reshape(tuple(reshapeijk))
-                zm = ds['coordinates'].data[:,2].reshape(tuple(reshapeijk))
-                db['x'] = xm
-                db['y'] = ym
-                db['z'] = zm
-                db['axis1'] = ds.attrs['axis1']
-                db['axis2'] = ds.attrs['axis2']
-                db['axis3'] = ds.attrs['axis3']
-                db['origin'] = ds.attrs['origin']
-                db['offsets'] = ds.attrs['offsets']
-            # Set up the initial mean fields
-            zeroarray = extractvar(ds, varnames[0], 0)
-            for v in varnames:
-                if v+suf not in db:
-                    db[v+suf] = np.full_like(zeroarray, 0.0)
-            if len(extrafuncs)>0:
-                for f in extrafuncs:
-                    if f['name']+suf not in db:
-                        db[f['name']+suf] = np.full_like(zeroarray, 0.0)
-            # Loop through and accumulate
-            while (tnow <= tend) and (tnow <= timevec[-1]):
-                # Find the closest time to tnow
-                i1, i2   = find_2nearest(timevec, tnow)
-                ti1, ti2 = timevec[i1], timevec[i2]
-                #print(tnow, ti1, ti2)
-                #iclosest = find_nearest(timevec, tnow)
-                #tclosest = timevec[iclosest]
-                if verbose: progress(i1, len(timevec))
-
-                # Add to db accumulation
-                db['times'].append(float(tnow))
-                vdat = {}
-                for v in varnames:
-                    v1      = nonan(extractvar(ds, v, i1), replacenan)
-                    v2      = nonan(extractvar(ds, v, i2), replacenan)
-                    vdat[v] = interpfields(ti1, ti2, v1, v2)
-                    #vdat[v] = nonan(extractvar(ds, v, iclosest), replacenan)
-                    db[v+suf] += vdat[v]
-                if len(extrafuncs)>0:
-                    for f in extrafuncs:
-                        name = f['name']+suf
-                        func = f['func']
-                        db[name] += func(vdat)
-                # increment counters
-                Ncount += 1
-                localNcount += 1
-                tnow += tperiod
-            print()  # Done with this file
-
-    # Normalize the result
-    if Ncount > 0:
-        for v in varnames:
-            db[v+suf] /= float(Ncount)
-        if len(extrafuncs)>0:
-            for f in extrafuncs:
-                name = f['name']+suf
-                db[name] /= float(Ncount)
-
+    tindex = ppsample.timeIndex(ncfilelist)
+    tsamp, ibins, i1, i2, w = getPhaseSamples(tindex.times, tstart, tend,
+                                              tperiod, nphasebins=nphasebins)
+    db['times'] = [float(t) for t in tsamp]
+    if verbose:
+        print("%i phase samples in %i bins"%(len(tsamp), nphasebins))
+    with xr.open_dataset(ncfile, group=group) as ds:
+        getPlaneHeaderXR(ds, db)
+        db['axis3'] = ds.attrs['axis3']
+        attrs = dict(ds.attrs)
+    R = None
     if transform:
         R=get_mapping_xyz_to_axis1axis2(db['axis1'],db['axis2'],db['axis3'],rot=axis_rotation)
-        #if not np.array_equal(R,np.eye(R.shape[0])):
-        db['velocitya1'+suf], db['velocitya2'+suf], db['velocitya3'+suf] = apply_coordinate_transform(R,
-                                                                                                      db['velocityx'+suf],
-                                                                                                      db['velocityy'+suf],
-                                                                                                      db['velocityz'+suf])
+
+    # Loop through and accumulate
+    for isamp, vdat in phaseSampleBlocks(ncfilelist, tindex, group, readlist,
+                                         i1, i2, w, blocksize=blocksize,
+                                         replacenan=replacenan,
+                                         verbose=verbose):
+        if transform: transformVelocity(R, vdat)
+        for ibin in np.unique(ibins[isamp]):
+            insamp = ibins[isamp] == ibin
+            accs[ibin].add({k:x[insamp] for k, x in vdat.items()})
+    if verbose: print()
+
+    # Normalize the result
+    if nphasebins == 1:
+        accs[0].todb(db)
+    else:
+        db.update(stackPhaseBins([acc.todb({}) for acc in accs]))
+        db['phasebins'] = tstart + (tperiod/nphasebins)*np.arange(nphasebins)
 
     if verbose:
-        print("Ncount = %i"%Ncount)
+        print("Ncount = %i"%sum([acc.count for acc in accs]))
         print()
     # include attributes
     if includeattr:
-        for k, g in ds.attrs.items():
+        for k, g in attrs.items():
             db[k] = g
     if len(savepklfile)>0:
-        # Write out the picklefile
-        dbfile = open(savepklfile, 'wb')
-        pickle.dump(db, dbfile, protocol=2)
-        dbfile.close()
+        # Write out the picklefile (or result store)
+        saveResultDB(db, savepklfile)
 
     return db
 
@@ -459,7 +1565,7 @@ def phaseAvgPlaneXR(ncfileinput, tstart, tend, tperiod,
 def MinMaxStd_PlaneXR(ncfile, timerange,
                       extrafuncs=[], avgdb = None,
                       varnames=['velocityx','velocityy','velocityz'], savepklfile='',
-                      groupname=None, verbose=False, includeattr=False):
+                      groupname=None, verbose=False, includeattr=False, blocksize=None):
     """
     Calculate the min, max, and standard deviation
     """
@@ -470,18 +1576,21 @@ def MinMaxStd_PlaneXR(ncfile, timerange,
     savg = '_avg'
     db = {}
     if avgdb is None:
-        if verbose: print("Calculating averages")
-        db = avgPlaneXR(ncfile, timerange,
-                        extrafuncs=extrafuncs,
-                        varnames=varnames,
-                        groupname=groupname, verbose=verbose, includeattr=includeattr)
+        # Compute everything in a single pass
+        if verbose: print("Calculating averages and min/max/std")
+        return statsPlaneXR(ncfile, timerange, stats=['avg','std','minmax'],
+                            extrafuncs=extrafuncs,
+                            varnames=varnames, savepklfile=savepklfile,
+                            groupname=groupname, verbose=verbose, includeattr=includeattr,
+                            blocksize=blocksize)
     else:
         db.update(avgdb)
     group = db['group']
-    timevec = ppsample.getVar(ppsample.loadDataset(ncfile), 'time')
+    timevec = ppsample.getFileTimes([ncfile])[0]
     t1 = timerange[0]
     t2 = timerange[1]
-    Ntotal=len(db['times'])
+    itimes = list(np.where((t1 <= timevec) & (timevec <= t2))[0])
+    Ntotal=len(itimes)
     with xr.open_dataset(ncfile, group=group) as ds:
         reshapeijk = ds.attrs['ijk_dims'][::-1]
         zeroarray = extractvar(ds, varnames[0], 0)
@@ -497,38 +1606,24 @@ def MinMaxStd_PlaneXR(ncfile, timerange,
                 db[name+smax] = np.full_like(zeroarray, -bigval)
                 db[name+smin] = np.full_like(zeroarray, bigval)
         Ncount = 0
+        nblock = getBlockSize(ds, varnames[0], blocksize)
         # Loop through and accumulate
         if verbose: print("Calculating min/max/std")
-        for itime, t in enumerate(timevec):
-            if (t1 <= t) and (t <= t2):
-                if verbose: progress(Ncount+1, Ntotal)
-                vdat = {}
-                for v in varnames:
-                    vdat[v] = extractvar(ds, v, itime)        
-                for v in varnames:
-                    # Change max vals
-                    filtermax = vdat[v] > db[v+smax]
-                    db[v+smax][filtermax] = vdat[v][filtermax]
-                    # Change min vals
-                    filtermin = vdat[v] < db[v+smin]
-                    db[v+smin][filtermin] = vdat[v][filtermin]
-                    # Standard dev
-                    db[v+sstd] += (vdat[v]-db[v+savg])*(vdat[v]-db[v+savg])
-                if len(extrafuncs)>0:
-                    for f in extrafuncs:
-                        name = f['name']
-                        func = f['func']
-                        vinst= func(vdat)
-                        vavg = db[name+savg]
-                        # Change max vals
-                        filtermax = vinst > db[name+smax]
-                        db[name+smax][filtermax] = vinst[filtermax]
-                        # Change min vals
-                        filtermin = vinst < db[name+smin]
-                        db[name+smin][filtermin] = vinst[filtermin]
-                        # Standard dev
-                        db[name+sstd] += (vinst-vavg)*(vinst-vavg)
-                Ncount += 1
+        for iblock in splitBlocks(itimes, nblock):
+            vdat = {}
+            for v in varnames:
+                vdat[v] = extractvarblock(ds, v, iblock)
+            countIO(ntimes=len(iblock))
+            vinst = dict(vdat)
+            for f in extrafuncs:
+                vinst[f['name']] = f['func'](vdat)
+            for name in vinst:
+                db[name+smax] = np.maximum(db[name+smax], vinst[name].max(axis=0))
+                db[name+smin] = np.minimum(db[name+smin], vinst[name].min(axis=0))
+                # Standard dev
+                db[name+sstd] += ((vinst[name]-db[name+savg])**2).sum(axis=0)
+            Ncount += len(iblock)
+            if verbose: progress(Ncount, Ntotal)
         # Normalize and sqrt std dev
         if Ncount > 0:
             for v in varnames:
@@ -539,38 +1634,26 @@ def MinMaxStd_PlaneXR(ncfile, timerange,
                     db[name+sstd] = np.sqrt(db[name+sstd]/float(Ncount))
         if verbose: print()
         if len(savepklfile)>0:
-            # Write out the picklefile
-            dbfile = open(savepklfile, 'wb')
-            pickle.dump(db, dbfile, protocol=2)
-            dbfile.close()        
+            # Write out the picklefile (or result store)
+            saveResultDB(db, savepklfile)
     return db
 
 
 def ReynoldsStress_PlaneXR(ncfileinput, timerange,
                            extrafuncs=[], avgdb = None,
                            varnames=['velocityx','velocityy','velocityz'],
-                           savepklfile='', groupname=None, verbose=False, includeattr=False,axis_rotation=0):
+                           savepklfile='', groupname=None, verbose=False, includeattr=False,axis_rotation=0,
+                           blocksize=None):
     """
     Calculate the reynolds stresses
     """
     ncfilelist = getFileList(ncfileinput)
-
-    print('first ncfilelist ',ncfilelist)
     ncfile=ncfilelist[0]
     eps     = 1.0E-10
     t1      = timerange[0]-eps
     t2      = timerange[1]    
     savg = '_avg'
 
-    corr_mapping = {
-        'velocityx': 'u',
-        'velocityy': 'v',
-        'velocityz': 'w',
-        'velocitya1': 'ua1',
-        'velocitya2': 'ua2',
-        'velocitya3': 'ua3'
-    }
-
     combinations = itertools.combinations_with_replacement(varnames, 2)
 
     corrlist = [
@@ -580,22 +1663,27 @@ def ReynoldsStress_PlaneXR(ncfileinput, timerange,
 
     db = {}
     if avgdb is None:
-        if verbose: print("Calculating averages")
-
-        orig_varnames = varnames[:]
-        db = avgPlaneXR(ncfilelist, timerange,
-                        extrafuncs=extrafuncs,
-                        varnames=orig_varnames,
-                        groupname=groupname, verbose=verbose, includeattr=includeattr,axis_rotation=axis_rotation)
+        # Compute the averages and stresses in a single pass
+        if verbose: print("Calculating averages and reynolds-stress")
+        return statsPlaneXR(ncfilelist, timerange, stats=['avg','rs'],
+                            extrafuncs=extrafuncs,
+                            varnames=varnames, savepklfile=savepklfile,
+                            groupname=groupname, verbose=verbose, includeattr=includeattr,
+                            axis_rotation=axis_rotation, blocksize=blocksize)
     else:
         db.update(avgdb)
+        # Start the stresses from zero, even if avgdb already has them
+        for corr in corrlist:
+            db.pop(corr[0], None)
 
     group   = db['group']
     Ncount = 0    
-    for ncfile in ncfilelist:
-        timevec     = ppsample.getVar(ppsample.loadDataset(ncfile), 'time')
-        filtertime  = np.where((t1 <= np.array(timevec)) & (np.array(timevec) <= t2))
-        Ntotal      = len(filtertime[0])
+    tindex     = ppsample.timeIndex(ncfilelist)
+    fileitimes = tindex.filter(t1, t2)
+    for ncfileiter, ncfile in enumerate(ncfilelist):
+        timevec     = tindex.filetimes[ncfileiter]
+        itimes      = fileitimes[ncfileiter]
+        Ntotal      = len(itimes)
         if verbose:
             print("%s %i"%(ncfile, Ntotal))
         localNcount = 0
@@ -610,25 +1698,25 @@ def ReynoldsStress_PlaneXR(ncfileinput, timerange,
 
             if any('velocitya' in v for v in varnames):
                 R=get_mapping_xyz_to_axis1axis2(db['axis1'],db['axis2'],db['axis3'],rot=axis_rotation)
+            nblock = getBlockSize(ds, 'velocityx', blocksize)
             # Loop through and accumulate
             if verbose: print("Calculating reynolds-stress")
-            for itime, t in enumerate(timevec):
-                if (t1 < t) and (t <= t2):
-                    t1 = t
-                    if verbose: progress(localNcount+1, Ntotal)
-                    vdat = {}
-                    for v in ['velocityx','velocityy','velocityz']:
-                        vdat[v] = extractvar(ds, v, itime)        
-                    if any('velocitya' in v for v in varnames):
-                        vdat['velocitya1'],vdat['velocitya2'],vdat['velocitya3'] = apply_coordinate_transform(R,vdat['velocityx'],vdat['velocityy'],vdat['velocityz'])
-                    for corr in corrlist:
-                        name = corr[0]
-                        v1   = corr[1]
-                        v2   = corr[2]
-                        # Standard dev
-                        db[name] += (vdat[v1]-db[v1+savg])*(vdat[v2]-db[v2+savg])
-                    Ncount += 1
-                    localNcount += 1
+            for iblock in splitBlocks(itimes, nblock):
+                vdat = {}
+                for v in ['velocityx','velocityy','velocityz']:
+                    vdat[v] = extractvarblock(ds, v, iblock)
+                countIO(ntimes=len(iblock))
+                if any('velocitya' in v for v in varnames):
+                    transformVelocity(R, vdat)
+                for corr in corrlist:
+                    name = corr[0]
+                    v1   = corr[1]
+                    v2   = corr[2]
+                    # Standard dev
+                    db[name] += ((vdat[v1]-db[v1+savg])*(vdat[v2]-db[v2+savg])).sum(axis=0)
+                Ncount += len(iblock)
+                localNcount += len(iblock)
+                if verbose: progress(localNcount, Ntotal)
             print()  # Done with this file
     # Normalize and sqrt std dev
     if Ncount > 0:
@@ -637,20 +1725,22 @@ def ReynoldsStress_PlaneXR(ncfileinput, timerange,
             db[name] = db[name]/float(Ncount)
     if verbose: print()
     if len(savepklfile)>0:
-        # Write out the picklefile
-        dbfile = open(savepklfile, 'wb')
-        pickle.dump(db, dbfile, protocol=2)
-        dbfile.close()
+        # Write out the picklefile (or result store)
+        saveResultDB(db, savepklfile)
     return db
 
 def phaseAvgReynoldsStress1_PlaneXR(ncfileinput, tstart, tend, tperiod,
                                     extrafuncs=[], avgdb = None,
                                     varnames=['velocityx','velocityy','velocityz'], replacenan=False,
-                                    savepklfile='', groupname=None, verbose=False, includeattr=False,axis_rotation=0):
+                                    savepklfile='', groupname=None, verbose=False, includeattr=False,axis_rotation=0,
+                                    nphasebins=1, blocksize=None):
     """
     Calculate the phase-averaged reynolds stresses
     
     Computes < (u_i - \overline{u_i})*(u_j - \overline{u_j}) >
+
+    The phase samples are taken as in phaseAvgPlaneXR, including the
+    nphasebins option.
     """
     ncfilelist = getFileList(ncfileinput)
     ncfile=ncfilelist[0]
@@ -658,15 +1748,6 @@ def phaseAvgReynoldsStress1_PlaneXR(ncfileinput, tstart, tend, tperiod,
     tavg = '_avg'
     pavg = '_phavg'
 
-    corr_mapping = {
-        'velocityx': 'u',
-        'velocityy': 'v',
-        'velocityz': 'w',
-        'velocitya1': 'ua1',
-        'velocitya2': 'ua2',
-        'velocitya3': 'ua3'
-    }
-
     combinations = itertools.combinations_with_replacement(varnames, 2)
 
     corrlist = [
@@ -687,69 +1768,40 @@ def phaseAvgReynoldsStress1_PlaneXR(ncfileinput, tstart, tend, tperiod,
         db.update(avgdb)
 
     group   = db['group']
-    Ncount = 0
-    tnow = tstart
-    for ncfile in ncfilelist:
-        timevec     = ppsample.getVar(ppsample.loadDataset(ncfile), 'time')
-        filtertime  = np.where((tnow <= np.array(timevec)) & (np.array(timevec) <= tend))
-        Ntotal      = len(filtertime[0])
-        if verbose:
-            print("%s %i"%(ncfile, Ntotal))
-            #print("%f %f"%(t1, t2))
-        localNcount = 0
-        with xr.open_dataset(ncfile, group=group) as ds:
-            reshapeijk = ds.attrs['ijk_dims'][::-1]
-            zeroarray = extractvar(ds, 'velocityx', 0)
-            # Set up the initial mean fields
-            for corr in corrlist:
-                suff = corr[0]
-                if suff not in db:
-                    db[suff] =  np.full_like(zeroarray, 0.0)
-            if any('velocitya' in v for v in varnames):
-                R=get_mapping_xyz_to_axis1axis2(db['axis1'],db['axis2'],db['axis3'],rot=axis_rotation)
-            # Loop through and accumulate
-            #if verbose: print("Calculating reynolds-stress")
-            while (tnow <= tend) and (tnow <= timevec[-1]):
-                # Find the closest time to tnow
-                i1, i2   = find_2nearest(timevec, tnow)
-                ti1, ti2 = timevec[i1], timevec[i2]
-                #print(tnow, ti1, ti2)
-                #iclosest = find_nearest(timevec, tnow)
-                #tclosest = timevec[iclosest]
-                if verbose: progress(i1, len(timevec))
-
-                # Add to db accumulation
-                db['times'].append(float(tnow))
-                vdat = {}
-                for v in varnames:
-                    v1      = nonan(extractvar(ds, v, i1), replacenan)
-                    v2      = nonan(extractvar(ds, v, i2), replacenan)
-                    vdat[v] = interpfields(ti1, ti2, v1, v2)
-                    if any('velocitya' in v for v in varnames):
-                        vdat['velocitya1'],vdat['velocitya2'],vdat['velocitya3'] = apply_coordinate_transform(R,vdat['velocityx'],vdat['velocityy'],vdat['velocityz'])
-                for corr in corrlist:
-                    name = corr[0]
-                    v1   = corr[1]
-                    v2   = corr[2]
-                    # Standard dev
-                    db[name] += (vdat[v1]-db[v1+tavg])*(vdat[v2]-db[v2+tavg])
-                # increment counters
-                Ncount += 1
-                localNcount += 1
-                tnow += tperiod
-            print()  # Done with this file
+    readlist, natlist = splitVarnames(varnames)
+    R = None
+    if len(natlist) > 0:
+        R=get_mapping_xyz_to_axis1axis2(db['axis1'],db['axis2'],db['axis3'],rot=axis_rotation)
+    tindex = ppsample.timeIndex(ncfilelist)
+    tsamp, ibins, i1, i2, w = getPhaseSamples(tindex.times, tstart, tend,
+                                              tperiod, nphasebins=nphasebins)
+    db['times'] = list(db.get('times', [])) + [float(t) for t in tsamp]
+    # Loop through and accumulate
+    Ncount = np.zeros(nphasebins)
+    corrsum = {}
+    for isamp, vdat in phaseSampleBlocks(ncfilelist, tindex, group, readlist,
+                                         i1, i2, w, blocksize=blocksize,
+                                         replacenan=replacenan,
+                                         verbose=verbose):
+        if R is not None: transformVelocity(R, vdat)
+        for name, v1, v2 in corrlist:
+            prod = (vdat[v1]-db[v1+tavg])*(vdat[v2]-db[v2+tavg])
+            if name not in corrsum:
+                corrsum[name] = np.zeros((nphasebins,)+prod.shape[1:])
+            for ibin in np.unique(ibins[isamp]):
+                corrsum[name][ibin] += prod[ibins[isamp] == ibin].sum(axis=0)
+        Ncount += np.bincount(ibins[isamp], minlength=nphasebins)
 
     # Normalize 
-    if Ncount > 0:
-        for corr in corrlist:
-            name = corr[0]
-            db[name] = db[name]/float(Ncount)
+    for name, v1, v2 in corrlist:
+        if name not in corrsum: continue
+        with np.errstate(invalid='ignore', divide='ignore'):
+            corrsum[name] /= Ncount.reshape((-1,)+(1,)*(corrsum[name].ndim-1))
+        db[name] = corrsum[name][0] if nphasebins == 1 else corrsum[name]
     if verbose: print()
     if len(savepklfile)>0:
-        # Write out the picklefile
-        dbfile = open(savepklfile, 'wb')
-        pickle.dump(db, dbfile, protocol=2)
-        dbfile.close()
+        # Write out the picklefile (or result store)
+        saveResultDB(db, savepklfile)
     return db
 
 def getLineXR(ncfile, itimevec, varnames, groupname=None,
@@ -760,7 +1812,7 @@ def getLineXR(ncfile, itimevec, varnames, groupname=None,
     db['timesteps'] = []
     timevec = None
     if gettimes:
-        timevec = ppsample.getVar(ppsample.loadDataset(ncfile), 'time')
+        timevec = ppsample.getFileTimes([ncfile])[0]
         db['times'] = []
     # Now load the ncfile data
     if groupname is None:
@@ -797,11 +1849,21 @@ def getLineXR(ncfile, itimevec, varnames, groupname=None,
     return db
 
 def avgLineXR(ncfileinput, timerange, varnames, extrafuncs=[], groupname=None,
-              verbose=0, includeattr=False, gettimes=False):
+              verbose=0, includeattr=False, gettimes=False,
+              stats=['avg'], blocksize=None):
+    """
+    Compute statistics of line sampler variables over timerange
+
+    stats is a list with any of 'avg', 'rs', 'std', 'min', 'max',
+    'skew', 'kurt', 'triple', 'minmax', or 'moments' (see parseStats),
+    all computed in the same pass.  The timesteps are read blocksize at
+    a time (default: chunk aligned, see getBlockSize) and reduced with
+    planeStatsAccumulator.
+    """
     # make sure input is a list
     ncfilelist = getFileList(ncfileinput)
     ncfile=ncfilelist[0]
-    suf='_avg'
+    acc = planeStatsAccumulator(varnames, stats=stats, extrafuncs=extrafuncs)
 
     # Create a fresh db dictionary
     db = {}
@@ -817,79 +1879,62 @@ def avgLineXR(ncfileinput, timerange, varnames, extrafuncs=[], groupname=None,
     else:
         group = groupname
     db['group'] = group
-    Ncount = 0
-    for ncfile in ncfilelist:
-        timevec     = ppsample.getVar(ppsample.loadDataset(ncfile), 'time')
-        filtertime  = np.where((t1 <= np.array(timevec)) & (np.array(timevec) <= t2))
-        Ntotal      = len(filtertime[0])
+    tindex     = ppsample.timeIndex(ncfilelist)
+    fileitimes = tindex.filter(t1, t2)
+    attrs = {}
+    for ncfileiter, ncfile in enumerate(ncfilelist):
+        itimes = fileitimes[ncfileiter]
+        Ntotal = len(itimes)
         if verbose:
             print("%s %i"%(ncfile, Ntotal))
-        localNcount = 0
         with xr.open_dataset(ncfile, group=group) as ds:
-            if 'x' not in ds:
-                xm = ds['coordinates'].data[:,0]
-                ym = ds['coordinates'].data[:,1]
-                zm = ds['coordinates'].data[:,2]
-                dtime=xr.open_dataset(ncfile)
-                dtime.close()
-                db['x'] = xm
-                db['y'] = ym
-                db['z'] = zm
-            # Set up the initial mean fields
-            zeroarray = np.zeros(len(ds.num_points))
-            for v in varnames:
-                if v+suf not in db:
-                    db[v+suf] = np.full_like(zeroarray, 0.0)
-            if len(extrafuncs)>0:
-                for f in extrafuncs:
-                    if f['name']+suf not in db:
-                        db[f['name']+suf] = np.full_like(zeroarray, 0.0)
-            # Loop through and accumulate
-            for itime, t in enumerate(timevec):
-                if (t1 < t) and (t <= t2):
-                    t1 = t
-                    if verbose: progress(localNcount+1, Ntotal)
-                    if gettimes: db['times'].append(float(t))
-                    vdat = {}
-                    for v in varnames:
-                        vdat[v] = ds[v][itime,:]
-                        db[v+suf] += vdat[v]
-                    if len(extrafuncs)>0:
-                        for f in extrafuncs:
-                            name = f['name']+suf
-                            func = f['func']
-                            db[name] += func(vdat)
-                    Ncount += 1
-                    localNcount += 1
-            print()  # Done with this file
+            if 'x' not in db:
+                db['x'] = ds['coordinates'].data[:,0]
+                db['y'] = ds['coordinates'].data[:,1]
+                db['z'] = ds['coordinates'].data[:,2]
+                attrs   = dict(ds.attrs)
+            if Ntotal == 0: continue
+            nblock = getBlockSize(ds, varnames[0], blocksize)
+            localNcount = 0
+            for iblock in splitBlocks(itimes, nblock):
+                if iblock[-1]-iblock[0]+1 == len(iblock):
+                    tsel = slice(iblock[0], iblock[-1]+1)
+                else:
+                    tsel = np.asarray(iblock)
+                vdat = {}
+                for v in varnames:
+                    vdat[v] = ds[v][tsel,:].values
+                    countIO(nbytes=vdat[v].nbytes)
+                acc.add(vdat)
+                countIO(ntimes=len(iblock))
+                localNcount += len(iblock)
+                if verbose: progress(localNcount, Ntotal)
+            if gettimes:
+                timevec = tindex.filetimes[ncfileiter]
+                db['times'] += [float(timevec[i]) for i in itimes]
+        print()  # Done with this file
     # Normalize the result
-    if Ncount > 0:
-        for v in varnames:
-            db[v+suf] /= float(Ncount)
-        if len(extrafuncs)>0:
-            for f in extrafuncs:
-                name = f['name']+suf
-                db[name] /= float(Ncount)
+    acc.todb(db)
     if verbose:
-        print("Ncount = %i"%Ncount)
+        print("Ncount = %i"%acc.count)
         print()
     # include attributes
     if includeattr:
-        for k, g in ds.attrs.items():
+        for k, g in attrs.items():
             db[k] = g
     return db
 
-def getFullPlaneXR(ncfile, num_time_steps,output_dt, groupname,ordering=["x","z","y"]):
-    """
-    Read all planes in netcdf file
-
-    Modified from openfast-toolbox
+# Variables and coordinate descriptions in the full plane datasets
+fullplanecoords = {"x":(0,"axial","velocityx"),
+                   "y":(1,"lateral","velocityy"),
+                   "z":(2,"vertical","velocityz")}
 
+def getFullPlaneCoords(ds, output_dt):
+    """
+    Coordinates of the full plane dataset
     """
-    ds = xr.open_dataset(ncfile,group=groupname)    
-    coordinates = {"x":(0,"axial"), "y":(1,"lateral"),"z":(2,"vertical")}
-    c           = {}
-    for coordinate,(i,desc) in coordinates.items():
+    c = {}
+    for coordinate,(i,desc,u) in fullplanecoords.items():
         c[coordinate] = xr.IndexVariable( 
                                             dims=[coordinate],
                                             data=np.sort(np.unique(ds['coordinates'].isel(ndim=i))), 
@@ -897,23 +1942,451 @@ def getFullPlaneXR(ncfile, num_time_steps,output_dt, groupname,ordering=["x","z"
                                         )
     c["times"] = xr.IndexVariable( 
                                 dims=["times"],
-                                data=ds.num_time_steps*output_dt,
+                                data=ds.num_time_steps.values*output_dt,
                                 attrs={"description":"time from start of simulation","units":"s"}
                              )    
+    return c
 
-    nt = len(c["times"])
-    nx = len(c["x"])
-    ny = len(c["y"])
-    nz = len(c["z"])
-    coordinates = {"x":(0,"axial","velocityx"), "y":(1,"lateral","velocityy"),"z":(2,"vertical","velocityz")}    
-    v           = {}    
-    for coordinate,(i,desc,u) in coordinates.items():        
-        v[u] = xr.DataArray(np.reshape(getattr(ds,"velocity{0}".format(coordinate)).values,(nt,nx,nz,ny)), 
+def makeFullPlaneDataset(vdat, c, ordering):
+    """
+    Build the full plane Dataset from the (nt, npts) arrays in vdat
+    (numpy or dask) and the coordinates c
+    """
+    shape = (len(c["times"]), len(c["x"]), len(c["z"]), len(c["y"]))
+    v     = {}    
+    for coordinate,(i,desc,u) in fullplanecoords.items():        
+        v[u] = xr.DataArray(vdat[u].reshape(shape), 
                                 coords=c, 
                                 dims=["times",ordering[0],ordering[1],ordering[2]],
                                 name="{0} velocity".format(desc), 
                                 attrs={"description":"velocity along {0}".format(coordinate),"units":"m/s"})
+    return xr.Dataset(data_vars=v, coords=v[u].coords)           
 
-    ds = xr.Dataset(data_vars=v, coords=v[u].coords)           
-    
-    return ds 
+def checkFullPlaneMemory(ds, ntimes, max_memory, what='the full plane'):
+    """
+    Raise a MemoryError if ntimes timesteps of the three velocity
+    components would take more than max_memory bytes
+    """
+    stepbytes = sum([ds[u].shape[1]*ds[u].dtype.itemsize for i,desc,u in fullplanecoords.values()])
+    if (max_memory is not None) and (ntimes*stepbytes > max_memory):
+        raise MemoryError('Reading %s needs %.3g GB, over max_memory=%.3g GB. Read it in smaller blocks with chunks or iterFullPlaneXR'
+                          %(what, ntimes*stepbytes/1024.0**3, max_memory/1024.0**3))
+    return stepbytes
+
+def getFullPlaneXR(ncfile, num_time_steps,output_dt, groupname,ordering=["x","z","y"],
+                   chunks=None, max_memory=None):
+    """
+    Read all planes in netcdf file
+
+    Modified from openfast-toolbox
+
+    By default everything is read into memory, after checking that it
+    fits in max_memory bytes (if given).  With chunks (a number of
+    timesteps, or 'auto' to follow the file chunks, see getBlockSize),
+    a lazy dask-backed Dataset chunked along times is returned instead,
+    and max_memory is checked against the size of one chunk.  The file
+    stays open for as long as the lazy Dataset is used.
+    """
+    if chunks is None:
+        with xr.open_dataset(ncfile,group=groupname) as ds:
+            nt = ds.sizes['num_time_steps']
+            checkFullPlaneMemory(ds, nt, max_memory)
+            c  = getFullPlaneCoords(ds, output_dt)
+            vdat = {u:ds[u].values for i,desc,u in fullplanecoords.values()}
+        countIO(nbytes=sum([x.nbytes for x in vdat.values()]), ntimes=nt)
+        return makeFullPlaneDataset(vdat, c, ordering)
+
+    if not usedask:
+        print("Error: dask package required for chunked reads")
+        sys.exit()
+    with xr.open_dataset(ncfile,group=groupname) as ds:
+        nchunk = getBlockSize(ds, 'velocityx', None if chunks == 'auto' else chunks)
+        checkFullPlaneMemory(ds, nchunk, max_memory, what='one chunk')
+    ds = xr.open_dataset(ncfile,group=groupname,chunks={'num_time_steps':nchunk})
+    c  = getFullPlaneCoords(ds, output_dt)
+    vdat = {u:ds[u].data for i,desc,u in fullplanecoords.values()}
+    return makeFullPlaneDataset(vdat, c, ordering)
+
+def iterFullPlaneXR(ncfile, output_dt, groupname, ordering=["x","z","y"],
+                    blocksize=None, max_memory=None):
+    """
+    Read all planes in netcdf file in blocks of timesteps, yielding one
+    in-memory Dataset (like getFullPlaneXR) per block.  The block size
+    defaults to the file chunks (see getBlockSize), and is reduced so
+    that each block fits in max_memory bytes.
+    """
+    with xr.open_dataset(ncfile,group=groupname) as ds:
+        nt        = ds.sizes['num_time_steps']
+        stepbytes = checkFullPlaneMemory(ds, 1, max_memory, what='one timestep')
+        nblock    = getBlockSize(ds, 'velocityx', blocksize)
+        if max_memory is not None:
+            nblock = max(1, min(nblock, int(max_memory//stepbytes)))
+        call = getFullPlaneCoords(ds, output_dt)
+        for iblock in splitBlocks(list(range(nt)), nblock):
+            tsel = slice(iblock[0], iblock[-1]+1)
+            c    = dict(call)
+            c["times"] = call["times"][tsel]
+            vdat = {u:ds[u][tsel,:].values for i,desc,u in fullplanecoords.values()}
+            countIO(nbytes=sum([x.nbytes for x in vdat.values()]), ntimes=len(iblock))
+            yield makeFullPlaneDataset(vdat, c, ordering)
+
+# ----------------------------------------------------------------------
+# Result store
+# ----------------------------------------------------------------------
+
+# File extensions which are saved as NetCDF result stores, everything
+# else is pickled
+resultstoreext = ['.nc', '.nc4', '.h5', '.hdf5']
+
+def isResultStore(filename):
+    """
+    True if filename is (or will be written as) a NetCDF result store
+    """
+    return os.path.splitext(filename)[1].lower() in resultstoreext
+
+def storeName(key, used):
+    """
+    Make a unique NetCDF variable name from the key path
+    """
+    name = ''.join([c if (c.isalnum() or c in '_.-') else '_' for c in key])
+    if (len(name) == 0) or (not name[0].isalpha()): name = 'v_'+name
+    base, i = name, 1
+    while name in used:
+        name = '%s_%i'%(base, i)
+        i += 1
+    used.add(name)
+    return name
+
+def jsonValue(x):
+    """
+    Convert x to something json can store, or return None if it can't
+    """
+    if (x is None) or isinstance(x, (bool, int, float, str)):
+        return x
+    if isinstance(x, np.generic) and not np.iscomplexobj(x):
+        return x.item()
+    if isinstance(x, (list, tuple)):
+        vals = [jsonValue(v) for v in x]
+        return vals if all([(v is not None) or (y is None) for v, y in zip(vals, x)]) else None
+    return None
+
+def encodeResult(x, key, variables, used):
+    """
+    Encode x for the result store.  Arrays are added to variables, and
+    the returned schema describes how to rebuild x from them.
+    """
+    def addarray(arr, name):
+        dims = tuple([storeName('%s_dim%i'%(name, i), used) for i in range(arr.ndim)])
+        variables[name] = xr.Variable(dims, arr)
+    if isinstance(x, dict):
+        items = list(x.items())
+        arrays = [v for k, v in items if isinstance(v, np.ndarray)]
+        # Same shape real arrays (e.g. snapshots keyed by time index)
+        # are stacked into one variable, so they can be read one at a
+        # time
+        if (len(items) > 1) and (len(arrays) == len(items)) and \
+           all([(a.shape == arrays[0].shape) and (a.dtype == arrays[0].dtype) for a in arrays]) and \
+           (arrays[0].dtype.kind in 'iuf') and \
+           all([jsonValue(k) is not None for k, v in items]):
+            name = storeName(key, used)
+            addarray(np.stack(arrays), name)
+            return {'t':'stack', 'v':name, 'keys':[jsonValue(k) for k, v in items],
+                    'ktypes':[type(k).__name__ for k, v in items]}
+        entries = []
+        for k, v in items:
+            if jsonValue(k) is None:
+                raise ValueError('Cannot store the key %s in %s'%(repr(k), key))
+            entries.append([jsonValue(k), type(k).__name__,
+                            encodeResult(v, key+'.'+str(k), variables, used)])
+        return {'t':'dict', 'items':entries}
+    if isinstance(x, np.ndarray) or (isinstance(x, np.generic) and not isinstance(x, np.str_)):
+        arr = np.asarray(x)
+        t   = 'array' if isinstance(x, np.ndarray) else 'scalar'
+        if arr.dtype.kind == 'c':
+            re, im = storeName(key+'.re', used), storeName(key+'.im', used)
+            addarray(arr.real, re)
+            addarray(arr.imag, im)
+            return {'t':t, 'v':[re, im], 'complex':True}
+        if arr.dtype.kind == 'b':
+            name = storeName(key, used)
+            addarray(arr.astype(np.int8), name)
+            return {'t':t, 'v':name, 'bool':True}
+        if arr.dtype.kind in 'iuf':
+            name = storeName(key, used)
+            addarray(arr, name)
+            return {'t':t, 'v':name}
+        if jsonValue(arr.tolist()) is not None:
+            return {'t':'json', 'v':arr.tolist(), 'array':True}
+    if isinstance(x, list) and (len(x) > 0) and \
+       all([isinstance(v, (int, float)) and not isinstance(v, bool) for v in x]):
+        # Long lists of numbers (e.g. the times) are kept as arrays
+        name = storeName(key, used)
+        addarray(np.asarray(x), name)
+        return {'t':'list', 'v':name}
+    if jsonValue(x) is not None or x is None:
+        return {'t':'json', 'v':jsonValue(x), 'tuple':isinstance(x, tuple)}
+    raise ValueError('Cannot store %s of type %s'%(key, type(x).__name__))
+
+def saveResultDB(db, filename):
+    """
+    Save the dict db to filename.  Names ending in .nc (see
+    resultstoreext) are written as a NetCDF result store, with each
+    array as a named variable and the layout of db as an attribute, so
+    that loadResultDB can read them back one array (or slice) at a
+    time.  Anything else is pickled as before.
+    """
+    if not isResultStore(filename):
+        with open(filename, 'wb') as dbfile:
+            pickle.dump(db, dbfile, protocol=2)
+        return
+    variables = {}
+    used      = set()
+    schema    = []
+    for k, v in db.items():
+        if jsonValue(k) is None:
+            raise ValueError('Cannot store the key %s'%repr(k))
+        schema.append([jsonValue(k), type(k).__name__,
+                       encodeResult(v, str(k), variables, used)])
+    ds = xr.Dataset(variables)
+    ds.attrs['ppresultschema'] = json.dumps(schema)
+    ds.to_netcdf(filename)
+    ds.close()
+    return
+
+def castKey(k, ktype):
+    return tuple(k) if ktype == 'tuple' else k
+
+class stackedResult(collections.abc.Mapping):
+    """
+    Read-only dict of same shape arrays stored as one variable, which
+    reads each entry only when it is accessed
+    """
+    def __init__(self, var, keys):
+        self.var  = var
+        self.keys_ = keys
+        self.index = {k:i for i, k in enumerate(keys)}
+
+    def __getitem__(self, k):
+        return self.var[self.index[k]].values
+
+    def __iter__(self):
+        return iter(self.keys_)
+
+    def __len__(self):
+        return len(self.keys_)
+
+class resultDB(collections.abc.MutableMapping):
+    """
+    Dict-like view of a result file from loadResultDB
+
+    Entries are read and decoded on first access and then kept.  Use
+    getslice(key, index) to read part of an array entry, e.g.
+    db.getslice('velocityx_avg', 2) reads only one plane, and ndim(key)
+    to check an entry without reading it.
+    """
+    def __init__(self, filename=None, db=None):
+        self.filename = filename
+        self.cache    = {} if db is None else dict(db)
+        self.schema   = {}
+        self.order    = list(self.cache.keys())
+        self.ds       = None
+        if filename is not None:
+            self.ds = xr.open_dataset(filename)
+            for k, ktype, s in json.loads(self.ds.attrs['ppresultschema']):
+                self.schema[castKey(k, ktype)] = s
+                self.order.append(castKey(k, ktype))
+
+    def decode(self, s):
+        t = s['t']
+        if t == 'json':
+            v = s['v']
+            if s.get('array', False): return np.array(v)
+            return tuple(v) if s.get('tuple', False) else v
+        if t == 'list':
+            return self.ds[s['v']].values.tolist()
+        if t == 'stack':
+            keys = [castKey(k, kt) for k, kt in zip(s['keys'], s['ktypes'])]
+            return stackedResult(self.ds[s['v']], keys)
+        if t == 'dict':
+            return {castKey(k, kt):self.decode(v) for k, kt, v in s['items']}
+        if s.get('complex', False):
+            x = self.ds[s['v'][0]].values + 1j*self.ds[s['v'][1]].values
+        else:
+            x = self.ds[s['v']].values
+            if s.get('bool', False): x = x.astype(bool)
+        return x[()] if t == 'scalar' else x
+
+    def getslice(self, key, index):
+        """
+        Read x[index] for the array entry x = db[key], without reading
+        the rest of it if it has not been read already
+        """
+        if (key not in self.cache) and (key not in self.schema):
+            raise KeyError(key)
+        s = self.schema.get(key, None)
+        if (key in self.cache) or (s['t'] != 'array'):
+            return np.asarray(self[key])[index]
+        if s.get('complex', False):
+            return self.ds[s['v'][0]][index].values + 1j*self.ds[s['v'][1]][index].values
+        x = self.ds[s['v']][index].values
+        return x.astype(bool) if s.get('bool', False) else x
+
+    def ndim(self, key):
+        """
+        Number of dimensions of an entry, without reading it
+        """
+        if key in self.cache:
+            return np.ndim(self.cache[key])
+        s = self.schema[key]
+        if s['t'] in ['array', 'scalar']:
+            v = s['v'][0] if s.get('complex', False) else s['v']
+            return self.ds[v].ndim
+        if s['t'] == 'list':
+            return 1
+        return np.ndim(s['v']) if s['t'] == 'json' else 0
+
+    def __getitem__(self, key):
+        if key not in self.cache:
+            if key not in self.schema: raise KeyError(key)
+            self.cache[key] = self.decode(self.schema[key])
+        return self.cache[key]
+
+    def __setitem__(self, key, value):
+        if (key not in self.cache) and (key not in self.schema):
+            self.order.append(key)
+        self.cache[key] = value
+
+    def __delitem__(self, key):
+        if (key not in self.cache) and (key not in self.schema):
+            raise KeyError(key)
+        self.cache.pop(key, None)
+        self.schema.pop(key, None)
+        self.order.remove(key)
+
+    def __iter__(self):
+        return iter(list(self.order))
+
+    def __len__(self):
+        return len(self.order)
+
+    def todict(self):
+        """
+        Read everything into a plain dict
+        """
+        def readall(v):
+            if isinstance(v, stackedResult):
+                return dict(v)
+            if isinstance(v, dict):
+                return {k:readall(x) for k, x in v.items()}
+            return v
+        return {k:readall(self[k]) for k in self}
+
+    def close(self):
+        if self.ds is not None: self.ds.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+def resultNdim(db, key):
+    """
+    Number of dimensions of db[key], without reading it if db is a
+    resultDB
+    """
+    return db.ndim(key) if isinstance(db, resultDB) else np.ndim(db[key])
+
+def loadResultDB(filename, lazy=True):
+    """
+    Load a result saved with saveResultDB (or any pickled dict)
+
+    A NetCDF result store is returned as a resultDB, which only reads
+    the entries as they are used, unless lazy=False in which case
+    everything is read into a plain dict.  Pickle files are always read
+    whole into whatever was pickled.
+
+    A filename like @task.name loads the result published under that
+    name earlier in the same driver run instead (see publishResult).
+    """
+    if isPublishedRef(filename):
+        return getPublishedResult(filename)
+    if not isResultStore(filename):
+        with open(filename, 'rb') as dbfile:
+            db = pickle.load(dbfile)
+        return db
+    db = resultDB(filename)
+    if lazy:
+        return db
+    with db:
+        out = db.todict()
+    return out
+
+# ----------------------------------------------------------------------
+# Published results
+# ----------------------------------------------------------------------
+# Results published by the tasks in a driver run, keyed by task.name
+publishedresults = {}
+
+# The task.name of the results which later tasks refer to.  Only these
+# are kept, so nothing is held in memory unless it is used.
+wantedresults = set()
+
+def setPublishedResults(wanted=[]):
+    """
+    Start keeping the results named in wanted (like avgplanes.myplane),
+    dropping anything published before.  With no names, publishing is
+    turned off.
+    """
+    global wantedresults
+    publishedresults.clear()
+    wantedresults = set(wanted)
+    return
+
+def isPublishedRef(filename):
+    """
+    True if filename is a reference like @task.name to a published
+    result
+    """
+    return isinstance(filename, str) and filename.startswith('@')
+
+def publishResult(task, name, db):
+    """
+    Make db available to the later tasks in the same driver run as
+    @task.name, if any of them refer to it
+    """
+    key = '%s.%s'%(task, name)
+    if key not in wantedresults:
+        return
+    if isinstance(db, resultDB):
+        with db:
+            db = db.todict()
+    publishedresults[key] = dict(db)
+    return
+
+def readonlyResult(db):
+    """
+    Shallow copy of db where the arrays are read-only views, so tasks
+    can add or replace entries without changing the published result
+    """
+    out = {}
+    for k, v in db.items():
+        if isinstance(v, np.ndarray):
+            v = v.view()
+            v.flags.writeable = False
+        elif isinstance(v, dict):
+            v = readonlyResult(v)
+        out[k] = v
+    return out
+
+def getPublishedResult(ref):
+    """
+    Return the result published as ref (@task.name).  Nothing is
+    copied, the arrays are read-only views of the published ones.
+    """
+    key = ref[1:]
+    if key not in publishedresults:
+        print("Error: no result published as %s"%ref)
+        print("Published results are: "+repr(['@'+k for k in publishedresults]))
+        raise KeyError(ref)
+    return readonlyResult(publishedresults[key])
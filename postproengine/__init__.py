@@ -3,15 +3,20 @@ import os
 import traceback
 import copy
 import io
-import matplotlib.pyplot as plt
-from mpl_toolkits.axes_grid1 import make_axes_locatable
 from collections import OrderedDict
+import collections.abc
 import numpy as np
 import pickle
-import pandas as pd
 import re
-from scipy.interpolate import RegularGridInterpolator
-import plotfunctions
+import glob
+import fnmatch
+import json
+import hashlib
+import shutil
+import time
+import functools
+import contextlib
+import inspect
 
 scriptpath = os.path.dirname(os.path.realpath(__file__))
 
@@ -35,8 +40,153 @@ validateinputs/
 |-- ...
 """
 
+class pluginRegistry(collections.abc.MutableMapping):
+    """
+    The registered plugins, keyed by task name.  Plugins found by
+    scanPlugins are listed without being imported, and their module is
+    only loaded the first time the plugin is used.
+    """
+    def __init__(self):
+        self.plugins = OrderedDict()  # Loaded plugins
+        self.paths   = OrderedDict()  # Files of the plugins not loaded yet
+        self.order   = []             # Task names in registration order
+        self.unnamed = []             # Files with plugins of unknown name
+        return
+
+    def addpaths(self, paths, unnamed=[]):
+        """
+        Add the name -> file entries found by scanPlugins
+        """
+        for name, path in paths.items():
+            if name in self.plugins: continue
+            self.paths[name] = path
+            if name not in self.order: self.order.append(name)
+        self.unnamed += list(unnamed)
+        return
+
+    def loadfile(self, path):
+        """
+        Import the plugin file path, which registers its plugins
+        """
+        for name in [k for k, p in self.paths.items() if p == path]:
+            self.paths.pop(name)
+        try:
+            load_module(path)
+        except Exception:
+            traceback.print_exc()
+        # Drop any plugins which failed to register
+        self.order = [k for k in self.order if (k in self.plugins) or (k in self.paths)]
+        return
+
+    def loadall(self):
+        """
+        Import every plugin file not loaded yet
+        """
+        for path in list(OrderedDict.fromkeys(list(self.paths.values())+self.unnamed)):
+            self.loadfile(path)
+        self.unnamed = []
+        return
+
+    def __getitem__(self, name):
+        if (name not in self.plugins) and (name in self.paths):
+            self.loadfile(self.paths[name])
+        if (name not in self.plugins) and (len(self.unnamed) > 0):
+            for path in self.unnamed: self.loadfile(path)
+            self.unnamed = []
+        return self.plugins[name]
+
+    def __setitem__(self, name, f):
+        self.plugins[name] = f
+        self.paths.pop(name, None)
+        if name not in self.order: self.order.append(name)
+        return
+
+    def __delitem__(self, name):
+        self.plugins.pop(name, None)
+        self.paths.pop(name, None)
+        self.order.remove(name)
+        return
+
+    def __contains__(self, name):
+        return (name in self.plugins) or (name in self.paths)
+
+    def __iter__(self):
+        return iter(list(self.order))
+
+    def __len__(self):
+        return len(self.order)
+
+def scanPlugins(dirpath):
+    """
+    Find the plugins in the .py files of dirpath without importing
+    them, from the classes decorated with @registerplugin and their
+    name attribute.  Returns an OrderedDict of task name -> file, and
+    the list of files with plugins whose name is not a plain string.
+
+    The plugins are listed in the order importing every file would
+    register them: files in name order, but the plugins of another
+    file in dirpath which a file imports (e.g., spod from
+    instantaneousplanes) come before its own.
+    """
+    import ast
+    found   = OrderedDict()   # file -> (plugin names, imported plugin files)
+    unnamed = []
+    for fname in sorted(os.listdir(dirpath)):
+        # Scan only "real modules"
+        if fname.startswith('.') or fname.startswith('__') or \
+           (not fname.endswith('.py')):
+            continue
+        path = os.path.join(dirpath, fname)
+        try:
+            with open(path, 'r') as f:
+                tree = ast.parse(f.read(), filename=path)
+        except (OSError, SyntaxError, ValueError):
+            traceback.print_exc()
+            continue
+        names   = []
+        imports = []
+        for node in ast.walk(tree):
+            if isinstance(node, ast.ImportFrom) and (node.module == 'postproengine'):
+                imports += [a.name for a in node.names]
+            elif isinstance(node, ast.ImportFrom) and (node.module or '').startswith('postproengine.'):
+                imports.append(node.module.split('.')[1])
+            elif isinstance(node, ast.Import):
+                imports += [a.name.split('.')[1] for a in node.names
+                            if a.name.startswith('postproengine.')]
+        for node in tree.body:
+            if not isinstance(node, ast.ClassDef): continue
+            decorators = [getattr(d, 'id', getattr(d, 'attr', None)) for d in node.decorator_list]
+            if 'registerplugin' not in decorators: continue
+            name = None
+            for item in node.body:
+                if isinstance(item, ast.Assign) and \
+                   any([getattr(t, 'id', None) == 'name' for t in item.targets]):
+                    try:
+                        name = ast.literal_eval(item.value)
+                    except ValueError:
+                        name = None
+            if isinstance(name, str):
+                names.append(name)
+            elif path not in unnamed:
+                unnamed.append(path)
+        deps = [os.path.join(dirpath, m+'.py') for m in imports]
+        found[path] = (names, [d for d in deps if d != path])
+    paths = OrderedDict()
+    def addfile(path, visited):
+        if (path in visited) or (path not in found): return
+        visited.add(path)
+        names, deps = found[path]
+        for dep in deps:
+            addfile(dep, visited)
+        for name in names:
+            paths[name] = path
+    visited = set()
+    for path in found:
+        addfile(path, visited)
+    return paths, unnamed
+
 # The list of all plugins is kept and built here
-pluginlist = OrderedDict()
+pluginlist = pluginRegistry()
 def registerplugin(f):
     """
     Register all the plugins to pluginlist
@@ -90,6 +240,7 @@ The following workflows are available:
 
 """
     f.write(header)
+    if hasattr(plist, 'loadall'): plist.loadall()
     looptasks = sorted(plist.keys())
     for task in looptasks:
         executormd = task+'.md'
@@ -155,6 +306,7 @@ def makedocs(rootpath=scriptpath, docdir='doc', docformat='markdown'):
     with open(os.path.join(docpath, 'README.md'), 'w') as f:
         print_readme(f)
 
+    pluginlist.loadall()
     looptasks = sorted(pluginlist.keys())
     for task in looptasks:
         mdfile = os.path.join(docpath, pluginlist[task].name+'.md')
@@ -167,6 +319,8 @@ def print_inputs(subset=[], plist=pluginlist):
     """
     Prints out the inputs required for every plugin
     """
+    if (len(subset) == 0) and hasattr(plist, 'loadall'):
+        plist.loadall()
     if len(subset)>0:
         looptasks = subset
     else:
@@ -316,9 +470,11 @@ def compute_axis1axis2_coords(db,rot=0):
         offsets = [offsets]
 
     # Create the iplane matrices
+    # (db['iplanes'] is set when only some of the planes were read)
+    iplanes   = db['iplanes'] if 'iplanes' in db else range(len(offsets))
     iplanemat = np.full_like(db['x'], 0, dtype=np.int64)
-    for k in range(len(offsets)):
-        iplanemat[k,:,:] = k
+    for k, iplane in enumerate(iplanes):
+        iplanemat[k,:,:] = iplane
 
     # create list of points
     xyz_pt    = np.vstack([db['x'].ravel(), db['y'].ravel(), db['z'].ravel()])
@@ -353,9 +509,11 @@ def compute_axis1axis2axis3_coords(db,rot=0):
         offsets = [offsets]
 
     # Create the iplane matrices
+    # (db['iplanes'] is set when only some of the planes were read)
+    iplanes   = db['iplanes'] if 'iplanes' in db else range(len(offsets))
     iplanemat = np.full_like(db['x'], 0, dtype=np.int64)
-    for k in range(len(offsets)):
-        iplanemat[k,:,:] = k
+    for k, iplane in enumerate(iplanes):
+        iplanemat[k,:,:] = iplane
 
     # create list of points
     xyz_pt    = np.vstack([db['x'].ravel(), db['y'].ravel(), db['z'].ravel()])
@@ -427,6 +585,7 @@ def interp_db_pts(db, ptlist, iplanelist, varnames, pt_coords='XYZ', timeindex=N
                     dbvar = db[var][iplane,:,:]
                 else:
                     dbvar = db[var][tindex][iplane,:,:]
+                from scipy.interpolate import RegularGridInterpolator
                 interpfunc = RegularGridInterpolator(interpcoords, dbvar, method=method)
                 #Add to the interpdat
                 interpdat[var] = np.append(interpdat[var], interpfunc(ptswap))
@@ -574,6 +733,7 @@ class circavgtemplate():
         return
 
     def execute(self):
+        import pandas as pd
         print('Executing '+self.actionname)
         # Get inputs
         centerpoint_in  = self.actiondict['centerpoint']
@@ -700,6 +860,7 @@ class interpolatetemplate():
         return
 
     def execute(self):
+        import pandas as pd
         print('Executing '+self.actionname)
         for iaction, actiondict in enumerate(self.actiondictlist):
             pointlocfunc      = actiondict['pointlocationfunction']
@@ -801,6 +962,9 @@ class contourplottemplate():
         return
 
     def execute(self):
+        import matplotlib.pyplot as plt
+        from mpl_toolkits.axes_grid1 import make_axes_locatable
+        import plotfunctions
         print('Executing '+self.actionname)
         for iaction, actiondict in enumerate(self.actiondictlist):
             figsize  = actiondict['figsize']
@@ -846,9 +1010,8 @@ class contourplottemplate():
                     fig, ax = plt.subplots(1,1,figsize=(figsize[0],figsize[1]), dpi=dpi)
                 plotq = plotfunc(self.plotdb)
                 if subtractpkl != '':
-                    pfile          = open(subtractpkl, 'rb')
-                    subtractdb         = pickle.load(pfile)
-                    pfile.close()
+                    import postproamrwindsample_xarray as ppsamplexr
+                    subtractdb         = ppsamplexr.loadResultDB(subtractpkl)
                     
                     subtract_plotq = plotfunc(subtractdb)
                     plotq -= subtract_plotq
@@ -955,6 +1118,7 @@ class doubleintegraltemplate():
         return
 
     def execute(self):
+        import pandas as pd
         print('Executing '+self.actionname)
         # Get inputs
         intfunc = eval(self.actiondict['intfunc'])
@@ -1027,18 +1191,90 @@ class doubleintegraltemplate():
 def runtaskdict(taskdict, plist, looptasks, verbose):
     for task in looptasks:
         if task in taskdict:
-            taskitem = plist[task](taskdict[task], verbose=verbose)
-            taskitem.execute(verbose=verbose)
+            executetask(plist[task], taskdict[task], verbose)
+    return
+
+def executetask(taskclass, inputs, verbose):
+    """
+    Create and execute a task, measuring it if profiling is on
+    """
+    if activeprofiler is None:
+        taskitem = taskclass(inputs, verbose=verbose)
+        taskitem.execute(verbose=verbose)
+        return
+    activeprofiler.wrapactions({taskclass.name:taskclass})
+    inputlist = inputs if isinstance(inputs, list) else [inputs]
+    names     = [e.get('name', '') for e in inputlist if isinstance(e, dict)]
+    with activeprofiler.measure(taskclass.name, ', '.join([str(n) for n in names])):
+        taskitem = taskclass(inputs, verbose=verbose)
+        taskitem.execute(verbose=verbose)
     return
     
-def driver(yamldict, plist=pluginlist, verbose=None):
+# Default byte budget of the snapshot cache used during a driver run
+snapshotcachedefault = '1GB'
+
+def driver(yamldict, plist=pluginlist, verbose=None, profile=None, cprofile=None,
+           plan=False):
     """
     Run through and execute all tasks
+
+    Plane snapshots read by one task are kept in a snapshot cache (see
+    postproamrwindsample_xarray.setPlaneCache) and reused by later
+    tasks.  Its size is set by the snapshotcache global attribute
+    (e.g., '4GB', or 0 to turn it off).  The cache is not shared
+    between the worker processes of the scheduler, so with nprocs > 1
+    each worker gets snapshotcache/nprocs.
+
+    With the nprocs global attribute > 1, each entry of each task is
+    run in a pool of nprocs processes as soon as the tasks it depends
+    on are done (see getTaskDependencies).
+
+    With the resultcache global attribute set to a directory, entries
+    whose inputs have not changed since an earlier run are not run
+    again, and their output files are restored from the cache (see
+    getResultCacheKeys).
+
+    With profile (or the profile global attribute) set to True or to a
+    file prefix, the wall time, CPU time, peak RSS, bytes read and
+    timesteps processed by every task and action are written to
+    <prefix>.json and <prefix>.csv (default prefix: ppprofile).  With
+    cprofile, a cProfile dump of each task is saved as well.
+
+    Results referred to as @task.name by later tasks (e.g., meanpklfile:
+    '@avgplanes.myplane') are handed over in memory, without a round
+    trip through a pickle file (see getPublishedRefs).
+
+    With the cases global attribute, the whole workflow is run once for
+    every case, see runbatch.
+
+    With plan=True, nothing is run.  Instead the timesteps, bytes read
+    and peak memory of every entry of every task are estimated from the
+    metadata of the sampling files and printed (see planUnits).  With
+    the memorybudget global attribute (e.g., '16GB'), entries which read
+    in blocks are given a blocksize which fits in the budget, the run
+    stops before starting anything if any other entry does not fit, and
+    the scheduler only runs entries at the same time if their peaks add
+    up to less than the budget.  The snapshot cache counts against the
+    budget (by default it takes at most a quarter of it).
+
+    With the follow global attribute, the workflow is run again every
+    time the sampling files grow, see runfollow.
     """
+    import postproamrwindsample_xarray as ppsamplexr
     looptasks = plist.keys()
 
     # Get the global attributes
     globattr = yamldict['globalattributes'] if 'globalattributes' in yamldict else {}
+
+    # Run the same workflow over a list of cases
+    if ('cases' in globattr) and plan:
+        for case in getCaseList(globattr['cases']):
+            print("--- %s ---"%case)
+            driver(getCaseDict(yamldict, case), plist=plist, verbose=verbose, plan=True)
+        return
+    if 'cases' in globattr:
+        return runbatch(yamldict, plist=plist, verbose=verbose,
+                        profile=profile, cprofile=cprofile)
     
     # Set the verbosity
     # Take verbosity from globalattributes
@@ -1054,7 +1290,77 @@ def driver(yamldict, plist=pluginlist, verbose=None):
             mod = load_module(module)
             sys.modules[name] = mod
 
-            
+    nprocs   = globattr['nprocs'] if 'nprocs' in globattr else 1
+    cachedir = globattr['resultcache'] if 'resultcache' in globattr else None
+
+    # Size of the snapshot cache, and how much of the memory budget is
+    # left for the tasks
+    cachesize = globattr['snapshotcache'] if 'snapshotcache' in globattr else snapshotcachedefault
+    cachesize = ppsamplexr.parseBytes(cachesize)
+    budget = ppsamplexr.parseBytes(globattr['memorybudget']) if 'memorybudget' in globattr else None
+    if budget is not None:
+        if 'snapshotcache' not in globattr:
+            cachesize = min(cachesize, budget//4)
+        if cachesize >= budget:
+            raise RuntimeError('snapshotcache %s does not fit in memorybudget %s'%
+                               (formatBytes(cachesize), formatBytes(budget)))
+        budget -= cachesize
+
+    # Estimate the memory needed by each unit of work
+    peaks  = None
+    if plan or (budget is not None):
+        units = getTaskUnits(yamldict, globattr, plist, looptasks)
+        plans = planUnits(units, plist)
+        refused = fitMemoryBudget(units, plans, budget) if budget is not None else []
+        if plan:
+            printPlan(units, plans, budget=budget, nprocs=nprocs, cachesize=cachesize)
+            return
+        if len(refused) > 0:
+            printPlan(units, plans, budget=budget, nprocs=nprocs, cachesize=cachesize)
+            raise RuntimeError('Tasks do not fit in memorybudget: %s'%
+                               ', '.join([unitName(units[i]) for i in refused]))
+        peaks = [p['peakbytes'] for p in plans]
+
+    # Set up the profiler
+    global activeprofiler
+    profile  = profile if profile is not None else globattr.get('profile', False)
+    cprofile = cprofile if cprofile is not None else globattr.get('cprofile', False)
+    if profile or cprofile:
+        prefix = profile if isinstance(profile, str) else profiledefault
+        activeprofiler = taskProfiler(prefix=prefix, cprofile=cprofile)
+
+    # Set up the snapshot cache shared by the tasks in this run.  Every
+    # worker process of the scheduler has its own, so they split it.
+    workers = nprocs if (nprocs > 1) and not globattr.get('follow', False) else 1
+    ppsamplexr.setPlaneCache(cachesize//workers)
+    # Only keep the results which are referred to
+    ppsamplexr.setPublishedResults([r[1:] for r in getPublishedRefs(yamldict)])
+    try:
+        if globattr.get('follow', False):
+            runfollow(yamldict, globattr, plist, looptasks, verbosity)
+        elif (nprocs > 1) or (cachedir is not None):
+            units = getTaskUnits(yamldict, globattr, plist, looptasks)
+            deps  = getTaskDependencies(units)
+            runscheduled(units, deps, plist, nprocs, verbosity,
+                         cachedir=cachedir, peaks=peaks, budget=budget)
+        else:
+            runexecuteorder(yamldict, globattr, plist, looptasks, verbosity)
+    finally:
+        cache = ppsamplexr.planecache
+        if verbosity and (cache is not None):
+            print("Snapshot cache: %i hits, %i misses"%(cache.hits, cache.misses))
+        ppsamplexr.setPlaneCache(None)
+        ppsamplexr.setPublishedResults()
+        if activeprofiler is not None:
+            activeprofiler.unwrapactions()
+            activeprofiler.report()
+            activeprofiler = None
+    return
+
+def runexecuteorder(yamldict, globattr, plist, looptasks, verbosity):
+    """
+    Run the tasks in yamldict, following executeorder if it is given
+    """
     # Check if executeorder is present
     if 'executeorder' in globattr:
         exeorder = globattr['executeorder']
@@ -1062,8 +1368,7 @@ def driver(yamldict, plist=pluginlist, verbose=None):
             if isinstance(item, str):
                 if item in plist.keys():
                     # item is the exact name of an executor, run it:
-                    taskitem = plist[item](yamldict[item], verbose=verbosity)
-                    taskitem.execute(verbose=verbosity)
+                    executetask(plist[item], yamldict[item], verbosity)
                 else:
                     # item is an entire workflow, run that
                     runtaskdict(yamldict[item], plist, looptasks, verbosity)
@@ -1078,6 +1383,1215 @@ def driver(yamldict, plist=pluginlist, verbose=None):
     return
 
 
+# ------------------------------------------------------------------
+# Follow mode
+# ------------------------------------------------------------------
+# Seconds between checks of the sampling files with follow: True
+followdefault = 60
+
+def getFollowFiles(entry):
+    """
+    Size and modification time of the sampling files (ncfile, which
+    may be glob patterns) of a unit of work
+    """
+    ncfile = entry.get('ncfile', None) if isinstance(entry, dict) else None
+    return getInputFiles({'ncfile':ncfile}) if ncfile else []
+
+def setFollowInputs(units, plist, checkpointsteps=None):
+    """
+    Turn on resume (and checkpointsteps) for every entry whose task
+    has them, unless the entry sets them itself.  Returns the units
+    which have to be computed again from the start when their files
+    change.
+    """
+    recompute = []
+    for i, (task, entry) in enumerate(units):
+        keys = [d['key'] for d in plist[task].inputdefs]
+        if 'resume' not in keys:
+            if 'ncfile' in keys: recompute.append(i)
+            continue
+        entry.setdefault('resume', True)
+        if checkpointsteps and ('checkpointsteps' in keys):
+            entry.setdefault('checkpointsteps', checkpointsteps)
+    return recompute
+
+def runfollow(yamldict, globattr, plist, looptasks, verbosity):
+    """
+    Keep running the workflow as the sampling files grow
+
+    Every follow seconds (the follow global attribute, or followdefault
+    if it is True), the size and modification time of the sampling
+    files of each unit of work (see getTaskUnits) are checked.  The
+    units whose files changed, and the units which depend on them, are
+    run again.  Tasks with a resume input (like avgplanes,
+    reynoldsstress, wake_meander, and wavenumber_spectra) have it
+    turned on, so they only read the new timesteps and save their
+    running state (every checkpointsteps timesteps as well, if set).
+
+    A unit which fails (e.g., while a file is being written) is tried
+    again once its files change.  Stops after followtimeout seconds
+    without new data (whether or not some units failed), or with
+    Ctrl-C.
+    """
+    interval = followdefault if globattr['follow'] is True else float(globattr['follow'])
+    timeout  = globattr.get('followtimeout', None)
+    units    = getTaskUnits(yamldict, globattr, plist, looptasks)
+    deps     = getTaskDependencies(units)
+    recompute = setFollowInputs(units, plist, globattr.get('checkpointsteps', None))
+    if len(recompute) > 0:
+        print("Note: %s will be computed from the start each time their files change"%
+              ', '.join([unitName(units[i]) for i in recompute]))
+    if ('nprocs' in globattr) or ('resultcache' in globattr):
+        print("Note: nprocs and resultcache are not used when following files")
+    seen       = [None for u in units]
+    # The file states each unit was last run on (successfully or not)
+    tried      = [None for u in units]
+    lastchange = time.time()
+    ncycle     = 0
+    try:
+        while True:
+            states = [getFollowFiles(entry) for task, entry in units]
+            if states != seen:
+                seen, lastchange = states, time.time()
+            rerun = set()
+            for i in range(len(units)):
+                if (states[i] != tried[i]) or (len(deps[i] & rerun) > 0):
+                    rerun.add(i)
+            if len(rerun) > 0:
+                ncycle += 1
+                print("Update %i at %s: %s"%(ncycle, time.strftime('%Y-%m-%d %H:%M:%S'),
+                                             ', '.join([unitName(units[i]) for i in sorted(rerun)])))
+                failed = set()
+                for i in sorted(rerun):
+                    task, entry = units[i]
+                    tried[i] = states[i]
+                    if len(deps[i] & failed) > 0:
+                        print("Skipping %s, a task it depends on failed"%unitName(units[i]))
+                        failed.add(i)
+                        continue
+                    try:
+                        executetask(plist[task], [entry], verbosity)
+                    except (Exception, SystemExit):
+                        print("Error in %s, trying again when its files change:"%unitName(units[i]))
+                        print(traceback.format_exc())
+                        failed.add(i)
+            if (timeout is not None) and (time.time() - lastchange > float(timeout)):
+                print("No new data for %g s, done following"%float(timeout))
+                break
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        print("Stopped following after %i updates"%ncycle)
+    return
+
+
+# ------------------------------------------------------------------
+# Batch runs over cases
+# ------------------------------------------------------------------
+# Global attributes which control a batch run
+batchdefaults = {'cases':[], 'caseprocs':1, 'caselogdir':'pplogs',
+                 'caseretries':0}
+
+def getCaseList(cases):
+    """
+    Expand a list of cases, where each item is a glob pattern (e.g.,
+    sweep/case_*) or a text file listing one case per line
+    """
+    caselist = []
+    for item in ([cases] if isinstance(cases, str) else cases):
+        item = str(item)
+        if os.path.isfile(item):
+            with open(item, 'r') as f:
+                lines = [l.strip() for l in f]
+            caselist += [l for l in lines if l and not l.startswith('#')]
+            continue
+        matches = sorted(glob.glob(item)) if glob.has_magic(item) else [item]
+        if len(matches) == 0:
+            print("Warning: no cases match %s"%item)
+        caselist += matches
+    return caselist
+
+def getCaseLabel(case):
+    """
+    Name of the log file for a case
+    """
+    label = re.sub(r'[^A-Za-z0-9_.-]+', '_', os.path.normpath(case)).strip('_.')
+    return label if label else 'case'
+
+def substituteCase(item, case):
+    """
+    Replace {case} (the case as given) and {casename} (its last path
+    component) in all strings of a nested dict/list
+    """
+    if isinstance(item, str):
+        casename = os.path.basename(os.path.normpath(case))
+        return item.replace('{case}', case).replace('{casename}', casename)
+    elif isinstance(item, dict):
+        return {k:substituteCase(g, case) for k, g in item.items()}
+    elif isinstance(item, (list, tuple)):
+        return [substituteCase(g, case) for g in item]
+    return item
+
+def getCaseDict(yamldict, case):
+    """
+    The input for one case: yamldict with the batch attributes removed
+    and {case} filled in
+    """
+    casedict = substituteCase(yamldict, case)
+    globattr = dict(casedict.get('globalattributes', {}))
+    for k in batchdefaults:
+        globattr.pop(k, None)
+    casedict['globalattributes'] = globattr
+    return casedict
+
+def runcase(casedict, logfile, verbose, profile, cprofile):
+    """
+    Run the driver on one case with all output going to logfile.
+    Stops with exit code 1 if the case failed.
+    """
+    with open(logfile, 'a') as log:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os.dup2(log.fileno(), 1)
+        os.dup2(log.fileno(), 2)
+        try:
+            driver(casedict, verbose=verbose, profile=profile, cprofile=cprofile)
+        except (Exception, SystemExit):
+            # Some tasks stop with sys.exit() on bad inputs
+            traceback.print_exc()
+            sys.stdout.flush()
+            sys.stderr.flush()
+            sys.exit(1)
+        sys.stdout.flush()
+        sys.stderr.flush()
+    return
+
+def runcaseinline(casedict, logfile, verbose, profile, cprofile):
+    """
+    Run one case in this process, returns True if it worked
+    """
+    with open(logfile, 'a') as log:
+        with contextlib.redirect_stdout(log), contextlib.redirect_stderr(log):
+            try:
+                driver(casedict, verbose=verbose, profile=profile, cprofile=cprofile)
+            except (Exception, SystemExit):
+                traceback.print_exc()
+                return False
+    return True
+
+def runbatch(yamldict, plist=pluginlist, verbose=None, profile=None, cprofile=None):
+    """
+    Run the workflow in yamldict once for every case in the cases
+    global attribute (see getCaseList), with {case} and {casename}
+    replaced in all inputs.
+
+    The cases are run in caseprocs processes at a time, each writing
+    to <caselogdir>/<case>.log, and failed cases are tried again up to
+    caseretries more times.  The state of every case is kept in
+    <caselogdir>/batchstatus.json, so running the batch again only
+    runs the cases which failed (or whose inputs changed).  A summary
+    table is printed at the end.
+    """
+    import multiprocessing
+    import multiprocessing.connection
+    globattr = yamldict['globalattributes'] if 'globalattributes' in yamldict else {}
+    opts     = {k:globattr.get(k, v) for k, v in batchdefaults.items()}
+    cases    = getCaseList(opts['cases'])
+    logdir   = opts['caselogdir']
+    nprocs   = max(1, int(opts['caseprocs']))
+    retries  = int(opts['caseretries'])
+    if len(cases) == 0:
+        print("Error: no cases to run")
+        sys.exit(1)
+    os.makedirs(logdir, exist_ok=True)
+
+    # Load the state of the earlier runs
+    statusfile = os.path.join(logdir, 'batchstatus.json')
+    status = {}
+    if os.path.isfile(statusfile):
+        with open(statusfile, 'r') as f:
+            status = json.load(f)
+    def savestatus():
+        with open(statusfile+'.tmp', 'w') as f:
+            json.dump(status, f, indent=1)
+        os.replace(statusfile+'.tmp', statusfile)
+
+    casedicts = {}
+    pending   = []
+    labels    = {}
+    for case in cases:
+        casedicts[case] = getCaseDict(yamldict, case)
+        labels[case]    = getCaseLabel(case)
+        if labels[case] in [labels[c] for c in labels if c != case]:
+            labels[case] += '_%i'%len(labels)
+        key  = hashItem(casedicts[case])
+        prev = status.get(case, {})
+        if (prev.get('status', None) == 'done') and (prev.get('key', None) == key):
+            print("Skipping case %s, finished in an earlier run"%case)
+            continue
+        status[case] = {'status':'pending', 'attempts':0, 'wall_s':0.0,
+                        'log':os.path.join(logdir, labels[case]+'.log'),
+                        'key':key}
+        # Start a fresh log
+        with open(status[case]['log'], 'w') as f:
+            pass
+        pending.append(case)
+    savestatus()
+
+    def finish(case, ok, wall):
+        s = status[case]
+        s['wall_s'] += wall
+        if ok:
+            s['status'] = 'done'
+            print("Finished case %s (%.1f s)"%(case, wall))
+        elif s['attempts'] <= retries:
+            s['status'] = 'retrying'
+            print("Case %s failed, trying again, see %s"%(case, s['log']))
+            pending.append(case)
+        else:
+            s['status'] = 'failed'
+            print("Case %s failed, see %s"%(case, s['log']))
+        savestatus()
+
+    def start(case):
+        s = status[case]
+        s['attempts'] += 1
+        if s['attempts'] > 1:
+            with open(s['log'], 'a') as f:
+                f.write('\n# Attempt %i\n'%s['attempts'])
+        if verbose: print("Starting case %s"%case)
+        return time.perf_counter()
+
+    try:
+        ctx = multiprocessing.get_context('fork')
+    except ValueError:
+        print("Warning: fork not available, running cases one at a time")
+        ctx = None
+    if ctx is None:
+        while len(pending) > 0:
+            case = pending.pop(0)
+            t0 = start(case)
+            ok = runcaseinline(casedicts[case], status[case]['log'], verbose, profile, cprofile)
+            finish(case, ok, time.perf_counter() - t0)
+    else:
+        # Each case runs in a fresh process, so nothing is left over
+        # from the cases before it
+        running = {}
+        while len(pending) > 0 or len(running) > 0:
+            while len(pending) > 0 and len(running) < nprocs:
+                case = pending.pop(0)
+                t0   = start(case)
+                proc = ctx.Process(target=runcase,
+                                   args=(casedicts[case], status[case]['log'],
+                                         verbose, profile, cprofile))
+                proc.start()
+                running[proc.sentinel] = (proc, case, t0)
+            ready = multiprocessing.connection.wait(list(running.keys()))
+            for sentinel in ready:
+                proc, case, t0 = running.pop(sentinel)
+                proc.join()
+                finish(case, proc.exitcode == 0, time.perf_counter() - t0)
+
+    printBatchSummary(cases, status)
+    failed = [c for c in cases if status[c]['status'] != 'done']
+    if len(failed) > 0:
+        raise RuntimeError('Cases failed: %s'%', '.join(failed))
+    return status
+
+def printBatchSummary(cases, status):
+    """
+    Print a table with the state of every case
+    """
+    width = max([len('case')]+[len(c) for c in cases])
+    fmt   = '%-'+repr(width)+'s %-8s %8s %10s  %s'
+    print(fmt%('case', 'status', 'attempts', 'time (s)', 'log'))
+    for case in cases:
+        s = status[case]
+        print(fmt%(case, s['status'], s['attempts'], '%.1f'%s['wall_s'], s['log']))
+    ndone = len([c for c in cases if status[c]['status'] == 'done'])
+    print("%i of %i cases done"%(ndone, len(cases)))
+    return
+
+# ------------------------------------------------------------------
+# Parallel task scheduler
+# ------------------------------------------------------------------
+# The units of work being run by the scheduler.  This is set before
+# the pool is forked, so the tasks (which may hold user functions) do
+# not have to be pickled.
+scheduledjob = {}
+
+def getTaskUnits(yamldict, globattr, plist, looptasks):
+    """
+    List the units of work as (taskname, entry) pairs, one for each
+    entry of each task, in the order the serial driver runs them
+    """
+    units = []
+    def addtasks(taskdict, tasklist):
+        for task in tasklist:
+            if task in taskdict:
+                inputs = taskdict[task]
+                for entry in (inputs if isinstance(inputs, list) else [inputs]):
+                    units.append((task, entry))
+    if 'executeorder' in globattr:
+        for item in globattr['executeorder']:
+            if isinstance(item, str):
+                if item in plist.keys():
+                    addtasks(yamldict, [item])
+                else:
+                    addtasks(yamldict[item], looptasks)
+            else:
+                wflowname = next(iter(item))
+                addtasks(yamldict[wflowname], item[wflowname])
+    else:
+        addtasks(yamldict, looptasks)
+    return units
+
+def unitName(unit):
+    """
+    Label for a unit of work, like avgplanes:myplane
+    """
+    task, entry = unit
+    name = entry.get('name', '') if isinstance(entry, dict) else ''
+    return '%s:%s'%(task, name) if name else task
+
+def getStrings(item, keyfilter=None, matched=False):
+    """
+    Return all strings in a nested dict/list.  With keyfilter, only
+    the strings under the keys where keyfilter(key) is true.
+    """
+    strings = []
+    if isinstance(item, str):
+        if (keyfilter is None) or matched:
+            strings.append(os.path.normpath(item))
+    elif isinstance(item, dict):
+        for k, g in item.items():
+            keymatch = matched or ((keyfilter is not None) and keyfilter(str(k)))
+            strings += getStrings(g, keyfilter=keyfilter, matched=keymatch)
+    elif isinstance(item, (list, tuple)):
+        for g in item:
+            strings += getStrings(g, keyfilter=keyfilter, matched=matched)
+    return strings
+
+def getPublishedRefs(item):
+    """
+    Return the references like @avgplanes.myplane to results published
+    by other tasks, anywhere in a nested dict/list
+    """
+    return [s for s in getStrings(item) if s.startswith('@')]
+
+def getTaskDependencies(units):
+    """
+    Work out which units each unit has to wait for.  A unit depends on
+
+    - the tasks listed in its depends_on key, given by task name
+      (e.g., avgplanes) or by the name of an entry, and
+    - any unit run before it in the serial order which saves a file
+      (keys starting with save, like savepklfile or savefile) that
+      it uses anywhere in its inputs (e.g., loadpklfile), and
+    - the units whose results it refers to as @task.name.
+
+    Returns a list with the set of dependencies of each unit.
+    """
+    issave  = lambda k: k.startswith('save')
+    outputs = [set(getStrings(entry, keyfilter=issave)) for task, entry in units]
+    deps    = [set() for u in units]
+    for i, (task, entry) in enumerate(units):
+        inputs = set(getStrings(entry))
+        for j in range(i):
+            if len(outputs[j] & inputs) > 0:
+                deps[i].add(j)
+        dependson = entry.get('depends_on', []) if isinstance(entry, dict) else []
+        for name in ([dependson] if isinstance(dependson, str) else dependson):
+            matches = [j for j, (t, e) in enumerate(units) if (j != i) and
+                       ((t == name) or (isinstance(e, dict) and e.get('name', None) == name))]
+            if len(matches) == 0:
+                raise ValueError('depends_on %s in %s does not match any task'%(name, unitName(units[i])))
+            deps[i].update(matches)
+        for ref in getPublishedRefs(entry):
+            reftask, _, refname = ref[1:].partition('.')
+            matches = [j for j, (t, e) in enumerate(units[:i]) if (t == reftask) and
+                       isinstance(e, dict) and (e.get('name', None) == refname)]
+            if len(matches) == 0:
+                raise ValueError('%s in %s does not match any task run before it'%(ref, unitName(units[i])))
+            deps[i].update(matches)
+    # Check that the dependencies can be satisfied
+    done = set()
+    while len(done) < len(units):
+        ready = [i for i in range(len(units)) if (i not in done) and (deps[i] <= done)]
+        if len(ready) == 0:
+            cycle = [unitName(units[i]) for i in range(len(units)) if i not in done]
+            raise ValueError('Circular depends_on between tasks %s'%repr(cycle))
+        done.update(ready)
+    return deps
+
+def runtaskunit(iunit, published={}):
+    """
+    Run one unit of work, restoring it from the result cache when
+    possible.  published holds the results of other units (run in
+    other processes) which this unit refers to as @task.name.
+
+    Returns (err, records, results), where err is None or the traceback
+    if it failed, records are the profiling records of this unit (see
+    taskProfiler), and results are the results it published.
+    """
+    import postproamrwindsample_xarray as ppsamplexr
+    ppsamplexr.publishedresults.update(published)
+    before   = set(ppsamplexr.publishedresults)
+    nrecords = 0 if activeprofiler is None else len(activeprofiler.records)
+    err      = rununit(iunit)
+    results  = {k:v for k, v in ppsamplexr.publishedresults.items() if k not in before}
+    if activeprofiler is None:
+        return err, [], results
+    records = activeprofiler.records[nrecords:]
+    del activeprofiler.records[nrecords:]
+    return err, records, results
+
+def rununit(iunit):
+    """
+    Run or restore one unit of work, see runtaskunit
+    """
+    import postproamrwindsample_xarray as ppsamplexr
+    task, entry = scheduledjob['units'][iunit]
+    verbose     = scheduledjob['verbose']
+    cachedir    = scheduledjob['cachedir']
+    try:
+        if cachedir is not None:
+            configkey, key = getResultCacheKeys(task, entry, scheduledjob['plist'], cachedir)
+            if restoreUnit(cachedir, key, (task, entry)):
+                return None
+            patterns  = getOutputPatterns(task, entry, scheduledjob['plist'])
+            before    = getFileStates(patterns, cachedir)
+            published = set(ppsamplexr.publishedresults)
+        executetask(scheduledjob['plist'][task], [entry], verbose)
+        if cachedir is not None:
+            after   = getFileStates(patterns, cachedir)
+            outputs = [f for f in sorted(after) if before.get(f, None) != after[f]]
+            results = {k:v for k, v in ppsamplexr.publishedresults.items() if k not in published}
+            # The outputs are not inputs of the next run
+            key = getInputKey(configkey, entry, outputs)
+            storeCachedResult(cachedir, configkey, key, outputs, unitName((task, entry)),
+                              results=results)
+    except (Exception, SystemExit):
+        # Some tasks stop with sys.exit() on bad inputs
+        return traceback.format_exc()
+    return None
+
+def getUnitRefs(unit):
+    """
+    The published results which a unit of work refers to, from this
+    process
+    """
+    import postproamrwindsample_xarray as ppsamplexr
+    task, entry = unit
+    keys = [r[1:] for r in getPublishedRefs(entry)]
+    return {k:ppsamplexr.publishedresults[k] for k in keys if k in ppsamplexr.publishedresults}
+
+def restoreUnit(cachedir, key, unit):
+    """
+    Restore a unit of work from the result cache, returns False if it
+    is not in the cache
+    """
+    import postproamrwindsample_xarray as ppsamplexr
+    task, entry = unit
+    # The results of this unit which later units refer to
+    wanted = ['%s.%s'%(task, entry.get('name', ''))]
+    wanted = [k for k in wanted if k in ppsamplexr.wantedresults]
+    if activeprofiler is None:
+        restored = restoreCachedResult(cachedir, key, wanted)
+    else:
+        with activeprofiler.measure(task, entry.get('name', ''), action='restore'):
+            restored = restoreCachedResult(cachedir, key, wanted)
+    if restored:
+        print("Restored %s from the result cache"%unitName(unit))
+    return restored
+
+def runscheduled(units, deps, plist, nprocs, verbose=False, cachedir=None,
+                 peaks=None, budget=None):
+    """
+    Run the units of work over a pool of nprocs processes, starting
+    each one as soon as all of its dependencies are done.  Units which
+    depend on a failed unit are skipped.  With nprocs=1, the units are
+    run in this process in the serial order.
+
+    With peaks (the estimated peak memory of each unit, see planUnits)
+    and budget (in bytes), a unit is held back while the units already
+    running would leave it less than its peak.
+
+    The results a unit publishes in a pool process are sent back here,
+    and on to the units which refer to them.
+    """
+    global scheduledjob
+    import postproamrwindsample_xarray as ppsamplexr
+    import multiprocessing
+    import concurrent.futures
+    scheduledjob = {'units':units, 'plist':plist, 'verbose':verbose,
+                    'cachedir':cachedir}
+    pending = list(range(len(units)))
+    running = {}
+    done    = set()
+    failed  = set()
+    ctx     = None
+    if nprocs > 1:
+        try:
+            ctx = multiprocessing.get_context('fork')
+        except ValueError:
+            print("Warning: fork not available, running tasks serially")
+    try:
+        if ctx is None:
+            # The serial order already satisfies all of the dependencies
+            for i in pending:
+                if len(deps[i] & failed) > 0:
+                    print("Skipping %s, a task it depends on failed"%unitName(units[i]))
+                    failed.add(i)
+                    continue
+                err, records, results = runtaskunit(i)
+                if activeprofiler is not None: activeprofiler.records.extend(records)
+                if err is not None:
+                    failed.add(i)
+                    print("Error in %s:"%unitName(units[i]))
+                    print(err)
+            pending = []
+        else:
+            with concurrent.futures.ProcessPoolExecutor(max_workers=nprocs,
+                                                        mp_context=ctx) as pool:
+                while len(pending) > 0 or len(running) > 0:
+                    # Skip anything which can no longer run
+                    skip = [i for i in pending if len(deps[i] & failed) > 0]
+                    for i in skip:
+                        print("Skipping %s, a task it depends on failed"%unitName(units[i]))
+                        pending.remove(i)
+                        failed.add(i)
+                    if len(skip) > 0: continue
+                    for i in [i for i in pending if deps[i] <= done]:
+                        if (budget is not None) and (len(running) > 0):
+                            inuse = sum([peaks[j] or 0 for j in running.values()])
+                            if inuse + (peaks[i] or 0) > budget: continue
+                        pending.remove(i)
+                        if verbose: print("Starting %s"%unitName(units[i]))
+                        running[pool.submit(runtaskunit, i, getUnitRefs(units[i]))] = i
+                    if len(running) == 0: break
+                    finished, _ = concurrent.futures.wait(running,
+                                                          return_when=concurrent.futures.FIRST_COMPLETED)
+                    for f in finished:
+                        i   = running.pop(f)
+                        err, records, results = f.result()
+                        if activeprofiler is not None: activeprofiler.records.extend(records)
+                        ppsamplexr.publishedresults.update(results)
+                        if err is None:
+                            done.add(i)
+                            if verbose: print("Finished %s"%unitName(units[i]))
+                        else:
+                            failed.add(i)
+                            print("Error in %s:"%unitName(units[i]))
+                            print(err)
+    finally:
+        scheduledjob = {}
+    if len(failed) > 0:
+        raise RuntimeError('Tasks failed: %s'%', '.join([unitName(units[i]) for i in sorted(failed)]))
+    return
+
+# ------------------------------------------------------------------
+# Result cache
+# ------------------------------------------------------------------
+def hashItem(item):
+    """
+    sha1 hash of a json serializable item
+    """
+    text = json.dumps(item, sort_keys=True, default=repr)
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+# Modules of this package which all tasks use, part of every task
+# version in the result cache (see getTaskVersion)
+taskversionmodules = ['postproengine', 'postproamrwindsample_xarray',
+                      'postproamrwindsample', 'plotfunctions']
+
+def getSourceHash(srcfile, hashes={}):
+    """
+    sha1 of the contents of srcfile, remembered as long as the file
+    size and modification time don't change
+    """
+    stat = os.stat(srcfile)
+    key  = (srcfile, stat.st_size, stat.st_mtime_ns)
+    if key not in hashes:
+        with open(srcfile, 'rb') as f:
+            hashes[key] = hashlib.sha1(f.read()).hexdigest()
+    return hashes[key]
+
+def getTaskSources(taskclass):
+    """
+    The source files a task depends on: the file it is defined in, the
+    modules in taskversionmodules, and any other module of
+    amr-wind-frontend it imports (or imports something from)
+    """
+    basedir = os.path.dirname(scriptpath)
+    srcfiles = [taskclass.execute.__code__.co_filename]
+    for name in taskversionmodules:
+        try:
+            spec = util.find_spec(name)
+        except (ImportError, ValueError):
+            spec = None
+        if (spec is not None) and (spec.origin is not None):
+            srcfiles.append(spec.origin)
+    for item in taskclass.execute.__globals__.values():
+        module = item if inspect.ismodule(item) else sys.modules.get(getattr(item, '__module__', None), None)
+        srcfile = getattr(module, '__file__', None)
+        if (srcfile is not None) and \
+           os.path.realpath(srcfile).startswith(os.path.join(basedir, '')):
+            srcfiles.append(srcfile)
+    srcfiles = set([os.path.realpath(f) for f in srcfiles])
+    return sorted([f for f in srcfiles if os.path.isfile(f)])
+
+def getTaskVersion(taskclass):
+    """
+    Version of a task, from its version attribute (if any) and the
+    contents of the source files it depends on (see getTaskSources)
+    """
+    version = [getattr(taskclass, 'version', None)]
+    for srcfile in getTaskSources(taskclass):
+        version.append([os.path.basename(srcfile), getSourceHash(srcfile)])
+    return version
+
+def getInputFiles(entry, exclude=[]):
+    """
+    The files (and files matching the glob patterns) named anywhere in
+    entry, with their size and modification time
+    """
+    exclude = set([os.path.abspath(f) for f in exclude])
+    files   = set()
+    for s in getStrings(entry):
+        matches = glob.glob(s) if glob.has_magic(s) else [s]
+        for f in matches:
+            if os.path.isfile(f) and os.path.abspath(f) not in exclude:
+                files.add(os.path.abspath(f))
+    states = []
+    for f in sorted(files):
+        stat = os.stat(f)
+        states.append([f, stat.st_size, stat.st_mtime_ns])
+    return states
+
+def getResultCacheKeys(task, entry, plist, cachedir):
+    """
+    Keys of a unit of work in the result cache.
+
+    The config key hashes the task name, the entry merged with the
+    task defaults, the task version, and the working directory (since
+    relative paths in the entry, and the outputs stored under them,
+    depend on it).  The full key adds the size
+    and modification time of every input file named in the entry,
+    leaving out the files the same config saved the last time it ran.
+
+    Returns (configkey, key)
+    """
+    taskclass = plist[task]
+    merged    = mergedicts(entry, taskclass.inputdefs)
+    configkey = hashItem([task, merged, getTaskVersion(taskclass), os.getcwd()])
+    ownoutputs = []
+    configfile = os.path.join(cachedir, configkey+'.json')
+    if os.path.isfile(configfile):
+        with open(configfile, 'r') as f:
+            ownoutputs = json.load(f)['outputs']
+    return configkey, getInputKey(configkey, entry, ownoutputs)
+
+def getInputKey(configkey, entry, outputs=[]):
+    """
+    Full result cache key, from the config key, the input files named
+    in entry which are not in outputs, and the published results it
+    refers to as @task.name
+    """
+    import postproamrwindsample_xarray as ppsamplexr
+    hashes = scheduledjob.setdefault('resulthashes', {})
+    refs   = []
+    for ref in getPublishedRefs(entry):
+        if (ref not in hashes) and (ref[1:] in ppsamplexr.publishedresults):
+            hashes[ref] = hashResult(ppsamplexr.publishedresults[ref[1:]])
+        refs.append([ref, hashes.get(ref, None)])
+    return hashItem([configkey, getInputFiles(entry, exclude=outputs), refs])
+
+def hashResult(db):
+    """
+    sha1 hash of the contents of a result db
+    """
+    h = hashlib.sha1()
+    for k in sorted(db, key=str):
+        v = db[k]
+        h.update(repr(k).encode('utf-8'))
+        if isinstance(v, dict):
+            h.update(hashResult(v).encode('utf-8'))
+        elif isinstance(v, np.ndarray) and (v.dtype != object):
+            h.update(repr((v.dtype.str, v.shape)).encode('utf-8'))
+            h.update(np.ascontiguousarray(v).tobytes())
+        else:
+            h.update(repr(v).encode('utf-8'))
+    return h.hexdigest()
+
+def getOutputPatterns(task, entry, plist):
+    """
+    Glob patterns for the files a unit of work may write: every path
+    named in the entry (with the defaults of the task), where {...}
+    format fields match anything, and the files in every directory
+    named in the entry (like output_dir)
+    """
+    merged   = mergedicts(entry, plist[task].inputdefs)
+    patterns = set()
+    for s in getStrings(merged):
+        if os.path.isdir(s):
+            patterns.add(os.path.join(os.path.abspath(s), '*'))
+        else:
+            patterns.add(os.path.abspath(re.sub(r'\{[^}]*\}', '*', s)))
+    return sorted(patterns)
+
+def getFileStates(patterns, cachedir):
+    """
+    Size and modification time of the files matching patterns, leaving
+    out anything in cachedir
+    """
+    cachedir = os.path.abspath(cachedir)
+    states   = {}
+    for d in set([os.path.dirname(p) for p in patterns]):
+        if (not os.path.isdir(d)) or d.startswith(cachedir): continue
+        for entry in os.scandir(d):
+            if entry.is_file() and any([fnmatch.fnmatch(entry.path, p) for p in patterns]):
+                stat = entry.stat()
+                states[entry.path] = (stat.st_size, stat.st_mtime_ns)
+    return states
+
+def storeCachedResult(cachedir, configkey, key, outputs, name='', results={}):
+    """
+    Copy the output files of a unit of work into cachedir under key,
+    along with the results it published
+    """
+    keydir = os.path.join(cachedir, key)
+    tmpdir = keydir+'.tmp%i'%os.getpid()
+    os.makedirs(tmpdir, exist_ok=True)
+    manifest = {'name':name, 'outputs':[]}
+    for i, f in enumerate(outputs):
+        if not os.path.isfile(f): continue
+        stored = '%i_%s'%(i, os.path.basename(f))
+        shutil.copy2(f, os.path.join(tmpdir, stored))
+        manifest['outputs'].append([f, stored])
+    if len(results) > 0:
+        with open(os.path.join(tmpdir, 'results.pkl'), 'wb') as f:
+            pickle.dump(results, f, protocol=2)
+        manifest['results'] = sorted(results)
+    with open(os.path.join(tmpdir, 'manifest.json'), 'w') as fp:
+        json.dump(manifest, fp, indent=1)
+    if os.path.isdir(keydir):
+        shutil.rmtree(keydir)
+    os.replace(tmpdir, keydir)
+    # Remember which files this config writes
+    configfile = os.path.join(cachedir, configkey+'.json')
+    with open(configfile+'.tmp%i'%os.getpid(), 'w') as fp:
+        json.dump({'name':name, 'outputs':[f for f, stored in manifest['outputs']]}, fp, indent=1)
+    os.replace(configfile+'.tmp%i'%os.getpid(), configfile)
+    return
+
+def restoreCachedResult(cachedir, key, wanted=[]):
+    """
+    Copy the output files stored under key back in place, and publish
+    the stored results named in wanted.  Returns False if key (or one
+    of the wanted results) is not in the cache.
+    """
+    import postproamrwindsample_xarray as ppsamplexr
+    keydir       = os.path.join(cachedir, key)
+    manifestfile = os.path.join(keydir, 'manifest.json')
+    if not os.path.isfile(manifestfile):
+        return False
+    with open(manifestfile, 'r') as fp:
+        manifest = json.load(fp)
+    for f, stored in manifest['outputs']:
+        if not os.path.isfile(os.path.join(keydir, stored)):
+            return False
+    if not set(wanted) <= set(manifest.get('results', [])):
+        return False
+    if len(wanted) > 0:
+        with open(os.path.join(keydir, 'results.pkl'), 'rb') as f:
+            results = pickle.load(f)
+        for k in wanted:
+            ppsamplexr.publishedresults[k] = results[k]
+    for f, stored in manifest['outputs']:
+        if os.path.dirname(f):
+            os.makedirs(os.path.dirname(f), exist_ok=True)
+        # copy2 keeps the modification time, so the tasks which read
+        # this output see the same input as before
+        shutil.copy2(os.path.join(keydir, stored), f)
+    return True
+
+# ------------------------------------------------------------------
+# Profiling
+# ------------------------------------------------------------------
+# The profiler used by the driver, None when profiling is off
+activeprofiler = None
+
+# Default prefix of the profiling report files
+profiledefault = 'ppprofile'
+
+def readPeakRSS():
+    """
+    Peak resident set size of this process in bytes, since the last
+    resetPeakRSS() where that is supported
+    """
+    try:
+        with open('/proc/self/status', 'r') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])*1024
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return 0
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes on Linux
+    return maxrss if sys.platform == 'darwin' else maxrss*1024
+
+def resetPeakRSS():
+    """
+    Reset the peak resident set size (only on Linux)
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+    return
+
+class taskProfiler():
+    """
+    Records the wall time, CPU time (including finished child
+    processes), peak RSS, bytes read from the sample files, and
+    timesteps processed for each task and action run by the driver
+    """
+    def __init__(self, prefix=profiledefault, cprofile=False):
+        self.prefix   = prefix
+        self.cprofile = cprofile
+        self.records  = []
+        self.stack    = []
+        self.wrapped  = []
+        return
+
+    def counters(self):
+        import postproamrwindsample_xarray as ppsamplexr
+        t = os.times()
+        return {'wall':time.perf_counter(),
+                'cpu':t.user + t.system + t.children_user + t.children_system,
+                'bytesread':ppsamplexr.iostats['bytesread'],
+                'timesteps':ppsamplexr.iostats['timesteps']}
+
+    @contextlib.contextmanager
+    def measure(self, task, name='', action=''):
+        """
+        Measure the task (or the action inside it) run in this context
+        """
+        # Hand the peak so far to the enclosing measurements before
+        # resetting it
+        peak = readPeakRSS()
+        for frame in self.stack:
+            frame['peak'] = max(frame['peak'], peak)
+        resetPeakRSS()
+        frame = {'task':task, 'name':name, 'peak':0}
+        self.stack.append(frame)
+        start = self.counters()
+        prof  = None
+        if self.cprofile and (action == ''):
+            import cProfile
+            prof = cProfile.Profile()
+            prof.enable()
+        try:
+            yield
+        finally:
+            if prof is not None:
+                prof.disable()
+                label = re.sub(r'[^A-Za-z0-9_.-]+', '_', '%s_%s'%(task, name)).strip('_')
+                prof.dump_stats('%s_%s_%i.prof'%(self.prefix, label, len(self.records)))
+            end = self.counters()
+            self.stack.pop()
+            frame['peak'] = max(frame['peak'], readPeakRSS())
+            for parent in self.stack:
+                parent['peak'] = max(parent['peak'], frame['peak'])
+            wall = end['wall'] - start['wall']
+            cpu  = end['cpu'] - start['cpu']
+            self.records.append({'task':task, 'name':name, 'action':action,
+                                 'wall_s':wall, 'cpu_s':cpu,
+                                 'cpu_per_wall':cpu/wall if wall > 0 else 0.0,
+                                 'peak_rss_mb':frame['peak']/1024**2,
+                                 'bytes_read':end['bytesread'] - start['bytesread'],
+                                 'timesteps':end['timesteps'] - start['timesteps'],
+                                 'pid':os.getpid()})
+        return
+
+    def wrapactions(self, plist):
+        """
+        Measure the execute() of every action of the tasks in plist
+        """
+        for taskclass in plist.values():
+            for actionclass in getattr(taskclass, 'actionlist', {}).values():
+                execute = vars(actionclass).get('execute', None)
+                if (execute is None) or hasattr(execute, 'profiled'):
+                    continue
+                self.wrapped.append((actionclass, execute))
+                actionclass.execute = self.wrapaction(execute, actionclass.actionname)
+        return
+
+    def wrapaction(self, execute, actionname):
+        profiler = self
+        @functools.wraps(execute)
+        def profiled(*args, **kwargs):
+            frame = profiler.stack[-1] if len(profiler.stack) > 0 else {'task':'', 'name':''}
+            with profiler.measure(frame['task'], frame['name'], action=actionname):
+                return execute(*args, **kwargs)
+        profiled.profiled = True
+        return profiled
+
+    def unwrapactions(self):
+        for actionclass, execute in self.wrapped:
+            actionclass.execute = execute
+        self.wrapped = []
+        return
+
+    def report(self):
+        """
+        Write the records to <prefix>.json and <prefix>.csv, and print
+        a summary of the tasks
+        """
+        with open(self.prefix+'.json', 'w') as f:
+            json.dump({'records':self.records}, f, indent=1)
+        columns = ['task', 'name', 'action', 'wall_s', 'cpu_s', 'cpu_per_wall',
+                   'peak_rss_mb', 'bytes_read', 'timesteps', 'pid']
+        import pandas as pd
+        df = pd.DataFrame(self.records, columns=columns)
+        df.to_csv(self.prefix+'.csv', index=False, sep=',')
+        print("Profile of %i tasks and actions written to %s.json, %s.csv"%(len(df), self.prefix, self.prefix))
+        if len(df) > 0:
+            summary = df[['task', 'name', 'action', 'wall_s', 'cpu_s',
+                          'peak_rss_mb', 'bytes_read', 'timesteps']]
+            print(summary.to_string(index=False, float_format=lambda x: '%.3f'%x))
+        return
+
+# ------------------------------------------------------------------
+# Execution planner
+# ------------------------------------------------------------------
+def formatBytes(nbytes):
+    """
+    Format a number of bytes like 1.5 GB
+    """
+    if nbytes is None:
+        return '?'
+    for unit in ['B', 'KB', 'MB', 'GB']:
+        if abs(nbytes) < 1024:
+            return '%.1f %s'%(nbytes, unit) if unit != 'B' else '%i B'%nbytes
+        nbytes = nbytes/1024
+    return '%.1f TB'%nbytes
+
+def getSampleInfo(ncfileinput, group=None, trange=None):
+    """
+    Read the metadata of the sampling files in ncfileinput (a file, a
+    glob pattern, or a list of them) without reading any of the sampled
+    data.  Returns a dict with
+
+    - files:    the list of files
+    - group:    the group (the first one if group is None)
+    - ntimes:   the number of timesteps in trange (all if None)
+    - nfiletimes: the largest number of those timesteps in one file
+    - npoints:  the number of points in the group
+    - ijk_dims: the ijk_dims of the group (None for samplers without it)
+    - itemsize: the bytes per value of each sampled variable
+    - tchunk:   the number of timesteps per chunk in the file
+    """
+    import postproamrwindsample as ppsample
+    import postproamrwindsample_xarray as ppsamplexr
+    from netCDF4 import Dataset
+    files = ppsamplexr.getFileList(ncfileinput)
+    if len(files) == 0:
+        raise ValueError('No sampling files match %s'%repr(ncfileinput))
+    tindex = ppsample.timeIndex(files)
+    if (trange is None) or (len(trange) < 2):
+        t1, t2 = -np.inf, np.inf
+    else:
+        t1, t2 = trange[0]-1.0E-10, trange[1]
+    filecounts = [len(i) for i in tindex.filter(t1, t2)]
+    with Dataset(files[0], 'r') as ds:
+        group  = ppsample.getGroups(ds)[0] if group is None else group
+        grp    = ds[group]
+        info   = {'files':files, 'group':group, 'ntimes':sum(filecounts),
+                  'nfiletimes':max(filecounts+[0]),
+                  'npoints':grp.dimensions['num_points'].size,
+                  'ijk_dims':[int(x) for x in grp.ijk_dims] if 'ijk_dims' in grp.ncattrs() else None,
+                  'itemsize':{}, 'tchunk':1}
+        for v, var in grp.variables.items():
+            if var.dimensions[:1] == ('num_time_steps',):
+                info['itemsize'][v] = var.dtype.itemsize
+                chunks = var.chunking()
+                if isinstance(chunks, list): info['tchunk'] = chunks[0]
+    return info
+
+def getReadVars(info, varnames):
+    """
+    The variables in the sampling file which are read to get varnames
+    (velocitya1, velocitya2, velocitya3 are made from velocityx,
+    velocityy, velocityz)
+    """
+    readvars = [v for v in varnames if not v.startswith('velocitya')]
+    if len(readvars) < len(varnames):
+        readvars += ['velocityx', 'velocityy', 'velocityz']
+    readvars = [v for v in dict.fromkeys(readvars) if v in info['itemsize']]
+    return readvars
+
+def planLoaded(filename):
+    """
+    Estimate for a task which loads its result instead of reading the
+    sampling files
+    """
+    return {'ntimes':0, 'bytesread':0, 'peakbytes':0, 'blocksize':None,
+            'notes':['loads %s'%filename]}
+
+def planStreaming(info, varnames, narrays, blocksize=None, nprocs=1, npoints=None,
+                  workitemsize=None, chunkkey=['blocksize']):
+    """
+    Estimate for a task which reads the timesteps a block at a time and
+    keeps narrays running arrays of the size of one snapshot (like the
+    statistics in avgPlaneXR).  Each block is read and then held as a
+    working copy and as deviations from the mean, in workitemsize bytes
+    per value (Default: the precision in the file).
+    """
+    import postproamrwindsample_xarray as ppsamplexr
+    npoints   = info['npoints'] if npoints is None else npoints
+    readvars  = getReadVars(info, varnames)
+    readstep  = npoints*sum([info['itemsize'][v] for v in readvars])
+    itemsize  = max([info['itemsize'][v] for v in readvars]+[1])
+    workitemsize = itemsize if workitemsize is None else workitemsize
+    if blocksize is None:
+        # Same as getBlockSize
+        nblock    = max(1, ppsamplexr.blockbytes//max(1, npoints*itemsize))
+        blocksize = max(info['tchunk'], (nblock//info['tchunk'])*info['tchunk'])
+    # Blocks do not span files
+    blocksize = max(1, min(int(blocksize), max(1, info['nfiletimes'])))
+    # Memory per timestep in a block and for everything else, for all
+    # of the processes
+    stepbytes  = nprocs*(readstep + 2*npoints*len(varnames)*workitemsize)
+    fixedbytes = nprocs*2*narrays*npoints*8
+    return {'ntimes':info['ntimes'], 'bytesread':info['ntimes']*readstep,
+            'peakbytes':fixedbytes + blocksize*stepbytes, 'blocksize':blocksize,
+            'stepbytes':stepbytes, 'fixedbytes':fixedbytes,
+            'tchunk':info['tchunk'], 'chunkkey':chunkkey, 'notes':[]}
+
+def planInMemory(info, varnames, ntimes=None, npoints=None, workitemsize=None,
+                 copies=1.0, extrabytes=0, scratchdir=None):
+    """
+    Estimate for a task which reads ntimes snapshots of varnames into
+    memory at once, and holds copies of them at its peak (plus
+    extrabytes), in workitemsize bytes per value (Default: the
+    precision in the file).  With scratchdir, the snapshots are
+    memory-mapped files and are left out of the peak.
+    """
+    ntimes   = info['ntimes'] if ntimes is None else ntimes
+    npoints  = info['npoints'] if npoints is None else npoints
+    readvars = getReadVars(info, varnames)
+    readstep = npoints*sum([info['itemsize'][v] for v in readvars])
+    workitemsize = max([info['itemsize'][v] for v in readvars]+[1]) if workitemsize is None else workitemsize
+    snapshot = ntimes*npoints*len(varnames)*workitemsize
+    notes    = []
+    if scratchdir is not None:
+        notes.append('snapshots memory-mapped in %s'%scratchdir)
+        copies = max(0.0, copies-1.0)
+    return {'ntimes':ntimes, 'bytesread':ntimes*readstep,
+            'peakbytes':int(copies*snapshot) + extrabytes, 'blocksize':None,
+            'snapshotbytes':snapshot, 'notes':notes}
+
+def planGeneric(entry):
+    """
+    Rough estimate for a task without an estimate method: everything in
+    ncfile (within trange or tavg) is read into memory
+    """
+    ncfile = entry.get('ncfile', None)
+    if not ncfile:
+        return {'ntimes':0, 'bytesread':0, 'peakbytes':None, 'blocksize':None,
+                'notes':['no sampling files']}
+    trange   = entry.get('trange', None) or entry.get('tavg', None)
+    trange   = trange if isinstance(trange, (list, tuple)) else None
+    varnames = entry.get('varnames', ['velocityx', 'velocityy', 'velocityz'])
+    info = getSampleInfo(ncfile, entry.get('group', None), trange)
+    plan = planInMemory(info, varnames)
+    plan['notes'].append('no estimate for this task, assuming all of ncfile is read into memory')
+    return plan
+
+def planUnits(units, plist):
+    """
+    Estimate the timesteps read, bytes read, and peak memory of each
+    unit of work (see getTaskUnits).  Tasks can give their own estimate
+    with an estimate(entry) method, which is called with the entry
+    merged with the task defaults and returns a dict made by
+    planStreaming or planInMemory.  The other tasks get planGeneric.
+    """
+    plans = []
+    for task, entry in units:
+        try:
+            taskitem = plist[task]([entry], verbose=False)
+            merged   = taskitem.yamldictlist[0]
+            if hasattr(taskitem, 'estimate'):
+                plan = taskitem.estimate(merged)
+            else:
+                plan = planGeneric(merged)
+        except (Exception, SystemExit) as e:
+            plan = {'ntimes':None, 'bytesread':None, 'peakbytes':None, 'blocksize':None,
+                    'notes':['could not plan: %s'%repr(e)]}
+        plans.append(plan)
+    return plans
+
+def fitMemoryBudget(units, plans, budget):
+    """
+    Make every unit fit in budget bytes.  Units which read in blocks
+    get a smaller blocksize (which is set in their entry).  Returns the
+    indices of the units which cannot fit.
+    """
+    refused = []
+    for i, plan in enumerate(plans):
+        if (plan['peakbytes'] is None) or (plan['peakbytes'] <= budget):
+            continue
+        if plan.get('stepbytes', None) and plan.get('chunkkey', None):
+            blocksize = int((budget - plan['fixedbytes'])//plan['stepbytes'])
+            if blocksize >= plan['tchunk']:
+                # Keep the blocks aligned with the file chunks
+                blocksize = (blocksize//plan['tchunk'])*plan['tchunk']
+            if blocksize >= 1:
+                task, entry = units[i]
+                target = entry
+                for k in plan['chunkkey'][:-1]:
+                    target = target[k]
+                target[plan['chunkkey'][-1]] = blocksize
+                plan['blocksize'] = blocksize
+                plan['peakbytes'] = plan['fixedbytes'] + blocksize*plan['stepbytes']
+                plan['notes'].append('blocksize reduced to fit memorybudget')
+                continue
+        plan['notes'].append('over memorybudget')
+        refused.append(i)
+    return refused
+
+def printPlan(units, plans, budget=None, nprocs=1, cachesize=0):
+    """
+    Print the plan of each unit of work and the totals.  budget is what
+    is left for the tasks after the snapshot cache of cachesize bytes.
+    """
+    names = [unitName(u) for u in units]
+    width = max([len('task')]+[len(n) for n in names])
+    fmt   = '%-'+repr(width)+'s %9s %10s %10s %9s  %s'
+    print(fmt%('task', 'timesteps', 'read', 'peak mem', 'blocksize', 'notes'))
+    for name, plan in zip(names, plans):
+        ntimes    = plan['ntimes'] if plan['ntimes'] is not None else '?'
+        blocksize = plan['blocksize'] if plan['blocksize'] is not None else '-'
+        print(fmt%(name, ntimes, formatBytes(plan['bytesread']), formatBytes(plan['peakbytes']),
+                   blocksize, '; '.join(plan['notes'])))
+    peaks = sorted([p['peakbytes'] for p in plans if p['peakbytes'] is not None], reverse=True)
+    print("Total read: %s"%formatBytes(sum([p['bytesread'] for p in plans if p['bytesread'] is not None])))
+    print("Largest task peak: %s"%formatBytes(peaks[0] if len(peaks) > 0 else 0))
+    if nprocs > 1:
+        print("Peak with %i tasks at once: up to %s"%(nprocs, formatBytes(sum(peaks[:nprocs]))))
+    if cachesize > 0:
+        print("Snapshot cache: %s"%formatBytes(cachesize) +
+              (" (%s per process)"%formatBytes(cachesize//nprocs) if nprocs > 1 else ""))
+    if budget is not None:
+        print("Memory budget: %s (%s for the tasks)"%(formatBytes(budget+cachesize), formatBytes(budget)))
+    return
+
 def test():
     # Only execute this if test.py is included
     yamldict = {
@@ -1094,12 +2608,5 @@ def test():
 path    = os.path.abspath(__file__)
 dirpath = os.path.dirname(path)
 
-# Load all plugins in this directory
-for fname in sorted(os.listdir(dirpath)):
-    # Load only "real modules"
-    if not fname.startswith('.') and \
-       not fname.startswith('__') and fname.endswith('.py'):
-        try:
-            load_module(os.path.join(dirpath, fname))
-        except Exception:
-            traceback.print_exc()
+# Find the plugins in this directory, they are only imported when used
+pluginlist.addpaths(*scanPlugins(dirpath))
@@ -8,14 +8,13 @@ amrwindfedirs = ['../',
 for x in amrwindfedirs: sys.path.insert(1, x)
 
 from postproengine import registerplugin, mergedicts, registeraction, contourplottemplate
+from postproengine import getSampleInfo, planStreaming, planLoaded
 from postproengine import compute_axis1axis2_coords, get_mapping_xyz_to_axis1axis2
 import postproamrwindsample_xarray as ppsamplexr
 import postproamrwindsample as ppsample
 import numpy as np
 import pickle
 import pandas as pd
-import matplotlib.pyplot as plt
-from mpl_toolkits.axes_grid1 import make_axes_locatable
 from postproengine import interpolatetemplate, circavgtemplate, doubleintegraltemplate  
 from postproengine import compute_axis1axis2_coords
 import re
@@ -27,10 +26,7 @@ See README.md for details on the structure of classes here
 """
 
 def loadpickle(picklefile):
-    pfile          = open(picklefile, 'rb')
-    ds             = pickle.load(pfile)
-    pfile.close()
-    return ds
+    return ppsamplexr.loadResultDB(picklefile)
 
 @registerplugin
 class postpro_averageplanes():
@@ -50,16 +46,31 @@ class postpro_averageplanes():
         {'key':'tavg',    'required':False,  'default':[],
             'help':'Which times to average over', },
         {'key':'loadpklfile', 'required':False,  'default':'',
-        'help':'Load previously computed results from this pickle file', },        
+        'help':'Load previously computed results from this pickle file (or @task.name of a result published earlier in the run)', },        
         {'key':'savepklfile', 'required':False,  'default':'',
-        'help':'Name of pickle file to save results', },
+        'help':'Name of pickle file to save results (a .nc name saves a NetCDF result store instead)', },
         {'key':'group',   'required':False,  'default':None,
          'help':'Which group to pull from netcdf file', },
         {'key':'varnames',  'required':False,  'default':['velocityx', 'velocityy', 'velocityz'],
          'help':'Variables to extract from the netcdf file',},        
         {'key':'axis_rotation',  'required':False,  'default':0,
          'help':'Degrees to rotate axis for velocitya1,a2,a3 transformation',},                
-        
+        {'key':'stats',  'required':False,  'default':['avg'],
+         'help':'Statistics to compute in the same pass [Choices: avg, rs, std, min, max, minmax, skew, kurt, moments (std, skew, kurt), triple (triple correlations and TKE transport)]',},
+        {'key':'blocksize',  'required':False,  'default':None,
+         'help':'Number of timesteps to read at once (Default: aligned with the file chunks)',},
+        {'key':'nprocs',  'required':False,  'default':1,
+         'help':'Number of processes used to compute the statistics',},
+        {'key':'backend',  'required':False,  'default':'numpy',
+         'help':'How to compute the statistics [Choices: numpy, dask (lazy, out-of-core)]',},
+        {'key':'scheduler',  'required':False,  'default':'threads',
+         'help':'dask scheduler for the dask backend [Choices: threads, processes, synchronous]',},
+        {'key':'resume',  'required':False,  'default':False,
+         'help':'Keep the running statistics next to savepklfile, and only add the new timesteps on later runs (numpy backend)',},
+        {'key':'checkpointsteps',  'required':False,  'default':None,
+         'help':'With resume, also save the running statistics every this many timesteps',},
+        {'key':'dtype',  'required':False,  'default':None,
+         'help':'Precision to read the planes in, the statistics are accumulated in float64 [Choices: float32, float64] (Default: precision in the file)',},
     ]
     actionlist = {}                    # Dictionary for holding sub-actions
     example = """
@@ -99,6 +110,20 @@ avgplanes:
             self.yamldictlist.append(mergedicts(indict, self.inputdefs))
         if verbose: print('Initialized '+self.name)
         return
+
+    def estimate(self, plane):
+        """
+        Estimate the timesteps, bytes read and peak memory of plane
+        (see postproengine.planUnits)
+        """
+        if len(plane['loadpklfile']) > 0:
+            return planLoaded(plane['loadpklfile'])
+        info = getSampleInfo(plane['ncfile'], plane['group'], plane['tavg'] or None)
+        accum = ppsamplexr.planeStatsAccumulator(plane['varnames'], stats=plane['stats'])
+        workitemsize = np.dtype(plane['dtype']).itemsize if plane['dtype'] else None
+        return planStreaming(info, plane['varnames'], accum.narrays(),
+                             blocksize=plane['blocksize'], nprocs=plane['nprocs'],
+                             workitemsize=workitemsize)
     
     def execute(self, verbose=False):
         if verbose: print('Running '+self.name)
@@ -111,6 +136,21 @@ avgplanes:
             pklfile  = plane['savepklfile']
             self.varnames = plane['varnames']
             self.axis_rotation = plane['axis_rotation']
+            stats    = plane['stats']
+            blocksize= plane['blocksize']
+            nprocs   = plane['nprocs']
+            backend  = plane['backend']
+            scheduler= plane['scheduler']
+            if backend == 'dask':
+                statsfunc = ppsamplexr.lazyStatsPlaneXR
+                statsopts = {'scheduler':scheduler,
+                             'nprocs':nprocs if nprocs > 1 else None}
+            elif backend == 'numpy':
+                statsfunc = ppsamplexr.statsPlaneXR
+                statsopts = {'nprocs':nprocs, 'resume':plane['resume'],
+                             'checkpointsteps':plane['checkpointsteps']}
+            else:
+                raise ValueError('Unknown backend %s'%backend)
 
             #Get all times if not specified
             if isinstance(ncfile, str):
@@ -133,13 +173,12 @@ avgplanes:
             # Load the plane
             if len(loadpkl)>0:
                 # Load from existing file
-                pfile          = open(loadpkl, 'rb')
-                self.dbavg     = pickle.load(pfile)
-                pfile.close()                
+                self.dbavg     = ppsamplexr.loadResultDB(loadpkl)
             else:
                 # Compute the result
-                self.dbavg  = ppsamplexr.avgPlaneXR(ncfile, tavg, varnames=self.varnames, groupname=group,includeattr=True, savepklfile=pklfile, verbose=verbose,axis_rotation=self.axis_rotation)
-
+                self.dbavg  = statsfunc(ncfile, tavg, stats=stats, varnames=self.varnames, groupname=group,includeattr=True, savepklfile=pklfile, verbose=verbose,axis_rotation=self.axis_rotation, blocksize=blocksize, dtype=plane['dtype'], **statsopts)
+            # Let later tasks in this run use it as @avgplanes.<name>
+            ppsamplexr.publishResult(self.name, plane['name'], self.dbavg)
             
             # Do any sub-actions required for this task
             for a in self.actionlist:
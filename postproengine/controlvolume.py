@@ -139,23 +139,26 @@ controlvolume:
         # Load the files into a dictionary  
         dd_avg = defaultdict(list) # initialize dictionary
         for pklfile in pklfiles:
-            with open(pklfile, 'rb') as fp:
-                d = pickle.load(fp)
-                axis_info = {} 
-
-                compute_axis1axis2axis3_coords(d,0)
-                R = get_mapping_xyz_to_axis1axis2(d['axis1'],d['axis2'],d['axis3'],rot=0)
-                axis_info['axis1'] = R[0,:]
-                axis_info['axis2'] = R[1,:]
-                axis_info['axis3'] = R[2,:]
-                origina1a2a3 = R@d['origin']
-
-                d['a1'] = d['a1'] + origina1a2a3[0]
-                d['a2'] = d['a2'] + origina1a2a3[1]
-                d['a3'] = d['a3'] + origina1a2a3[2]
+            # Result stores are read lazily, so only the plane arrays
+            # used below are read
+            d = ppsamplexr.loadResultDB(pklfile)
+            axis_info = {} 
+
+            compute_axis1axis2axis3_coords(d,0)
+            R = get_mapping_xyz_to_axis1axis2(d['axis1'],d['axis2'],d['axis3'],rot=0)
+            axis_info['axis1'] = R[0,:]
+            axis_info['axis2'] = R[1,:]
+            axis_info['axis3'] = R[2,:]
+            origina1a2a3 = R@d['origin']
+
+            d['a1'] = d['a1'] + origina1a2a3[0]
+            d['a2'] = d['a2'] + origina1a2a3[1]
+            d['a3'] = d['a3'] + origina1a2a3[2]
                 
-            for key, value in d.items():
-                dd_avg[key].append(value)
+            for key in d.keys():
+                if ppsamplexr.resultNdim(d, key) == 3:
+                    dd_avg[key].append(d[key])
+            if isinstance(d, ppsamplexr.resultDB): d.close()
         dd_avg = dict(dd_avg)
 
         # Flatten the lists from each offset/group into single 3D numpy arrays
@@ -14,7 +14,6 @@ import correlate as corr
 import postproamrwindsample_xarray as ppsamplexr
 import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
 from collections            import OrderedDict
 
 # Load ruamel or pyyaml as needed
@@ -106,6 +105,7 @@ def probelocations(s=1):
         return
 
     def execute(self, verbose=False):
+        import matplotlib.pyplot as plt
         # Do any task-related here
         if verbose: print('Running '+self.name)
         for iplanenum, plane in enumerate(self.yamldictlist):
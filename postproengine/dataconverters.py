@@ -14,8 +14,6 @@ import numpy as np
 import numpy.linalg as linalg
 import pandas as pd
 import pickle
-import matplotlib.pyplot as plt
-from mpl_toolkits.axes_grid1 import make_axes_locatable
 import time
 import struct
 from netCDF4 import Dataset
@@ -207,8 +205,8 @@ class postpro_dataconverts():
 
             varnames = ['velocityx', 'velocityy', 'velocityz']
 
-            # Load the plane
-            self.db = ppsamplexr.getPlaneXR(self.parent.filelist, [0,1], varnames, groupname=group, verbose=False,includeattr=True,gettimes=True,timerange=self.parent.times)
+            # Get the plane geometry first, so only the cropped box is read
+            self.db = ppsamplexr.readPlaneHeaderXR(self.parent.filelist, groupname=group)
             XX = np.array(self.db['x'])
             YY = np.array(self.db['y'])
             ZZ = np.array(self.db['z'])
@@ -249,16 +247,29 @@ class postpro_dataconverts():
             y1_dist = abs(yloc-y[-1])
             y_box_size = 2*min(y0_dist,y1_dist)
 
-            if y0_dist == min(y0_dist,y1_dist): 
+            y_range = [0, len(y)-1]
+            if y0_dist < y1_dist: 
                 y_box_ind = np.argmin(abs(y - y_box_size - y[0]))
-                y = y[0:y_box_ind+1] 
-            if y1_dist == min(y0_dist,y1_dist): 
+                y_range = [0, y_box_ind]
+            elif y1_dist < y0_dist: 
                 y_box_ind = np.argmin(abs(y - (y[-1] - y_box_size)))
-                y = y[y_box_ind:] 
-
+                y_range = [y_box_ind, len(y)-1]
+            y = y[y_range[0]:y_range[1]+1]
 
             bot_ind = np.argmin(abs(z-(zloc - turbine_height)))
+            z_range = [bot_ind, len(z)-1]
             z = z[bot_ind:]
+
+            # Load the plane, reading only the box at iplane.  The
+            # ranges are indexed by the (k, j, i) axes of the plane.
+            kji_range = [None]*3
+            kji_range[streamwise_index] = [iplane, iplane]
+            kji_range[lateral_index]    = y_range
+            kji_range[vertical_index]   = z_range
+            self.db = ppsamplexr.getPlaneXR(self.parent.filelist, [0,1], varnames, groupname=group, verbose=False,includeattr=True,gettimes=True,timerange=self.parent.times,
+                                            contiguous=True,
+                                            iplanes=list(range(kji_range[0][0], kji_range[0][1]+1)),
+                                            j_range=kji_range[1], i_range=kji_range[2])
             nt = len(self.db['times'])
             ny = len(y)
             nz = len(z)
@@ -267,20 +278,11 @@ class postpro_dataconverts():
             t = np.array(self.db['times'])
             tsteps = np.array(self.db['timesteps'])
             uRef = np.ndarray(nt)
+            # self.db[v] is (time, k, j, i), so shift the permutation by one
+            tpermutation = [0]+[p+1 for p in permutation]
+            for icomp, v in enumerate(['velocityx', 'velocityy', 'velocityz']):
+                ts['u'][icomp,:,:,:] = np.transpose(self.db[v],tpermutation)[:,0,:,:]
             for titer , tval in enumerate(tsteps):
-                if y0_dist == y1_dist: 
-                    ts['u'][0,titer,:,:] = np.transpose(np.array(self.db['velocityx'][tval]),permutation)[iplane,:,bot_ind:]
-                    ts['u'][1,titer,:,:] = np.transpose(np.array(self.db['velocityy'][tval]),permutation)[iplane,:,bot_ind:]
-                    ts['u'][2,titer,:,:] = np.transpose(np.array(self.db['velocityz'][tval]),permutation)[iplane,:,bot_ind:]
-                elif y0_dist == min(y0_dist,y1_dist): 
-                    ts['u'][0,titer,:,:] = np.transpose(np.array(self.db['velocityx'][tval]),permutation)[iplane,0:y_box_ind+1,bot_ind:]
-                    ts['u'][1,titer,:,:] = np.transpose(np.array(self.db['velocityy'][tval]),permutation)[iplane,0:y_box_ind+1,bot_ind:]
-                    ts['u'][2,titer,:,:] = np.transpose(np.array(self.db['velocityz'][tval]),permutation)[iplane,0:y_box_ind+1,bot_ind:]
-                else:
-                    ts['u'][0,titer,y_box_ind:,bot_ind:] = np.transpose(np.array(self.db['velocityx'][tval]),permutation)[iplane,y_box_ind:,bot_ind:]
-                    ts['u'][1,titer,y_box_ind:,bot_ind:] = np.transpose(np.array(self.db['velocityy'][tval]),permutation)[iplane,y_box_ind:,bot_ind:]
-                    ts['u'][2,titer,y_box_ind:,bot_ind:] = np.transpose(np.array(self.db['velocityz'][tval]),permutation)[iplane,y_box_ind:,bot_ind:]
-
                 interpolator = RegularGridInterpolator((y, z), ts['u'][0,titer, :, :])
                 uRef[titer]  = interpolator((yloc, zloc))
 
@@ -9,17 +9,18 @@ for x in amrwindfedirs: sys.path.insert(1, x)
 
 from postproengine import registerplugin, mergedicts, registeraction
 from postproengine import compute_axis1axis2_coords, interpolatetemplate
+from postproengine import getSampleInfo, planInMemory
 import postproamrwindsample_xarray as ppsamplexr
 import postproamrwindsample as ppsample
 import numpy as np
 import pickle
-import matplotlib.pyplot as plt
-from mpl_toolkits.axes_grid1 import make_axes_locatable
 from postproengine import convert_vel_xyz_to_axis1axis2
-import cv2
-from postproengine import spod
 import re
 import plotfunctions
+import importlib.util
+
+# Check for the opencv package used to make videos
+usecv2 = importlib.util.find_spec('cv2') is not None
 
 """
 Plugin for creating instantaneous planar images
@@ -60,7 +61,9 @@ class postpro_instantaneousplanes():
         {'key':'varnames',  'required':False,  'default':['velocityx', 'velocityy', 'velocityz'],
          'help':'Variables to extract from the netcdf file',},        
         {'key':'savepklfile', 'required':False,  'default':'',
-         'help':'Name of pickle file to save results', },
+         'help':'Name of pickle file to save results (a .nc name saves a NetCDF result store instead)', },
+        {'key':'dtype',  'required':False,  'default':None,
+         'help':'Precision to store the planes in [Choices: float32, float64] (Default: precision in the file)',},
 
     ]
     actionlist = {}                    # Dictionary for holding sub-actions
@@ -118,6 +121,19 @@ instantaneousplanes:
             self.yamldictlist.append(mergedicts(indict, self.inputdefs))
         if verbose: print('Initialized '+self.name)
         return
+
+    def estimate(self, plane):
+        """
+        Estimate the timesteps, bytes read and peak memory of plane
+        (see postproengine.planUnits)
+        """
+        trange = plane['trange'] if isinstance(plane['trange'], (list, tuple)) else None
+        info   = getSampleInfo(plane['ncfile'], plane['group'], trange)
+        if trange is None:
+            ntimes = len(plane['times']) if len(plane['times']) > 0 else len(np.atleast_1d(plane['iters']))
+            info['ntimes'] = ntimes
+        workitemsize = np.dtype(plane['dtype']).itemsize if plane['dtype'] else None
+        return planInMemory(info, plane['varnames'], workitemsize=workitemsize)
     
     def execute(self, verbose=False):
         if verbose: print('Running '+self.name)
@@ -143,7 +159,7 @@ instantaneousplanes:
                 iters = [find_nearest(timevec, t) for t in times]
 
             # Load the plane
-            self.db  = ppsamplexr.getPlaneXR(ncfile, iters, varnames, groupname=group, verbose=verbose, gettimes=True, includeattr=True,timerange=self.trange)
+            self.db  = ppsamplexr.getPlaneXR(ncfile, iters, varnames, groupname=group, verbose=verbose, gettimes=True, includeattr=True,timerange=self.trange, dtype=plane['dtype'])
 
             # Convert to native axis1/axis2 coordinates if necessary
             if ('a1' in [self.xaxis, self.yaxis]) or \
@@ -157,10 +173,10 @@ instantaneousplanes:
             self.iters = iters
 
             if len(savepklfile)>0:
-                # Write out the picklefile
-                dbfile = open(savepklfile, 'wb')
-                pickle.dump(self.db, dbfile, protocol=2)
-                dbfile.close()
+                # Write out the picklefile (or result store)
+                ppsamplexr.saveResultDB(self.db, savepklfile)
+            # Let later tasks in this run use it as @instantaneousplanes.<name>
+            ppsamplexr.publishResult(self.name, plane['name'], self.db)
 
             # Do any sub-actions required for this task
             for a in self.actionlist:
@@ -232,6 +248,8 @@ instantaneousplanes:
             return
 
         def execute(self):
+            import matplotlib.pyplot as plt
+            from mpl_toolkits.axes_grid1 import make_axes_locatable
             print('Executing ' + self.actionname)
             plotfunc = eval(self.actiondict['plotfunc'])
             title    = self.actiondict['title']
@@ -390,6 +408,10 @@ instantaneousplanes:
                     time  = self.parent.db['times'][iplot]
 
                 images.append(imagefilename.format(time=time, iplane=iplane))
+            if not usecv2:
+                print("Error: opencv (cv2) package required to make videos")
+                sys.exit()
+            import cv2
             frame = cv2.imread(os.path.join(images[0]))
             height, width, layers = frame.shape
             video = cv2.VideoWriter(video_name, cv2.VideoWriter_fourcc(*'mp4v'), fps, (width, height))
@@ -439,6 +461,7 @@ instantaneousplanes:
             return
 
         def execute(self):
+            import matplotlib.pyplot as plt
             print('Executing ' + self.actionname)
             plotfunc = eval(self.actiondict['plotfunc'])
             title    = self.actiondict['title']
@@ -469,6 +492,7 @@ instantaneousplanes:
                 fig, ax = plt.subplots(figsize=(figsize[0],figsize[1]),subplot_kw={'projection':'polar'},dpi=dpi)
                 LR = r[-1]
                 plotq = plotfunc(self.parent.db,i)
+                from postproengine import spod
                 Ur = spod.interpolate_cart_to_radial(plotq[iplane,:,:],y,z,RR,TT,xcenter,ycenter)
                 if vmin == None or vmax == None:
                     im = ax.pcolormesh(theta,r,Ur,cmap=cmap)
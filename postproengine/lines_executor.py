@@ -8,13 +8,12 @@ amrwindfedirs = ['../',
 for x in amrwindfedirs: sys.path.insert(1, x)
 
 from postproengine import registerplugin, mergedicts, registeraction, contourplottemplate
+from postproengine import getSampleInfo, planStreaming
 import postproamrwindsample_xarray as ppsamplexr
 import postproamrwindsample as ppsample
 import numpy as np
 import pickle
 import pandas as pd
-import matplotlib.pyplot as plt
-from mpl_toolkits.axes_grid1 import make_axes_locatable
 
 
 """
@@ -55,6 +54,7 @@ linesampler:
   average:
     tavg: [15000, 16000]
     savefile: ../results/avgmast_1000.csv
+    stats: ['rs', 'std']
 """
     # --- Stuff required for main task ---
     def __init__(self, inputs, verbose=False):
@@ -64,6 +64,20 @@ linesampler:
             self.yamldictlist.append(mergedicts(indict, self.inputdefs))
         if verbose: print('Initialized '+self.name)
         return
+
+    def estimate(self, line):
+        """
+        Estimate the timesteps, bytes read and peak memory of line
+        (see postproengine.planUnits)
+        """
+        if 'average' not in line:
+            return {'ntimes':0, 'bytesread':0, 'peakbytes':0, 'blocksize':None, 'notes':[]}
+        average = mergedicts(line['average'], self.actionlist['average'].actiondefs)
+        info    = getSampleInfo(line['ncfile'], line['group'], average['tavg'] or None)
+        accum   = ppsamplexr.planeStatsAccumulator(line['varnames'], stats=average['stats'])
+        return planStreaming(info, line['varnames'], accum.narrays(),
+                             blocksize=average['blocksize'],
+                             chunkkey=['average', 'blocksize'])
     
     def execute(self, verbose=False):
         self.verbose=verbose
@@ -96,6 +110,10 @@ linesampler:
             {'key':'savefile',  'required':True,  'default':'',
              'help':'Filename to save the radial profiles', },
             {'key':'tavg',       'required':False,  'default':[],  'help':'Times to average over', },
+            {'key':'stats',  'required':False,  'default':['avg'],
+             'help':'Statistics to compute in the same pass [Choices: avg, rs, std, min, max, minmax, skew, kurt, moments (std, skew, kurt), triple (triple correlations and TKE transport)]',},
+            {'key':'blocksize',  'required':False,  'default':None,
+             'help':'Number of timesteps to read at once (Default: aligned with the file chunks)',},
         ]
         
         def __init__(self, parent, inputs):
@@ -111,11 +129,14 @@ linesampler:
             ncfile   = self.parent.ncfile
             varnames = self.parent.varnames
             group    = self.parent.group
+            stats    = self.actiondict['stats']
+            blocksize= self.actiondict['blocksize']
             
             ds   = ppsamplexr.avgLineXR(ncfile, tavg, varnames,
                                         groupname=group,
                                         verbose=self.parent.verbose,
-                                        includeattr=False, gettimes=False)
+                                        includeattr=False, gettimes=False,
+                                        stats=stats, blocksize=blocksize)
             
             # Save data to csv file
             ds.pop('group')     # Remove the group from being written
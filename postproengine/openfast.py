@@ -12,11 +12,12 @@ import postproamrwindsample_xarray as ppsamplexr
 import postproamrwindsample as ppsample
 import numpy as np
 import pickle
-import matplotlib.pyplot as plt
 import pandas as pd
-from mpl_toolkits.axes_grid1 import make_axes_locatable
-import fatpack
 import scipy
+import importlib.util
+
+# Check for the fatpack package used for the damage equivalent loads
+usefatpack = importlib.util.find_spec('fatpack') is not None
 
 """
 Plugin for postprocessing openfast data
@@ -248,6 +249,10 @@ class postpro_openfast():
                 std_df.to_csv(csvfile, index=False,float_format='%.15f')
 
             if 'DEL' in operations:
+                if not usefatpack:
+                    print("Error: fatpack package required to compute DELs")
+                    sys.exit()
+                import fatpack
                 DEL_df = pd.DataFrame(columns=self.parent.df.columns)
                 DEL_df.loc[0]=0
                 for column in filtered_df:
@@ -9,13 +9,12 @@ for x in amrwindfedirs: sys.path.insert(1, x)
 
 from postproengine import registerplugin, mergedicts, registeraction, contourplottemplate
 from postproengine import compute_axis1axis2_coords, get_mapping_xyz_to_axis1axis2
+from postproengine import getSampleInfo, planStreaming, planLoaded
 import postproamrwindsample_xarray as ppsamplexr
 import postproamrwindsample as ppsample
 import numpy as np
 import pickle
 import pandas as pd
-import matplotlib.pyplot as plt
-from mpl_toolkits.axes_grid1 import make_axes_locatable
 from postproengine import interpolatetemplate, circavgtemplate
 from postproengine import compute_axis1axis2_coords
 from collections import OrderedDict
@@ -27,10 +26,7 @@ See README.md for details on the structure of classes here
 """
 
 def loadpickle(picklefile):
-    pfile          = open(picklefile, 'rb')
-    ds             = pickle.load(pfile)
-    pfile.close()
-    return ds
+    return ppsamplexr.loadResultDB(picklefile)
 
 @registerplugin
 class postpro_phaseavgplanes():
@@ -59,19 +55,23 @@ class postpro_phaseavgplanes():
         #{'key':'calcrestress', 'required':False,  'default':False,
         # 'help':'Also calculate Reynolds stresses', },
         {'key':'saveavgpklfile', 'required':False,  'default':'',
-        'help':'Name of pickle file to save average results', },
+        'help':'Name of pickle file to save average results (a .nc name saves a NetCDF result store instead)', },
         {'key':'loadavgpklfile', 'required':False,  'default':'',
-        'help':'Name of pickle file to load average results', },
+        'help':'Name of pickle file to load average results (or @task.name of a result published earlier in the run)', },
         {'key':'loadpklfile', 'required':False,  'default':'',
-        'help':'Load previously computed results from this pickle file', },        
+        'help':'Load previously computed results from this pickle file (or @task.name of a result published earlier in the run)', },        
         {'key':'savepklfile', 'required':False,  'default':'',
-        'help':'Name of pickle file to save results', },
+        'help':'Name of pickle file to save results (a .nc name saves a NetCDF result store instead)', },
         {'key':'group',   'required':False,  'default':None,
          'help':'Which group to pull from netcdf file', },
         {'key':'varnames',  'required':False,  'default':['velocityx', 'velocityy', 'velocityz'],
          'help':'Variables to extract from the netcdf file',},        
         {'key':'axis_rotation',  'required':False,  'default':0,
         'help':'Degrees to rotate axis for velocitya1,a2,a3 transformation',},        
+        {'key':'stats',  'required':False,  'default':['avg'],
+         'help':'Phase statistics to compute in the same pass [Choices: avg, rs, std, min, max, minmax, skew, kurt, moments (std, skew, kurt), triple (triple correlations and TKE transport)]',},
+        {'key':'nphasebins',  'required':False,  'default':1,
+         'help':'Number of phase bins per period (results get a leading bin axis if more than 1, see phasebin in contourplot)',},
     ]
     actionlist = OrderedDict()                    # Dictionary for holding sub-actions    
     example = """
@@ -101,6 +101,24 @@ class postpro_phaseavgplanes():
         if verbose: print('Initialized '+self.name)
         return
 
+    def estimate(self, plane):
+        """
+        Estimate the timesteps, bytes read and peak memory of plane
+        (see postproengine.planUnits).  Only the snapshots around the
+        phase samples are read, so the bytes read are an upper bound.
+        """
+        if len(plane['loadpklfile']) > 0:
+            return planLoaded(plane['loadpklfile'])
+        trange = [plane['tstart'], plane['tend']]
+        info   = getSampleInfo(plane['ncfile'], plane['group'], trange)
+        accum  = ppsamplexr.planeStatsAccumulator(plane['varnames'], stats=plane['stats'])
+        plan   = planStreaming(info, plane['varnames'], accum.narrays()*plane['nphasebins'],
+                               chunkkey=None)
+        if plane['calcavg'] and (len(plane['loadavgpklfile']) == 0):
+            # A second pass for the averages
+            plan['bytesread'] *= 2
+        return plan
+
     def execute(self, verbose=False):
         if verbose: print('Running '+self.name)
         # Loop through and create plots
@@ -115,6 +133,8 @@ class postpro_phaseavgplanes():
             self.varnames = plane['varnames']
             self.axis_rotation = plane['axis_rotation']
             self.calcavg  = plane['calcavg']
+            self.stats    = plane['stats']
+            self.nphasebins = plane['nphasebins']
             #self.calcrestress    = plane['calcrestress']
             self.saveavgpklfile  = plane['saveavgpklfile']
             self.loadavgpklfile  = plane['loadavgpklfile']
@@ -123,28 +143,28 @@ class postpro_phaseavgplanes():
             # Compute or load phase averaging
             if len(loadpkl)>0:
                 # Load from existing file
-                pfile          = open(loadpkl, 'rb')
-                self.dbavg     = pickle.load(pfile)
-                pfile.close()
+                self.dbpavg    = ppsamplexr.loadResultDB(loadpkl)
             else:
                 # Do phase averaging
                 self.dbpavg  = ppsamplexr.phaseAvgPlaneXR(self.ncfile, self.tstart, self.tend, self.tperiod,
                                                           varnames=self.varnames, groupname=self.group, includeattr=True,
-                                                          savepklfile=self.pklfile, verbose=verbose, axis_rotation=self.axis_rotation)
+                                                          savepklfile=self.pklfile, verbose=verbose, axis_rotation=self.axis_rotation,
+                                                          stats=self.stats, nphasebins=self.nphasebins)
 
             # Compute the normal average
             if self.calcavg:  # or self.calcrestress:
                 if len(self.loadavgpklfile)>0:
                     # Load from existing file
-                    pfile     = open(self.loadavgpklfile, 'rb')
-                    dbavg     = pickle.load(pfile)
-                    pfile.close()
+                    dbavg     = ppsamplexr.loadResultDB(self.loadavgpklfile)
                 else:
                     tavg = [self.tstart, self.tend]
                     dbavg  = ppsamplexr.avgPlaneXR(self.ncfile, tavg,
                                                    varnames=self.varnames, groupname=self.group,includeattr=True,
                                                    savepklfile=self.saveavgpklfile, verbose=verbose, axis_rotation=self.axis_rotation)
-                self.dbpavg.update(dbavg)
+                # Keep the phase sample times and header
+                self.dbpavg.update({k:v for k, v in dbavg.items() if k not in self.dbpavg})
+            # Let later tasks in this run use it as @phaseavgplanes.<name>
+            ppsamplexr.publishResult(self.name, plane['name'], self.dbpavg)
 
 
             # Do any sub-actions required for this task
@@ -168,7 +188,7 @@ class postpro_phaseavgplanes():
         required   = False
         actiondefs = [
             {'key':'savepklfile', 'required':False,  'default':'',
-             'help':'Name of pickle file to save phase averaged results', },
+             'help':'Name of pickle file to save phase averaged results (a .nc name saves a NetCDF result store instead)', },
         ]
         def __init__(self, parent, inputs):
             self.actiondict = mergedicts(inputs, self.actiondefs)
@@ -192,14 +212,30 @@ class postpro_phaseavgplanes():
                                                                      savepklfile=savepklfile,
                                                                      groupname=groupname,
                                                                      verbose=self.parent.verbose, includeattr=True,
-                                                                     axis_rotation=self.parent.axis_rotation)
+                                                                     axis_rotation=self.parent.axis_rotation,
+                                                                     nphasebins=self.parent.nphasebins)
             self.parent.dbpavg.update(db_rephavg)
             return
 
     @registeraction(actionlist)
     class contourplot(contourplottemplate):
         actionname = 'contourplot'
+        actiondefs = contourplottemplate.actiondefs + [
+            {'key':'phasebin',  'required':False,  'default':0,
+             'help':'Which phase bin to plot when nphasebins > 1', },
+        ]
         def __init__(self, parent, inputs):
             super().__init__(parent, inputs)
             self.plotdb = self.parent.dbpavg
             return
+
+        def execute(self):
+            # Plot each entry with the phase bin it asks for
+            actiondictlist = self.actiondictlist
+            for actiondict in actiondictlist:
+                self.plotdb = ppsamplexr.selectPhaseBin(self.parent.dbpavg, actiondict['phasebin'])
+                self.actiondictlist = [actiondict]
+                super().execute()
+            self.actiondictlist = actiondictlist
+            self.plotdb = self.parent.dbpavg
+            return
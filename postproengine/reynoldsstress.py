@@ -9,14 +9,13 @@ for x in amrwindfedirs: sys.path.insert(1, x)
 
 from postproengine import registerplugin, mergedicts, registeraction, contourplottemplate
 from postproengine import compute_axis1axis2_coords
+from postproengine import getSampleInfo, planStreaming
 import postproamrwindsample_xarray as ppsamplexr
 import postproamrwindsample as ppsample
 import numpy as np
 import pandas as pd
 import itertools
 import pickle
-import matplotlib.pyplot as plt
-from mpl_toolkits.axes_grid1 import make_axes_locatable
 from postproengine import interpolatetemplate, circavgtemplate,doubleintegraltemplate
 
 """
@@ -43,15 +42,29 @@ class postpro_reynoldsstress():
         {'key':'tavg',    'required':False,  'default':[],
          'help':'Which times to average over', },
         {'key':'meanpklfile', 'required':False,  'default':'',
-        'help':'Name of pickle file which contains mean results', }, 
+        'help':'Name of pickle file which contains mean results (or @task.name of a result published earlier in the run)', }, 
         {'key':'savepklfile', 'required':False,  'default':'',
-        'help':'Name of pickle file to save results', },
+        'help':'Name of pickle file to save results (a .nc name saves a NetCDF result store instead)', },
         {'key':'group',   'required':False,  'default':None,
          'help':'Which group to pull from netcdf file', },
         {'key':'varnames',  'required':False,  'default':['velocityx', 'velocityy', 'velocityz'],
          'help':'Variables to extract from the netcdf file',},                
         {'key':'axis_rotation',  'required':False,  'default':0,
          'help':'Degrees to rotate axis for velocitya1,a2,a3 transformation',},                
+        {'key':'stats',  'required':False,  'default':['avg', 'rs'],
+         'help':'Statistics to compute in the same pass [Choices: avg, rs, std, min, max, minmax, skew, kurt, moments (std, skew, kurt), triple (triple correlations and TKE transport)]',},
+        {'key':'blocksize',  'required':False,  'default':None,
+         'help':'Number of timesteps to read at once (Default: aligned with the file chunks)',},
+        {'key':'nprocs',  'required':False,  'default':1,
+         'help':'Number of processes used to compute the statistics',},
+        {'key':'backend',  'required':False,  'default':'numpy',
+         'help':'How to compute the statistics [Choices: numpy, dask (lazy, out-of-core)]',},
+        {'key':'scheduler',  'required':False,  'default':'threads',
+         'help':'dask scheduler for the dask backend [Choices: threads, processes, synchronous]',},
+        {'key':'resume',  'required':False,  'default':False,
+         'help':'Keep the running statistics next to savepklfile, and only add the new timesteps on later runs (numpy backend)',},
+        {'key':'checkpointsteps',  'required':False,  'default':None,
+         'help':'With resume, also save the running statistics every this many timesteps',},
     ]
     example = """
 reynoldsstress:
@@ -89,6 +102,21 @@ reynoldsstress:
         if verbose: print('Initialized '+self.name)
         return
 
+    def estimate(self, plane):
+        """
+        Estimate the timesteps, bytes read and peak memory of plane
+        (see postproengine.planUnits)
+        """
+        info = getSampleInfo(plane['ncfile'], plane['group'], plane['tavg'] or None)
+        if plane['meanpklfile'] == '':
+            stats, nprocs = ['rs']+list(plane['stats']), plane['nprocs']
+        else:
+            # Only the stresses are computed, around the loaded means
+            stats, nprocs = ['rs'], 1
+        accum = ppsamplexr.planeStatsAccumulator(plane['varnames'], stats=stats)
+        return planStreaming(info, plane['varnames'], accum.narrays(),
+                             blocksize=plane['blocksize'], nprocs=nprocs)
+
     def execute(self, verbose=False):
         if verbose: print('Running '+self.name)
         # Loop through and create plots
@@ -100,6 +128,21 @@ reynoldsstress:
             meanpkl  = plane['meanpklfile']
             self.varnames = plane['varnames']
             self.axis_rotation = plane['axis_rotation']
+            stats    = plane['stats']
+            blocksize= plane['blocksize']
+            nprocs   = plane['nprocs']
+            backend  = plane['backend']
+            scheduler= plane['scheduler']
+            if backend == 'dask':
+                statsfunc = ppsamplexr.lazyStatsPlaneXR
+                statsopts = {'scheduler':scheduler,
+                             'nprocs':nprocs if nprocs > 1 else None}
+            elif backend == 'numpy':
+                statsfunc = ppsamplexr.statsPlaneXR
+                statsopts = {'nprocs':nprocs, 'resume':plane['resume'],
+                             'checkpointsteps':plane['checkpointsteps']}
+            else:
+                raise ValueError('Unknown backend %s'%backend)
 
             # Get the averaging window
             if tavg==[]:
@@ -117,19 +160,30 @@ reynoldsstress:
             if meanpkl == '':
                 meandb = None
             else:
-                # Load it from the pickle file
-                pfile          = open(meanpkl, 'rb')
-                meandb         = pickle.load(pfile)
-                pfile.close()
+                # Load it from the pickle file (or result store)
+                meandb         = ppsamplexr.loadResultDB(meanpkl)
             
             # Get the reynolds-stress averages
-            self.dbReAvg  = ppsamplexr.ReynoldsStress_PlaneXR(ncfile, tavg,
-                                                              avgdb = meandb,
-                                                              varnames=self.varnames,
-                                                              savepklfile=self.pklfile,
-                                                              groupname=group,
-                                                              verbose=verbose, includeattr=True,axis_rotation=self.axis_rotation)
-            
+            if meandb is None:
+                # Compute the means, stresses, and other stats in one pass
+                self.dbReAvg  = statsfunc(ncfile, tavg,
+                                         stats=['rs']+list(stats),
+                                         varnames=self.varnames,
+                                         savepklfile=self.pklfile,
+                                         groupname=group,
+                                         verbose=verbose, includeattr=True,axis_rotation=self.axis_rotation,
+                                         blocksize=blocksize, **statsopts)
+            else:
+                self.dbReAvg  = ppsamplexr.ReynoldsStress_PlaneXR(ncfile, tavg,
+                                                                  avgdb = meandb,
+                                                                  varnames=self.varnames,
+                                                                  savepklfile=self.pklfile,
+                                                                  groupname=group,
+                                                                  verbose=verbose, includeattr=True,axis_rotation=self.axis_rotation,
+                                                                  blocksize=blocksize)
+            # Let later tasks in this run use it as @reynoldsstress.<name>
+            ppsamplexr.publishResult(self.name, plane['name'], self.dbReAvg)
+
             # Do any sub-actions required for this task
             for a in self.actionlist:
                 action = self.actionlist[a]
@@ -227,9 +281,7 @@ reynoldsstress:
 
             # Overwrite picklefile
             if len(self.parent.pklfile)>0:
-                dbfile = open(self.parent.pklfile, 'wb')
-                pickle.dump(self.parent.dbReAvg, dbfile, protocol=2)
-                dbfile.close()
+                ppsamplexr.saveResultDB(self.parent.dbReAvg, self.parent.pklfile)
 
     @registeraction(actionlist)
     class compute_turbulent_fluxes():
@@ -297,9 +349,7 @@ reynoldsstress:
 
             # Overwrite picklefile
             if len(self.parent.pklfile)>0:
-                dbfile = open(self.parent.pklfile, 'wb')
-                pickle.dump(self.parent.dbReAvg, dbfile, protocol=2)
-                dbfile.close()
+                ppsamplexr.saveResultDB(self.parent.dbReAvg, self.parent.pklfile)
 
     @registeraction(actionlist)
     class contourplot(contourplottemplate):
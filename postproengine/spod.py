@@ -9,6 +9,7 @@ for x in amrwindfedirs: sys.path.insert(1, x)
 
 from postproengine import registerplugin, mergedicts, registeraction
 from postproengine import compute_axis1axis2_coords, get_mapping_xyz_to_axis1axis2
+from postproengine import getSampleInfo, planInMemory
 import postproamrwindsample_xarray as ppsamplexr
 import postproamrwindsample as ppsample
 import pickle
@@ -367,16 +368,19 @@ def extract_1d_from_meshgrid(Z):
         return unique_cols[:, 0],0
 
 
-def read_cart_data(ncfile,varnames,group,trange,iplanes,xaxis,yaxis):
+def read_cart_data(ncfile,varnames,group,trange,iplanes,xaxis,yaxis,scratchdir=None,dtype=np.float64):
 
-    db = ppsamplexr.getPlaneXR(ncfile,[0,1],varnames,groupname=group,verbose=0,includeattr=True,gettimes=True,timerange=trange)
+    if (iplanes is not None) and (not isinstance(iplanes, list)): iplanes = [iplanes,]
+    # Only read the requested planes
+    db = ppsamplexr.getPlaneXR(ncfile,[0,1],varnames,groupname=group,verbose=0,includeattr=True,gettimes=True,timerange=trange,
+                               contiguous=True,scratchdir=scratchdir,iplanes=iplanes,dtype=dtype)
     if iplanes == None: 
         if isinstance(db['offsets'], np.ndarray):
             iplanes = list(range(len(db['offsets'])))
         else:
             iplanes = [0,]
-
-    if not isinstance(iplanes, list): iplanes = [iplanes,]
+    # Position of each plane along k in the arrays read
+    kplane = lambda iplane: db['iplanes'].index(iplane) if 'iplanes' in db else iplane
 
     if ('a1' in [xaxis, yaxis]) or ('a2' in [xaxis, yaxis]) or ('a3' in [xaxis, yaxis]):
         compute_axis1axis2_coords(db,rot=0)
@@ -396,30 +400,18 @@ def read_cart_data(ncfile,varnames,group,trange,iplanes,xaxis,yaxis):
         if ('a1' in [xaxis, yaxis]) or ('a2' in [xaxis, yaxis]) or ('a3' in [xaxis, yaxis]):
             xc[iplaneiter] = origina1a2a3[-1] + offsets[iplane]
         else:
-            xc[iplaneiter] = db['x'][iplane,0,0]
-        y,axisy = extract_1d_from_meshgrid(YY[iplane,:,:])
-        z,axisz = extract_1d_from_meshgrid(ZZ[iplane,:,:])
-        permutation = [0,axisz+1,axisy+1]
-        udata[iplane] = np.zeros((len(t),len(z),len(y),3))
-        for i,tstep in enumerate(db['timesteps']):
-            if ('velocitya' in varnames[0]) or ('velocitya' in varnames[1]) or ('velocitya' in varnames[2]):
-                ordered_data = np.transpose(np.array(db['velocitya3'][tstep]),permutation)
-                udata[iplane][i,:,:,0] = ordered_data[iplane,:,:]
-
-                ordered_data = np.transpose(np.array(db['velocity'+xaxis][tstep]),permutation)
-                udata[iplane][i,:,:,1] = ordered_data[iplane,:,:]
-
-                ordered_data = np.transpose(np.array(db['velocity'+yaxis][tstep]),permutation)
-                udata[iplane][i,:,:,2] = ordered_data[iplane,:,:]
-            else:
-                ordered_data = np.transpose(np.array(db['velocityx'][tstep]),permutation)
-                udata[iplane][i,:,:,0] = ordered_data[iplane,:,:]
-
-                ordered_data = np.transpose(np.array(db['velocityy'][tstep]),permutation)
-                udata[iplane][i,:,:,1] = ordered_data[iplane,:,:]
-
-                ordered_data = np.transpose(np.array(db['velocityz'][tstep]),permutation)
-                udata[iplane][i,:,:,2] = ordered_data[iplane,:,:]
+            xc[iplaneiter] = db['x'][kplane(iplane),0,0]
+        y,axisy = extract_1d_from_meshgrid(YY[kplane(iplane),:,:])
+        z,axisz = extract_1d_from_meshgrid(ZZ[kplane(iplane),:,:])
+        # db[v] is (time, k, j, i), so shift the permutation by one
+        permutation = [0,1,axisz+2,axisy+2]
+        udata[iplane] = np.zeros((len(t),len(z),len(y),3),dtype=dtype)
+        if ('velocitya' in varnames[0]) or ('velocitya' in varnames[1]) or ('velocitya' in varnames[2]):
+            components = ['velocitya3', 'velocity'+xaxis, 'velocity'+yaxis]
+        else:
+            components = ['velocityx', 'velocityy', 'velocityz']
+        for icomp, v in enumerate(components):
+            udata[iplane][:,:,:,icomp] = np.transpose(db[v],permutation)[:,kplane(iplane),:,:]
 
     return udata , xc, y , z , t, iplanes 
 
@@ -643,7 +635,7 @@ class postpro_spod():
             'help':'List of correlations to include in SPOD. Separate U,V,W components with dash. Examples: U-V-W, U,V,W,V-W ', },
         {'key':'output_dir',  'required':False,  'default':'./','help':'Directory to save results'},
         {'key':'savepklfile', 'required':False,  'default':'',
-        'help':'Name of pickle file to save results', },
+        'help':'Name of pickle file to save results (a .nc name saves a NetCDF result store instead)', },
         {'key':'loadpklfile', 'required':False,  'default':None,
         'help':'Name of pickle file to load to perform actions', },
         {'key':'compute_eigen_vectors', 'required':False,  'default':True,
@@ -662,6 +654,10 @@ class postpro_spod():
          'help':'Print extra information.',},        
         {'key':'nowindow',  'required':False,  'default':False,
          'help':'Do not window time fourier transform with single block (e.g.,, for periodic signals in time).',},        
+        {'key':'scratchdir',  'required':False,  'default':None,
+         'help':'Directory for memory-mapped scratch storage of the plane snapshots (Default: keep in memory)',},
+        {'key':'dtype',  'required':False,  'default':None,
+         'help':'Precision of the snapshots and the FFT/SVD inputs, eigenvalues are kept in double precision [Choices: float32, float64] (Default: float64)',},
         
     ]
     example = """
@@ -719,6 +715,40 @@ spod:
             self.yamldictlist.append(mergedicts(indict, self.inputdefs))
         if verbose: print('Initialized '+self.name)
         return
+
+    def estimate(self, plane):
+        """
+        Estimate the timesteps, bytes read and peak memory of plane
+        (see postproengine.planUnits).  The peak is when the snapshots,
+        the cartesian velocities of every plane, and the polar
+        velocities and their Fourier transforms in time (udata_that)
+        and in theta (udata_rhat) are all held at once.
+        """
+        trange  = plane['trange'] if len(plane['trange']) > 0 else None
+        info    = getSampleInfo(plane['ncfile'], plane['group'], trange)
+        ni, nj, nk = info['ijk_dims']
+        iplanes = plane['iplane']
+        nplanes = nk if iplanes is None else len(np.atleast_1d(iplanes))
+        nt      = info['ntimes']
+        NR, NTheta = plane['NR'], plane['NTheta']
+        itemsize   = np.dtype(plane['dtype'] if plane['dtype'] else np.float64).itemsize
+        if plane['nowindow']:
+            NB, Nkt = 1, nt//2+1
+        else:
+            nperseg = plane['nperseg'] if plane['nperseg'] is not None else nt
+            NB, Nkt = nt//max(1, nperseg//2)+1, nperseg//2+1
+        polar   = NR*NTheta*nt*3*itemsize
+        fourier = 2*NR*NTheta*NB*Nkt*3*(2*itemsize)
+        modes   = 0
+        if plane['compute_eigen_vectors']:
+            for corr in np.atleast_1d(plane['correlations']):
+                modes += NR*NTheta*Nkt*NB*len(corr.split('-'))*16
+        plan = planInMemory(info, plane['varnames'], npoints=ni*nj*nplanes,
+                            workitemsize=itemsize, copies=2,
+                            extrabytes=polar+fourier+modes,
+                            scratchdir=plane['scratchdir'])
+        plan['notes'].append('%i blocks, %i frequencies'%(NB, Nkt))
+        return plan
     
     def execute(self, verbose=False):
         print('Running '+self.name)
@@ -752,6 +782,10 @@ spod:
             self.varnames = plane['varnames']
             self.verbose = plane['verbose']
             self.nowindow = plane['nowindow']
+            scratchdir    = plane['scratchdir']
+            # Working precision for the snapshots and the FFT/SVD inputs
+            dtype         = np.float64 if plane['dtype'] is None else ppsamplexr.getWorkingDtype(plane['dtype'])
+            cdtype        = np.result_type(dtype, np.complex64)
 
 
             #Get all times if not specified 
@@ -761,7 +795,8 @@ spod:
             if not wake_center_files == None and not isinstance(wake_center_files, list): wake_center_files = [wake_center_files,]
             if self.verbose:
                 print("--> Reading in velocity data",flush=True)
-            udata_cart,xcs,y,z,self.times,iplanes = read_cart_data(ncfile,self.varnames,group,self.trange,iplanes,self.xaxis,self.yaxis)
+            udata_cart,xcs,y,z,self.times,iplanes = read_cart_data(ncfile,self.varnames,group,self.trange,iplanes,self.xaxis,self.yaxis,
+                                                                     scratchdir=scratchdir,dtype=dtype)
             #file = 'ucart_data_pulse.pkl'
             #file = 'ucart_data.pkl'
             # with open(file,'wb') as f:
@@ -822,7 +857,7 @@ spod:
                         if self.verbose:
                             print("--> Centering on middle of yaxis: ",zcenter,flush=True)
 
-                self.udata_polar = np.zeros((NR,NTheta,len(tsteps),len(components)))
+                self.udata_polar = np.zeros((NR,NTheta,len(tsteps),len(components)),dtype=dtype)
                 for titer , t in enumerate(tsteps):
                     for compind in range(len(components)):
                         if zcenter-LR < 0:
@@ -862,7 +897,7 @@ spod:
 
                 if self.verbose:
                     print("--> Fourier transforming in time (number of blocks = "+str(NB) + ")",flush=True)
-                self.udata_that = np.zeros((NR,NTheta,NB,Nkt,3),dtype=complex)
+                self.udata_that = np.zeros((NR,NTheta,NB,Nkt,3),dtype=cdtype)
                 for rind in np.arange(0,len(r)):
                     for thetaind in np.arange(0,len(theta)):
                         for compind,comp in enumerate(components):
@@ -880,7 +915,7 @@ spod:
                 if self.verbose:
                     print("--> Fourier transforming in Theta",flush=True)
                 NkTheta = int(NTheta)
-                self.udata_rhat = np.zeros((NR,NkTheta,NB,Nkt,len(components)),dtype=complex)
+                self.udata_rhat = np.zeros((NR,NkTheta,NB,Nkt,len(components)),dtype=cdtype)
                 for rind in np.arange(0,NR):
                     for block in np.arange(0,NB):
                         for ktind in np.arange(0,Nkt):
@@ -924,7 +959,7 @@ spod:
                         corr_inds = [corr_dict[corr.upper()] for corr in comp_corr]
 
                         W = np.kron(np.eye(len(corr_inds)),self.W1D)
-                        Wsqrt = np.sqrt(W)
+                        Wsqrt = np.sqrt(W).astype(dtype)
                         Wsqrtinv = np.zeros_like(Wsqrt)
                         for i in range(NR*len(corr_inds)):
                             if (Wsqrt[i,i]==0):
@@ -947,7 +982,7 @@ spod:
                                 #POD_Mat = np.zeros((NR*len(corr_inds),NB),dtype=complex)
                                 #for corr_ind_iter , corr_ind in enumerate(corr_inds):
                                     #POD_Mat[corr_ind_iter*NR:NR*(corr_ind_iter+1),0:NB] = np.copy(self.udata_rhat[:,ktheta_ind,:,tfreq_ind,corr_ind])
-                                POD_Mat_scaled = np.sqrt(scaling_factor_k) * np.dot(Wsqrt,POD_Mat)
+                                POD_Mat_scaled = float(np.sqrt(scaling_factor_k)) * np.dot(Wsqrt,POD_Mat)
                                 
                                 if compute_eigen_vectors:
                                     lsvd, ssvd, rsvd = np.linalg.svd(POD_Mat_scaled,full_matrices=False,compute_uv=True)
@@ -994,11 +1029,14 @@ spod:
                         objects = [] 
                         objects.append(self.POD_eigenvalues)
                         objects.append(self.variables)
+                        objectnames = ['POD_eigenvalues', 'variables']
                         if sort:
                             objects.append(self.sorted_inds)
+                            objectnames.append('sorted_inds')
 
 
                         if compute_eigen_vectors:
+                            objectnames += ['POD_modes', 'POD_proj_coeff']
                             if save_num_modes == None:
                                 objects.append(self.POD_modes)
                                 if save_proj_coeff:
@@ -1022,23 +1060,36 @@ spod:
                                         save_proj_coeff[corr][mode,:] = compute_projection_coefficient(self.udata_rhat[:,ktheta_ind,:,angfreq_ind,:],save_modes[corr][mode,:,:],corr,NR,NB,W)
                                 objects.append(save_modes)
                                 objects.append(save_proj_coeff)
-                        with open(savefilename, 'wb') as f:
-                            for obj in objects:
-                                pickle.dump(obj, f)
+                        if ppsamplexr.isResultStore(savefilename):
+                            ppsamplexr.saveResultDB(dict(zip(objectnames, objects)), savefilename)
+                        else:
+                            with open(savefilename, 'wb') as f:
+                                for obj in objects:
+                                    pickle.dump(obj, f)
 
                 if loadpklfile!=None:
                     print("--> Loading from: ",loadpklfile,flush=True)
-                    with open(loadpklfile, 'rb') as f:
-                        self.POD_eigenvalues = pickle.load(f)
-                        self.variables = pickle.load(f)
+                    if ppsamplexr.isResultStore(loadpklfile):
+                        db = ppsamplexr.loadResultDB(loadpklfile)
+                        self.POD_eigenvalues = db['POD_eigenvalues']
+                        self.variables = db['variables']
                         if sort:
-                            self.sorted_inds = pickle.load(f)
+                            self.sorted_inds = db['sorted_inds']
                         if compute_eigen_vectors:
-                            self.POD_modes      = pickle.load(f)
-                            try:
-                                self.POD_proj_coeff = pickle.load(f)
-                            except:
-                                self.POD_proj_coeff = None
+                            self.POD_modes      = db['POD_modes']
+                            self.POD_proj_coeff = db.get('POD_proj_coeff', None)
+                    else:
+                        with open(loadpklfile, 'rb') as f:
+                            self.POD_eigenvalues = pickle.load(f)
+                            self.variables = pickle.load(f)
+                            if sort:
+                                self.sorted_inds = pickle.load(f)
+                            if compute_eigen_vectors:
+                                self.POD_modes      = pickle.load(f)
+                                try:
+                                    self.POD_proj_coeff = pickle.load(f)
+                                except:
+                                    self.POD_proj_coeff = None
 
                 # Do any sub-actions required for this task for each plane
                 for a in self.actionlist:
@@ -9,29 +9,18 @@ for x in amrwindfedirs: sys.path.insert(1, x)
 
 from postproengine import registerplugin, mergedicts, registeraction
 from postproengine import compute_axis1axis2_coords, get_mapping_xyz_to_axis1axis2
+from postproengine import getSampleInfo, planInMemory
 import postproamrwindsample_xarray as ppsamplexr
 import postproamrwindsample as ppsample
 import numpy as np
 import pandas as pd
 import os
 import pickle
-import matplotlib.pyplot as plt
-from mpl_toolkits.axes_grid1 import make_axes_locatable
 import importlib.util
 import sys
 
-# Add check for samwich package
-name = 'samwich'
-spec = importlib.util.find_spec(name)
-if spec is not None:
-    module = importlib.util.module_from_spec(spec)
-    sys.modules[name] = module
-    spec.loader.exec_module(module)
-    from samwich.dataloaders import PlanarData
-    from samwich.waketrackers import track,Plotter
-    usesamwich=True
-else:
-    usesamwich=False
+# Add check for samwich package, which is only imported when used
+usesamwich = importlib.util.find_spec('samwich') is not None
 
 """
 Plugin for computing wake meandering statistics
@@ -40,6 +29,8 @@ See README.md for details on the structure of classes here
 """
 
 def get_wake_centers(u,YY,ZZ,method='ConstantArea',weighted_center=True,args=None):
+    from samwich.dataloaders import PlanarData
+    from samwich.waketrackers import track
     datadict = {}
     datadict['y'] = np.copy(YY[:,:].T)
     y_grid_center = (datadict['y'][-1,0] + datadict['y'][0,0])/2.0 
@@ -112,6 +103,12 @@ class postpro_wakemeander():
         'help':'Which axis to use on the abscissa', },
         {'key':'yaxis',    'required':False,  'default':'z',
         'help':'Which axis to use on the ordinate', },
+        {'key':'scratchdir',  'required':False,  'default':None,
+         'help':'Directory for memory-mapped scratch storage of the plane snapshots (Default: keep in memory)',},
+        {'key':'dtype',  'required':False,  'default':None,
+         'help':'Precision to store the plane snapshots in [Choices: float32, float64] (Default: float64)',},
+        {'key':'resume',  'required':False,  'default':False,
+         'help':'Only compute the wake centers after the last time in the savefile csv files, and append them (the wake object in savepklfile only has the new times)',},
     ]
     example = """
     wake_meander:
@@ -169,6 +166,41 @@ class postpro_wakemeander():
         if unique_cols.shape[1] == 1:
             return unique_cols[:, 0],0
     
+    def estimate(self, entry):
+        """
+        Estimate the timesteps, bytes read and peak memory of entry
+        (see postproengine.planUnits).  The snapshots and the velocities
+        of every plane are held at once, plus a copy of one plane while
+        its wake centers are found.
+        """
+        info    = getSampleInfo(entry['ncfile'], entry['group'], entry['trange'])
+        ni, nj, nk = info['ijk_dims']
+        iplanes = entry['iplane']
+        nplanes = nk if iplanes is None else len(np.atleast_1d(iplanes))
+        itemsize = np.dtype(entry['dtype']).itemsize if entry['dtype'] else None
+        plan = planInMemory(info, entry['varnames'], npoints=ni*nj*nplanes,
+                            workitemsize=itemsize, copies=2,
+                            scratchdir=entry['scratchdir'])
+        plan['peakbytes'] += plan['snapshotbytes']//nplanes
+        return plan
+
+    def getResumeCenters(self, entry, iplanes):
+        """
+        Load the wake centers saved by an earlier run.  Returns
+        (oldcenters, tlast), where oldcenters has the dataframe of each
+        plane and tlast is the last time saved for all of the planes
+        (None if any plane has nothing saved yet).
+        """
+        oldcenters = {}
+        for iplane in iplanes:
+            fname = os.path.join(entry['output_dir'], entry['savefile'].format(iplane=iplane))
+            if os.path.isfile(fname):
+                oldcenters[iplane] = pd.read_csv(fname)
+        if (len(oldcenters) < len(iplanes)) or any([len(df) == 0 for df in oldcenters.values()]):
+            return {}, None
+        tlast = min([df['t'].iloc[-1] for df in oldcenters.values()])
+        return oldcenters, tlast
+
     def execute(self, verbose=False):
         if verbose: print('Running '+self.name)
         # Loop through and create plots
@@ -193,6 +225,8 @@ class postpro_wakemeander():
             self.output_dir =  entry['output_dir']
             self.axis_rotation = entry['axis_rotation']
             savepklfile  = entry['savepklfile']
+            scratchdir   = entry['scratchdir']
+            dtype        = np.float64 if entry['dtype'] is None else ppsamplexr.getWorkingDtype(entry['dtype'])
 
             #Get all times if not specified 
             filelist = []
@@ -201,14 +235,36 @@ class postpro_wakemeander():
 
             udata = {}
             xc = {}
-            self.db = ppsamplexr.getPlaneXR(ncfile,[0,1],self.varnames,groupname=group,verbose=0,includeattr=True,gettimes=True,timerange=trange)
+            if (iplanes is not None) and (not isinstance(iplanes, list)): iplanes = [iplanes,]
+
+            # Only compute the times after the ones already saved
+            oldcenters, tlast = {}, None
+            if entry['resume'] and (len(savefile) > 0):
+                if iplanes is None:
+                    ncdat = ppsample.loadDataset(ppsamplexr.getFileList(ncfile)[0])
+                    grp   = ncdat[ppsample.getGroups(ncdat)[0] if group is None else group]
+                    iplanes = list(range(int(grp.ijk_dims[2])))
+                oldcenters, tlast = self.getResumeCenters(entry, iplanes)
+            if tlast is not None:
+                eps   = 1.0E-10
+                tvec  = ppsample.timeIndex(ppsamplexr.getFileList(ncfile)).times
+                tnew  = tvec[(tvec > tlast+eps) & (tvec >= trange[0]-eps) & (tvec <= trange[1]+eps)]
+                if len(tnew) == 0:
+                    print("No new times for %s after t=%g"%(entry['name'], tlast))
+                    continue
+                if verbose: print("Resuming %s after t=%g"%(entry['name'], tlast))
+                trange = [tnew[0], tnew[-1]]
+            # Only read the requested planes
+            self.db = ppsamplexr.getPlaneXR(ncfile,[0,1],self.varnames,groupname=group,verbose=0,includeattr=True,gettimes=True,timerange=trange,
+                                            contiguous=True,scratchdir=scratchdir,iplanes=iplanes,dtype=dtype)
 
             if iplanes == None: 
                 try:
                     iplanes = list(range(len(self.db['offsets'])))
                 except:
                     iplanes = [0,]
-            if not isinstance(iplanes, list): iplanes = [iplanes,]
+            # Position of each plane along k in the arrays read
+            kplane = lambda iplane: self.db['iplanes'].index(iplane) if 'iplanes' in self.db else iplane
 
             # Convert to native axis1/axis2 coordinates if necessary
             self.natural_axes = False
@@ -234,36 +290,24 @@ class postpro_wakemeander():
             for iplane in iplanes:
                 YY = np.array(self.db[self.xaxis])
                 ZZ = np.array(self.db[self.yaxis])
-                y,axisy = self.extract_1d_from_meshgrid(YY[iplane,:,:])
-                z,axisz = self.extract_1d_from_meshgrid(ZZ[iplane,:,:])
+                y,axisy = self.extract_1d_from_meshgrid(YY[kplane(iplane),:,:])
+                z,axisz = self.extract_1d_from_meshgrid(ZZ[kplane(iplane),:,:])
 
                 if not self.natural_axes:
-                    xc[iplane] = self.db['x'][iplane,0,0]
+                    xc[iplane] = self.db['x'][kplane(iplane),0,0]
                 else:
                     xc[iplane] = origina1a2a3[-1] + offsets[iplane]
 
-                udata[iplane] = np.zeros((len(t),len(y),len(z),3))
-
-                permutation = [0,axisy+1,axisz+1]
-                for i,tstep in enumerate(self.db['timesteps']):
-                    if natural_velocities:
-                        ordered_data = np.transpose(np.array(self.db['velocitya3'][tstep]),permutation)
-                        udata[iplane][i,:,:,0] = ordered_data[iplane,:,:]
-
-                        ordered_data = np.transpose(np.array(self.db['velocity'+self.xaxis][tstep]),permutation)
-                        udata[iplane][i,:,:,1] = ordered_data[iplane,:,:]
+                udata[iplane] = np.zeros((len(t),len(y),len(z),3),dtype=dtype)
 
-                        ordered_data = np.transpose(np.array(self.db['velocity'+self.yaxis][tstep]),permutation)
-                        udata[iplane][i,:,:,2] = ordered_data[iplane,:,:]
-                    else:
-                        ordered_data = np.transpose(np.array(self.db['velocityx'][tstep]),permutation)
-                        udata[iplane][i,:,:,0] = ordered_data[iplane,:,:]
-
-                        ordered_data = np.transpose(np.array(self.db['velocityy'][tstep]),permutation)
-                        udata[iplane][i,:,:,1] = ordered_data[iplane,:,:]
-
-                        ordered_data = np.transpose(np.array(self.db['velocityz'][tstep]),permutation)
-                        udata[iplane][i,:,:,2] = ordered_data[iplane,:,:]
+                # self.db[v] is (time, k, j, i)
+                permutation = [0,1,axisy+2,axisz+2]
+                if natural_velocities:
+                    components = ['velocitya3', 'velocity'+self.xaxis, 'velocity'+self.yaxis]
+                else:
+                    components = ['velocityx', 'velocityy', 'velocityz']
+                for icomp, v in enumerate(components):
+                    udata[iplane][:,:,:,icomp] = np.transpose(self.db[v],permutation)[:,kplane(iplane),:,:]
 
             YY , ZZ = np.meshgrid(y,z)
             arg=None
@@ -294,6 +338,9 @@ class postpro_wakemeander():
                     sys.exit()
 
                 self.wake, self.dfcenters[self.xaxis+'c'], self.dfcenters[self.yaxis+'c'] = get_wake_centers(udata[iplane],YY,ZZ,method=method,weighted_center=weighted_center,args=arg)
+                if iplane in oldcenters:
+                    old = oldcenters[iplane]
+                    self.dfcenters = pd.concat([old[old['t'] <= tlast], self.dfcenters], ignore_index=True)
 
                 if not os.path.exists(self.output_dir):
                     os.makedirs(self.output_dir)
@@ -354,6 +401,7 @@ class postpro_wakemeander():
             return
 
         def execute(self):
+            import matplotlib.pyplot as plt
             print('Executing '+self.actionname)
             figsize  = self.actiondict['figsize']
             dpi      = self.actiondict['dpi']
@@ -402,7 +450,7 @@ class postpro_wakemeander():
         {'key':'compute_uv',  'required':False,  'default':False,
          'help':'Boolean to compute eigenvectors of PCA', },
         {'key':'pklfile',  'required':False,  'default':"",
-         'help':'File to save eigenvectors of PCA', },
+         'help':'File to save eigenvectors of PCA (a .nc name saves a NetCDF result store instead)', },
         ]
         
         def __init__(self, parent, inputs):
@@ -477,8 +525,11 @@ class postpro_wakemeander():
                     wake_meandering_stats['aniso_std']  = np.std(eig_ratio)
                     if compute_uv:
                         savefname = os.path.join(self.parent.output_dir, pklfile)
-                        with open(savefname, 'wb') as file:
-                            pickle.dump(pcs, file)
+                        if ppsamplexr.isResultStore(savefname):
+                            ppsamplexr.saveResultDB({'pcs':pcs}, savefname)
+                        else:
+                            with open(savefname, 'wb') as file:
+                                pickle.dump(pcs, file)
                 except:
                     print("Error computing PCA for ansitropy metric")
 
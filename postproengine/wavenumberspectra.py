@@ -10,8 +10,10 @@ amrwindfedirs = ['../',
 for x in amrwindfedirs: sys.path.insert(1, x)
 
 from postproengine import registerplugin, mergedicts, registeraction, extract_1d_from_meshgrid
+from postproengine import getSampleInfo, planInMemory
 import windspectra
 import postproamrwindsample_xarray as ppsamplexr
+import postproamrwindsample as ppsample
 import numpy as np
 import pandas as pd
 import postproamrwindabl as ppabl
@@ -27,14 +29,39 @@ def get_angular_wavenumbers(N,L):
         counter += 1
     return k
 
-def read_cart_data(ncfile,varnames,group,trange,iplanes,xaxis,yaxis):
-    db = ppsamplexr.getPlaneXR(ncfile,[0,1],varnames,groupname=group,verbose=0,includeattr=True,gettimes=True,timerange=trange)
+def accumulateSpectra(state, uhats):
+    """
+    Add the Fourier transforms uhats (one (time, kx, ky) array per
+    velocity component) to the running mean and sum of squared
+    deviations from the mean in state, using the pairwise update of
+    Chan et al.  M2/count is then the same as the time average of
+    |uhat|^2 of the fluctuations.  Returns the updated state.
+    """
+    nb = uhats[0].shape[0]
+    bmean = [u.mean(axis=0) for u in uhats]
+    bM2   = [(np.abs(u - m)**2).sum(axis=0) for u, m in zip(uhats, bmean)]
+    if (state is None) or (state['count'] == 0):
+        return {'count':nb, 'mean':bmean, 'M2':bM2}
+    n = state['count'] + nb
+    for i in range(len(uhats)):
+        delta = bmean[i] - state['mean'][i]
+        state['M2'][i]   = state['M2'][i] + bM2[i] + np.abs(delta)**2*state['count']*nb/n
+        state['mean'][i] = state['mean'][i] + delta*nb/n
+    state['count'] = n
+    return state
+
+def read_cart_data(ncfile,varnames,group,trange,iplanes,xaxis,yaxis,scratchdir=None):
+    if (iplanes is not None) and (not isinstance(iplanes, list)): iplanes = [iplanes,]
+    # Only read the requested planes
+    db = ppsamplexr.getPlaneXR(ncfile,[0,1],varnames,groupname=group,verbose=0,includeattr=True,gettimes=True,timerange=trange,
+                               contiguous=True,scratchdir=scratchdir,iplanes=iplanes)
     if iplanes == None: 
         if isinstance(db['offsets'], np.ndarray):
             iplanes = list(range(len(db['offsets'])))
         else:
             iplanes = [0,]
-    if not isinstance(iplanes, list): iplanes = [iplanes,]
+    # Position of each plane along k in the arrays read
+    kplane = lambda iplane: db['iplanes'].index(iplane) if 'iplanes' in db else iplane
     if ('a1' in [xaxis, yaxis]) or ('a2' in [xaxis, yaxis]) or ('a3' in [xaxis, yaxis]):
         compute_axis1axis2_coords(db,rot=0)
         R = get_mapping_xyz_to_axis1axis2(db['axis1'],db['axis2'],db['axis3'],rot=0)
@@ -54,33 +81,20 @@ def read_cart_data(ncfile,varnames,group,trange,iplanes,xaxis,yaxis):
         if ('a1' in [xaxis, yaxis]) or ('a2' in [xaxis, yaxis]) or ('a3' in [xaxis, yaxis]):
             heights[iplaneiter] = origina1a2a3[-1] + offsets[iplane]
         else:
-            heights[iplaneiter] = db['z'][iplane,0,0]
+            heights[iplaneiter] = db['z'][kplane(iplane),0,0]
 
-        x,axisx = extract_1d_from_meshgrid(XX[iplane,:,:])
-        y,axisy = extract_1d_from_meshgrid(YY[iplane,:,:])
+        x,axisx = extract_1d_from_meshgrid(XX[kplane(iplane),:,:])
+        y,axisy = extract_1d_from_meshgrid(YY[kplane(iplane),:,:])
 
-        #set data to time,x,y
-        permutation = [0,axisx+1,axisy+1]
+        #set data to time,x,y (db[v] is time,k,j,i)
+        permutation = [0,1,axisx+2,axisy+2]
         udata[iplane] = np.zeros((len(t),len(x),len(y),3))
-        for i,tstep in enumerate(db['timesteps']):
-            if ('velocitya' in varnames[0]) or ('velocitya' in varnames[1]) or ('velocitya' in varnames[2]):
-                ordered_data = np.transpose(np.array(db['velocitya3'][tstep]),permutation)
-                udata[iplane][i,:,:,0] = ordered_data[iplane,:,:]
-
-                ordered_data = np.transpose(np.array(db['velocity'+xaxis][tstep]),permutation)
-                udata[iplane][i,:,:,1] = ordered_data[iplane,:,:]
-
-                ordered_data = np.transpose(np.array(db['velocity'+yaxis][tstep]),permutation)
-                udata[iplane][i,:,:,2] = ordered_data[iplane,:,:]
-            else:
-                ordered_data = np.transpose(np.array(db['velocityx'][tstep]),permutation)
-                udata[iplane][i,:,:,0] = ordered_data[iplane,:,:]
-
-                ordered_data = np.transpose(np.array(db['velocityy'][tstep]),permutation)
-                udata[iplane][i,:,:,1] = ordered_data[iplane,:,:]
-
-                ordered_data = np.transpose(np.array(db['velocityz'][tstep]),permutation)
-                udata[iplane][i,:,:,2] = ordered_data[iplane,:,:]
+        if ('velocitya' in varnames[0]) or ('velocitya' in varnames[1]) or ('velocitya' in varnames[2]):
+            components = ['velocitya3', 'velocity'+xaxis, 'velocity'+yaxis]
+        else:
+            components = ['velocityx', 'velocityy', 'velocityz']
+        for icomp, v in enumerate(components):
+            udata[iplane][:,:,:,icomp] = np.transpose(db[v],permutation)[:,kplane(iplane),:,:]
     return udata , heights, x , y , t, iplanes 
 @registerplugin
 class wavenumberspectra_executor():
@@ -111,6 +125,8 @@ class wavenumberspectra_executor():
         {'key':'diss_rate',    'required':False,  'default':1.0,'help':'Dissipation rate for theoretical spectra', },
         {'key':'remove_endpoint_x','required':False,  'default':False,'help':'Remove one endpoint in x before FFT if periodic signal is sampled twice at endpoints.', },
         {'key':'remove_endpoint_y','required':False,  'default':False,'help':'Remove one endpoint in y before FFT if periodic signal is sampled twice at endpoints.', },
+        {'key':'scratchdir','required':False,  'default':None,'help':'Directory for memory-mapped scratch storage of the plane snapshots (Default: keep in memory)', },
+        {'key':'resume','required':False,  'default':False,'help':'Keep the running spectra next to csvfile, and only add the new timesteps on later runs', },
     ]
     actionlist = {}                    # Dictionary for holding sub-actions
     example = """
@@ -159,6 +175,24 @@ class wavenumberspectra_executor():
 
         return kmag_centers,E_spec
     
+    def estimate(self, plane):
+        """
+        Estimate the timesteps, bytes read and peak memory of plane
+        (see postproengine.planUnits).  The snapshots and the velocities
+        of every plane are held at once, plus the fluctuations and the
+        Fourier transforms of one plane.
+        """
+        info    = getSampleInfo(plane['ncfile'], plane['group'], plane['trange'])
+        ni, nj, nk = info['ijk_dims']
+        iplanes = plane['iplanes']
+        nplanes = nk if iplanes is None else len(np.atleast_1d(iplanes))
+        # float64 fluctuations, and the complex transforms of 3 components
+        # (and the intermediate transform along the first axis)
+        extra   = info['ntimes']*ni*nj*3*(8 + 2*16)
+        return planInMemory(info, plane['varnames'], npoints=ni*nj*nplanes,
+                            workitemsize=8, copies=2, extrabytes=extra,
+                            scratchdir=plane['scratchdir'])
+    
     def execute(self, verbose=False):
         # Do any task-related here
         if verbose: print('Running '+self.name)
@@ -178,17 +212,43 @@ class wavenumberspectra_executor():
             diss_rate = plane['diss_rate']
             remove_endpoint_x = plane['remove_endpoint_x']
             remove_endpoint_y = plane['remove_endpoint_y']
+            scratchdir = plane['scratchdir']
             if not isinstance(type_spec, list): type_spec = [type_spec,]
 
+            # Pick up the running spectra saved by an earlier run
+            statefile, state, oldtimes = None, {}, []
+            if plane['resume']:
+                statefile = ppsamplexr.getStateFile(csvfile)
+                settings  = {'varnames':list(varnames), 'group':group, 'iplanes':iplanes,
+                             'xaxis':xaxis, 'yaxis':yaxis, 'tstart':float(trange[0]),
+                             'remove_endpoint_x':remove_endpoint_x,
+                             'remove_endpoint_y':remove_endpoint_y}
+                saved = ppsamplexr.loadStatsState(statefile, settings, trange[1])
+                if (saved is not None) and (len(saved['times']) > 0):
+                    eps   = 1.0E-10
+                    tvec  = ppsample.timeIndex(ppsamplexr.getFileList(ncfile)).times
+                    tnew  = tvec[(tvec > saved['times'][-1]+eps) & (tvec <= trange[1]+eps)]
+                    if len(tnew) == 0:
+                        print("No new times for %s after t=%g"%(plane['name'], saved['times'][-1]))
+                        continue
+                    if verbose: print("Resuming %s from %s"%(plane['name'], statefile))
+                    state, oldtimes = saved['state'], saved['times']
+                    trange = [tnew[0], tnew[-1]]
+
             # Read in the cartesian data
-            udata_cart,heights,x,y,times,iplanes = read_cart_data(ncfile,varnames,group,trange,iplanes,xaxis,yaxis)
+            udata_cart,heights,x,y,times,iplanes = read_cart_data(ncfile,varnames,group,trange,iplanes,xaxis,yaxis,
+                                                                  scratchdir=scratchdir)
             #udata[iplane] = np.zeros((len(t),len(x),len(y),3))
 
             E_spec = {}
             for iplane in iplanes:
-                #subtract temporal mean of velocity components
-                udata_mean = np.mean(udata_cart[iplane],axis=0,keepdims=True)
-                udata_fluc = udata_cart[iplane] - udata_mean
+                if statefile is None:
+                    #subtract temporal mean of velocity components
+                    udata_mean = np.mean(udata_cart[iplane],axis=0,keepdims=True)
+                    udata_fluc = udata_cart[iplane] - udata_mean
+                else:
+                    # The mean is removed from the transforms below
+                    udata_fluc = udata_cart[iplane]
 
                 if remove_endpoint_x:
                     udata_fluc = udata_fluc[:,:-1,:,:]
@@ -214,9 +274,13 @@ class wavenumberspectra_executor():
                 what = np.fft.fft(np.fft.fft(udata_fluc[:,:,:,2],axis=1),axis=2)/(Nx*Ny)
 
                 # Compute fourier transform of two-point correlation tensor 
-                Phi_11 = np.mean((np.abs(uhat)**2),axis=0)
-                Phi_22 = np.mean((np.abs(vhat)**2),axis=0)
-                Phi_33 = np.mean((np.abs(what)**2),axis=0)
+                if statefile is None:
+                    Phi_11 = np.mean((np.abs(uhat)**2),axis=0)
+                    Phi_22 = np.mean((np.abs(vhat)**2),axis=0)
+                    Phi_33 = np.mean((np.abs(what)**2),axis=0)
+                else:
+                    state[iplane] = accumulateSpectra(state.get(iplane, None), [uhat, vhat, what])
+                    Phi_11, Phi_22, Phi_33 = [M2/state[iplane]['count'] for M2 in state[iplane]['M2']]
 
                 # For 2D wavenumbers, E(|k|) ~ L^3/T^2, \Phi(k) ~ L^4/T^2 
                 # \Phi is energy density in 2D wavesapce. 
@@ -251,6 +315,9 @@ class wavenumberspectra_executor():
             for spec_type in type_spec:
                 dfcsv[spec_type] = E_spec[spec_type]
             dfcsv.to_csv(csvfile, index=False, sep=',')
+            if statefile is not None:
+                ppsamplexr.saveStatsState(statefile, settings, state,
+                                          oldtimes + [float(t) for t in times])
             
             # Do any sub-actions required for this task
             for a in self.actionlist:
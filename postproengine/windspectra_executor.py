@@ -10,6 +10,7 @@ amrwindfedirs = ['../',
 for x in amrwindfedirs: sys.path.insert(1, x)
 
 from postproengine import registerplugin, mergedicts, registeraction
+from postproengine import getSampleInfo, planInMemory
 import windspectra
 import postproamrwindsample_xarray as ppsamplexr
 import numpy as np
@@ -28,9 +29,9 @@ def avgSpectraNCfile(ncfilename, ptlist, group, timeindices, avgbins=[], verbose
     db = ppsamplexr.getPlanePtsXR(ncfilename, timeindices, ptlist, groupname=group, verbose=verbose, gettimes=True)
     t  = np.array(db['times'])
     for ipt, pt in enumerate(ptlist):
-        u = np.array(db[pt]['velocityx'])
-        v = np.array(db[pt]['velocityy'])
-        w = np.array(db[pt]['velocityz'])
+        u = db['velocityx'][ipt,:]
+        v = db['velocityy'][ipt,:]
+        w = db['velocityz'][ipt,:]
         ulong, ulat = windspectra.convertUxytoLongLat(u,v)
         all_ulongavgs.append(np.mean(ulong))
         f, Suu      = windspectra.avgWindSpectra(t, ulong, avgbins)
@@ -101,6 +102,20 @@ windspectra:
         #print(self.yamldictlist)
         #print(self.actionlist)
         return
+
+    def estimate(self, plane):
+        """
+        Estimate the timesteps, bytes read and peak memory of plane
+        (see postproengine.planUnits).  Only the time series at the
+        points from pointlocationfunction are read.
+        """
+        modname, funcname = plane['pointlocationfunction'].split('.')[:2]
+        ptlist = getattr(sys.modules[modname], funcname)()
+        info   = getSampleInfo(plane['ncfile'], plane['group'])
+        if len(plane['timeindices']) > 0:
+            info['ntimes'] = len(plane['timeindices'])
+        return planInMemory(info, ['velocityx', 'velocityy', 'velocityz'],
+                            npoints=len(ptlist), workitemsize=8, copies=2)
     
     def execute(self, verbose=False):
         # Do any task-related here
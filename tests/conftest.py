@@ -0,0 +1,52 @@
+# Shared fixtures for the postprocessing tests.  The sampling files are
+# written with utilities/makeSampleNC.py.
+import sys, os
+# Plots are only saved to files
+os.environ.setdefault('MPLBACKEND', 'Agg')
+testpath = os.path.dirname(os.path.realpath(__file__))
+basepath = os.path.dirname(testpath)
+for x in [basepath, os.path.join(basepath, 'utilities')]:
+    if x not in sys.path: sys.path.insert(1, x)
+
+import pytest
+import numpy as np
+import makeSampleNC
+
+@pytest.fixture(scope='session')
+def planefiles(tmp_path_factory):
+    """
+    Two consecutive sampling files with an XY plane group (3 offsets)
+    """
+    datadir = tmp_path_factory.mktemp('planes')
+    files   = [str(datadir/'XY_0.nc'), str(datadir/'XY_1.nc')]
+    makeSampleNC.makeSampleFile(files[0], planes=[('XY', 8, 6)], nt=20,
+                                dt=0.5, t0=0.0, offsets=[0.0, 20.0, 40.0],
+                                flowargs={'seed':1})
+    makeSampleNC.makeSampleFile(files[1], planes=[('XY', 8, 6)], nt=20,
+                                dt=0.5, t0=10.0, offsets=[0.0, 20.0, 40.0],
+                                flowargs={'seed':1})
+    return files
+
+def readPlanes(ncfiles, t1, t2, group='XY',
+               varnames=['velocityx', 'velocityy', 'velocityz']):
+    """
+    Read the plane snapshots in t1 <= t <= t2 directly with netCDF4,
+    returns the times and a dict of (ntimes, nk, nj, ni) arrays
+    """
+    from netCDF4 import Dataset
+    times, data = [], {v:[] for v in varnames}
+    for ncfile in ncfiles:
+        with Dataset(ncfile) as rootgrp:
+            t    = np.array(rootgrp.variables['time'][:])
+            keep = (t >= t1) & (t <= t2)
+            grp  = rootgrp.groups[group]
+            dims = list(grp.ijk_dims[::-1])
+            times.append(t[keep])
+            for v in varnames:
+                vdat = np.array(grp.variables[v][:])[keep]
+                data[v].append(vdat.reshape([len(vdat)]+dims))
+    return np.concatenate(times), {v:np.concatenate(data[v]) for v in varnames}
+
+@pytest.fixture(scope='session')
+def planedata():
+    return readPlanes
@@ -0,0 +1,28 @@
+import signal
+import pytest
+import postproengine as ppeng
+
+def stuck(signum, frame):
+    # Stops runfollow like Ctrl-C, so a loop which never times out
+    # fails the test instead of hanging it
+    raise KeyboardInterrupt
+
+def test_follow_timeout_with_failing_task(planefiles, capsys):
+    """
+    A task which always fails is not rerun on unchanged files, and does
+    not keep the follow loop from stopping at followtimeout
+    """
+    yamldict = {
+        'globalattributes': {'follow':0.05, 'followtimeout':0.5},
+        'avgplanes': [{'name':'XY', 'ncfile':planefiles, 'tavg':[2.0, 18.0],
+                       'varnames':['nosuchvariable']}],
+    }
+    signal.signal(signal.SIGALRM, stuck)
+    signal.alarm(10)
+    try:
+        ppeng.driver(yamldict, verbose=False)
+    finally:
+        signal.alarm(0)
+    out = capsys.readouterr().out
+    assert out.count('Error in avgplanes') == 1
+    assert 'done following' in out
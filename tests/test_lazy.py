@@ -0,0 +1,25 @@
+import os
+import numpy as np
+import pytest
+import postproamrwindsample_xarray as ppsamplexr
+
+def openfiles(ncfiles):
+    """
+    Number of file descriptors of this process open on ncfiles
+    """
+    paths = [os.path.realpath(f) for f in ncfiles]
+    fds   = [os.path.join('/proc/self/fd', f) for f in os.listdir('/proc/self/fd')]
+    return sum([os.path.realpath(fd) in paths for fd in fds])
+
+@pytest.mark.skipif(not os.path.isdir('/proc/self/fd'), reason='needs /proc')
+def test_lazy_closes_files(planefiles):
+    pytest.importorskip('dask')
+    nopen  = openfiles(planefiles)
+    lazyds = ppsamplexr.openPlaneSetXR(planefiles)
+    lazyds['velocityx'].values
+    assert openfiles(planefiles) > nopen
+    lazyds.close()
+    assert openfiles(planefiles) == nopen
+    ppsamplexr.lazyStatsPlaneXR(planefiles, [2.0, 18.0], stats=['avg', 'rs'],
+                                scheduler='synchronous')
+    assert openfiles(planefiles) == nopen
@@ -0,0 +1,71 @@
+import numpy as np
+import pytest
+import postproamrwindsample_xarray as ppsamplexr
+
+phasestats = ['avg', 'rs', 'std']
+
+@pytest.mark.parametrize('nphasebins', [1, 3])
+def test_lazy_phaseavg(planefiles, nphasebins):
+    """
+    The dask backend gives the same phase statistics as phaseAvgPlaneXR
+    """
+    pytest.importorskip('dask')
+    ref = ppsamplexr.phaseAvgPlaneXR(planefiles, 1.2, 18.0, 1.3, stats=phasestats,
+                                     nphasebins=nphasebins)
+    db  = ppsamplexr.lazyStatsPlaneXR(planefiles, [0.0, 18.0], stats=phasestats,
+                                      tperiod=1.3, tstart=1.2,
+                                      nphasebins=nphasebins, scheduler='synchronous')
+    np.testing.assert_allclose(db['times'], ref['times'])
+    if nphasebins > 1:
+        np.testing.assert_allclose(db['phasebins'], ref['phasebins'])
+    for k in ref:
+        if k.endswith('_phavg') or k.endswith('_phrs') or k.endswith('_phstd'):
+            np.testing.assert_allclose(db[k], ref[k], rtol=1e-8, atol=1e-10, err_msg=k)
+
+def test_phaseavgplanes_bins(planefiles, tmp_path):
+    """
+    phaseavgplanes with several phase bins, plotting one of them
+    """
+    import postproengine as ppeng
+    pngfile  = str(tmp_path/'phase_{iplane}.png')
+    yamldict = {'phaseavgplanes': [{
+        'name':'XY', 'ncfile':planefiles, 'tstart':1.2, 'tend':18.0,
+        'tperiod':1.3, 'nphasebins':3, 'calcavg':True,
+        'contourplot':{'iplane':[0, 2], 'phasebin':2, 'savefile':pngfile,
+                       'plotfunc':'lambda db: db["velocityx_phavg"] - db["velocityx_avg"]'},
+    }]}
+    ppeng.driver(yamldict, verbose=False)
+    for iplane in [0, 2]:
+        assert (tmp_path/('phase_%i.png'%iplane)).is_file()
+    ref = ppsamplexr.phaseAvgPlaneXR(planefiles, 1.2, 18.0, 1.3, nphasebins=3)
+    db  = ppsamplexr.selectPhaseBin(ref, 2)
+    np.testing.assert_array_equal(db['velocityx_phavg'], ref['velocityx_phavg'][2])
+    np.testing.assert_array_equal(db['x'], ref['x'])
+    with pytest.raises(ValueError):
+        ppsamplexr.selectPhaseBin(ref, 3)
+
+@pytest.mark.parametrize('nphasebins', [1, 2])
+def test_phaseavg_interp(planefiles, planedata, nphasebins):
+    """
+    phaseAvgPlaneXR against phase samples interpolated one at a time
+    """
+    tstart, tend, tperiod = 1.2, 18.0, 1.3
+    times, data = planedata(planefiles, -np.inf, np.inf)
+    dphase  = tperiod/nphasebins
+    samples = [[] for ibin in range(nphasebins)]
+    n = 0
+    while tstart + n*dphase <= tend + 1.0E-10:
+        ts = tstart + n*dphase
+        i  = min(np.searchsorted(times, ts, side='right')-1, len(times)-2)
+        w  = (ts-times[i])/(times[i+1]-times[i])
+        samples[n % nphasebins].append({v:(1-w)*data[v][i] + w*data[v][i+1] for v in data})
+        n += 1
+    db = ppsamplexr.phaseAvgPlaneXR(planefiles, tstart, tend, tperiod,
+                                    stats=['avg', 'std'], nphasebins=nphasebins)
+    assert len(db['times']) == n
+    for ibin in range(nphasebins):
+        bindb = ppsamplexr.selectPhaseBin(db, ibin)
+        for v in data:
+            vsamp = np.array([s[v] for s in samples[ibin]])
+            np.testing.assert_allclose(bindb[v+'_phavg'], vsamp.mean(axis=0), rtol=1e-10, atol=1e-12)
+            np.testing.assert_allclose(bindb[v+'_phstd'], vsamp.std(axis=0), rtol=1e-9, atol=1e-12)
@@ -0,0 +1,70 @@
+import pickle
+import numpy as np
+import pytest
+import postproamrwindsample_xarray as ppsamplexr
+
+varnames = ['velocityx', 'velocityy', 'velocityz']
+stats    = ['avg', 'rs', 'std', 'skew', 'kurt', 'min', 'max']
+labels   = {'velocityx':'u', 'velocityy':'v', 'velocityz':'w'}
+
+def twopass(planedata, ncfiles, t1, t2):
+    """
+    Reference statistics, from the mean in a first pass over all
+    snapshots and the fluctuations in a second
+    """
+    times, data = planedata(ncfiles, t1, t2)
+    ref = {}
+    for v in varnames:
+        mean = data[v].mean(axis=0)
+        fluc = data[v] - mean
+        m2   = (fluc**2).mean(axis=0)
+        ref[v+'_avg']  = mean
+        ref[v+'_std']  = np.sqrt(m2)
+        ref[v+'_skew'] = (fluc**3).mean(axis=0)/m2**1.5
+        ref[v+'_kurt'] = (fluc**4).mean(axis=0)/m2**2
+        ref[v+'_min']  = data[v].min(axis=0)
+        ref[v+'_max']  = data[v].max(axis=0)
+    for i, v1 in enumerate(varnames):
+        for v2 in varnames[i:]:
+            f1 = data[v1] - data[v1].mean(axis=0)
+            f2 = data[v2] - data[v2].mean(axis=0)
+            ref[labels[v1]+labels[v2]+'_avg'] = (f1*f2).mean(axis=0)
+    return times, ref
+
+def checkstats(db, ref):
+    for k in ref:
+        np.testing.assert_allclose(db[k], ref[k], rtol=1e-9, atol=1e-12, err_msg=k)
+
+@pytest.mark.parametrize('blocksize', [None, 3])
+def test_stats_serial(planefiles, planedata, blocksize):
+    times, ref = twopass(planedata, planefiles, 2.0, 18.0)
+    db = ppsamplexr.statsPlaneXR(planefiles, [2.0, 18.0], stats=stats,
+                                 blocksize=blocksize)
+    np.testing.assert_allclose(db['times'], times)
+    checkstats(db, ref)
+
+def test_stats_nprocs(planefiles, planedata):
+    times, ref = twopass(planedata, planefiles, 2.0, 18.0)
+    db = ppsamplexr.statsPlaneXR(planefiles, [2.0, 18.0], stats=stats,
+                                 nprocs=2, blocksize=4)
+    np.testing.assert_allclose(db['times'], times)
+    checkstats(db, ref)
+
+@pytest.mark.parametrize('checkpointsteps', [None, 5])
+def test_stats_resume(planefiles, planedata, tmp_path, checkpointsteps):
+    """
+    Statistics over the first file, resumed once the second is there
+    """
+    times, ref = twopass(planedata, planefiles, 2.0, 18.0)
+    savepkl = str(tmp_path/'stats.pkl')
+    ppsamplexr.statsPlaneXR(planefiles[:1], [2.0, 18.0], stats=stats,
+                            savepklfile=savepkl, resume=True,
+                            checkpointsteps=checkpointsteps)
+    with open(ppsamplexr.getStateFile(savepkl), 'rb') as f:
+        state = pickle.load(f)
+    assert len(state['times']) == len(times[times < 10.0])
+    db = ppsamplexr.statsPlaneXR(planefiles, [2.0, 18.0], stats=stats,
+                                 savepklfile=savepkl, resume=True,
+                                 checkpointsteps=checkpointsteps)
+    np.testing.assert_allclose(db['times'], times)
+    checkstats(db, ref)
@@ -0,0 +1,35 @@
+import pytest
+import postproengine as ppeng
+import postproamrwindsample_xarray as ppsamplexr
+
+def planyaml(planefiles, globattr):
+    return {'globalattributes': globattr,
+            'avgplanes': [{'name':'XY', 'ncfile':planefiles, 'tavg':[2.0, 18.0],
+                           'stats':['rs']}]}
+
+def test_plan_snapshotcache(planefiles, capsys):
+    """
+    The snapshot cache is split over the scheduler processes and
+    counted in the memory budget
+    """
+    yamldict = planyaml(planefiles, {'nprocs':4, 'memorybudget':'400KB'})
+    ppeng.driver(yamldict, plan=True)
+    out = capsys.readouterr().out
+    assert 'Snapshot cache: 100.0 KB (25.0 KB per process)' in out
+    assert 'Memory budget: 400.0 KB (300.0 KB for the tasks)' in out
+
+def test_snapshotcache_over_budget(planefiles):
+    yamldict = planyaml(planefiles, {'memorybudget':'1MB', 'snapshotcache':'2MB'})
+    with pytest.raises(RuntimeError, match='snapshotcache'):
+        ppeng.driver(yamldict, plan=True)
+
+def test_snapshotcache_per_worker(planefiles, monkeypatch):
+    sizes = []
+    setcache = ppsamplexr.setPlaneCache
+    def recordsize(maxbytes):
+        sizes.append(maxbytes)
+        return setcache(maxbytes)
+    monkeypatch.setattr(ppsamplexr, 'setPlaneCache', recordsize)
+    yamldict = planyaml(planefiles, {'nprocs':2, 'snapshotcache':'8MB'})
+    ppeng.driver(yamldict)
+    assert sizes[0] == 4*1024**2
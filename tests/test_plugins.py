@@ -0,0 +1,54 @@
+import os
+import subprocess
+import sys
+import textwrap
+
+testpath = os.path.dirname(os.path.realpath(__file__))
+basepath = os.path.dirname(testpath)
+
+def runpython(code):
+    """
+    Run code in a fresh interpreter and return what it prints
+    """
+    result = subprocess.run([sys.executable, '-c', textwrap.dedent(code)],
+                            capture_output=True, text=True, check=True,
+                            cwd=basepath)
+    return result.stdout.strip().split('\n')[-1]
+
+def test_driver_without_plots_skips_matplotlib(planefiles):
+    code = """
+    import sys
+    import postproengine as ppeng
+    ppeng.driver({'avgplanes':[{'name':'XY', 'ncfile':%s, 'tavg':[2.0, 18.0]}],
+                  'reynoldsstress':[{'name':'XY', 'ncfile':%s, 'tavg':[2.0, 18.0]}]})
+    print('matplotlib' in sys.modules)
+    """%(repr(planefiles), repr(planefiles))
+    assert runpython(code) == 'False'
+
+def test_default_task_order():
+    """
+    Without executeorder, tasks run in the order the plugins register,
+    which is the order importing every plugin file gave: spod (imported
+    by instantaneousplanes) comes before instantaneousplanes
+    """
+    import postproengine as ppeng
+    assert list(ppeng.pluginlist.keys()) == [
+        'avgplanes', 'controlvolume', 'correlate', 'convert', 'spod',
+        'instantaneousplanes', 'linesampler', 'openfast', 'phaseavgplanes',
+        'plotcsv', 'reynoldsstress', 'wake_meander', 'wavenumber_spectra',
+        'windspectra']
+
+def test_scan_order(tmp_path):
+    import postproengine as ppeng
+    plugin = "from postproengine import registerplugin\n%s\n" \
+             "@registerplugin\nclass postpro_%s():\n    name = '%s'\n"
+    files = {'a_first':'', 'b_uses_c':'from postproengine import c_used',
+             'c_used':'', 'd_local':'def f():\n    from postproengine import e_last'}
+    for f, imports in files.items():
+        with open(str(tmp_path/(f+'.py')), 'w') as fp:
+            fp.write(plugin%(imports, f, f))
+    with open(str(tmp_path/'e_last.py'), 'w') as fp:
+        fp.write(plugin%('', 'e_last', 'e_last'))
+    paths, unnamed = ppeng.scanPlugins(str(tmp_path))
+    assert list(paths.keys()) == ['a_first', 'c_used', 'b_uses_c', 'e_last', 'd_local']
+    assert unnamed == []
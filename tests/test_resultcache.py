@@ -0,0 +1,45 @@
+import os
+import pickle
+import postproengine as ppeng
+
+def test_task_sources():
+    """
+    A task version covers the library modules it uses, not only the
+    executor file
+    """
+    sources = [os.path.basename(f) for f in ppeng.getTaskSources(ppeng.pluginlist['avgplanes'])]
+    for f in ['averageplanes.py', '__init__.py', 'postproamrwindsample_xarray.py',
+              'postproamrwindsample.py', 'plotfunctions.py']:
+        assert f in sources
+    version = ppeng.getTaskVersion(ppeng.pluginlist['avgplanes'])
+    assert len(version) == len(sources)+1
+
+def test_source_hash(tmp_path):
+    srcfile = str(tmp_path/'module.py')
+    with open(srcfile, 'w') as f:
+        f.write('x = 1\n')
+    h1 = ppeng.getSourceHash(srcfile)
+    with open(srcfile, 'w') as f:
+        f.write('x = 22\n')
+    assert ppeng.getSourceHash(srcfile) != h1
+
+def test_result_cache(planefiles, tmp_path, monkeypatch, capsys):
+    """
+    The second run of an unchanged entry is restored from the cache
+    """
+    monkeypatch.chdir(tmp_path)
+    yamldict = {
+        'globalattributes': {'resultcache':str(tmp_path/'cache')},
+        'avgplanes': [{'name':'XY', 'ncfile':planefiles, 'tavg':[2.0, 18.0],
+                       'savepklfile':'XY_avg.pkl'}],
+    }
+    ppeng.driver(yamldict, verbose=False)
+    with open('XY_avg.pkl', 'rb') as f:
+        first = pickle.load(f)
+    os.remove('XY_avg.pkl')
+    capsys.readouterr()
+    ppeng.driver(yamldict, verbose=False)
+    assert 'Restored avgplanes' in capsys.readouterr().out
+    with open('XY_avg.pkl', 'rb') as f:
+        second = pickle.load(f)
+    assert (first['velocityx_avg'] == second['velocityx_avg']).all()
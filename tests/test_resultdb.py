@@ -0,0 +1,54 @@
+import numpy as np
+import pytest
+import postproamrwindsample_xarray as ppsamplexr
+
+def checksame(a, b):
+    """
+    a and b hold the same values and types
+    """
+    if isinstance(a, dict):
+        assert set(a.keys()) == set(b.keys())
+        for k in a:
+            checksame(a[k], b[k])
+    elif isinstance(a, np.ndarray):
+        assert isinstance(b, np.ndarray)
+        assert a.dtype == b.dtype
+        np.testing.assert_array_equal(a, b)
+    else:
+        assert type(a) == type(b)
+        assert a == b
+
+def exampledb():
+    rng = np.random.default_rng(0)
+    return {
+        'group':'XY',
+        'times':[1.0, 1.5, 2.0],
+        'velocityx_avg':rng.standard_normal((3, 4, 5)),
+        'flags':np.array([True, False]),
+        'spectrum':rng.standard_normal(6) + 1j*rng.standard_normal(6),
+        'offsets':np.float32(2.5),
+        'axis1':(1.0, 0.0, 0.0),
+        'attrs':{'name':'XY', 'ijk_dims':[5, 4, 3], 'empty':None},
+        'velocityx':{0:rng.standard_normal((4, 5)), 1:rng.standard_normal((4, 5))},
+        12:'integer key',
+    }
+
+@pytest.mark.parametrize('lazy', [True, False])
+def test_resultdb_roundtrip(tmp_path, lazy):
+    db = exampledb()
+    ncfile = str(tmp_path/'result.nc')
+    ppsamplexr.saveResultDB(db, ncfile)
+    loaded = ppsamplexr.loadResultDB(ncfile, lazy=lazy)
+    try:
+        checksame(db, dict(loaded) if lazy else loaded)
+        if lazy:
+            np.testing.assert_array_equal(loaded.getslice('velocityx_avg', 1),
+                                          db['velocityx_avg'][1])
+    finally:
+        if lazy: loaded.close()
+
+def test_resultdb_pickle(tmp_path):
+    db = exampledb()
+    pklfile = str(tmp_path/'result.pkl')
+    ppsamplexr.saveResultDB(db, pklfile)
+    checksame(db, ppsamplexr.loadResultDB(pklfile))
@@ -0,0 +1,23 @@
+import pickle
+import numpy as np
+import postproengine as ppeng
+import postproamrwindsample_xarray as ppsamplexr
+
+def test_rs_from_avgplanes_stats(planefiles, tmp_path):
+    """
+    reynoldsstress given an avgplanes result which already has the
+    stresses (stats: [avg, rs]) must not add onto them
+    """
+    outfile  = str(tmp_path/'rs.pkl')
+    yamldict = {
+        'avgplanes':      [{'name':'XY', 'ncfile':planefiles, 'tavg':[2.0, 18.0],
+                            'stats':['avg', 'rs']}],
+        'reynoldsstress': [{'name':'XY', 'ncfile':planefiles, 'tavg':[2.0, 18.0],
+                            'meanpklfile':'@avgplanes.XY', 'savepklfile':outfile}],
+    }
+    ppeng.driver(yamldict, verbose=False)
+    with open(outfile, 'rb') as f:
+        db = pickle.load(f)
+    ref = ppsamplexr.ReynoldsStress_PlaneXR(planefiles, [2.0, 18.0])
+    for k in ['uu_avg', 'uv_avg', 'uw_avg', 'vv_avg', 'vw_avg', 'ww_avg']:
+        np.testing.assert_allclose(db[k], ref[k], rtol=1e-10, atol=1e-12)
@@ -0,0 +1,43 @@
+import pytest
+import postproengine as ppeng
+
+def test_dependencies():
+    units = [('avgplanes',      {'name':'XY', 'savepklfile':'XY_avg.pkl'}),
+             ('reynoldsstress', {'name':'XY', 'meanpklfile':'XY_avg.pkl'}),
+             ('avgplanes',      {'name':'YZ'}),
+             ('phaseavgplanes', {'name':'YZ', 'loadavgpklfile':'@avgplanes.YZ'}),
+             ('wake_meandering', {'name':'W', 'depends_on':'reynoldsstress'})]
+    deps = ppeng.getTaskDependencies(units)
+    assert deps == [set(), {0}, set(), {2}, {1}]
+
+def test_dependency_cycle():
+    units = [('avgplanes',      {'name':'A', 'depends_on':'B'}),
+             ('reynoldsstress', {'name':'B', 'depends_on':['C']}),
+             ('phaseavgplanes', {'name':'C', 'depends_on':'avgplanes'})]
+    with pytest.raises(ValueError, match='Circular'):
+        ppeng.getTaskDependencies(units)
+
+def test_dependency_self_cycle():
+    """
+    Two entries of a task which depend on the task itself
+    """
+    units = [('avgplanes', {'name':'A', 'depends_on':'avgplanes'}),
+             ('avgplanes', {'name':'B', 'depends_on':'avgplanes'})]
+    with pytest.raises(ValueError, match='Circular'):
+        ppeng.getTaskDependencies(units)
+
+@pytest.mark.parametrize('entry', [{'name':'X', 'depends_on':'nosuchtask'},
+                                   {'name':'X', 'meanpklfile':'@avgplanes.nosuchname'}])
+def test_dependency_unknown(entry):
+    units = [('avgplanes', {'name':'XY'}), ('reynoldsstress', entry)]
+    with pytest.raises(ValueError, match='does not match'):
+        ppeng.getTaskDependencies(units)
+
+def test_reference_later_task():
+    """
+    @task.name can only refer to a task run before
+    """
+    units = [('reynoldsstress', {'name':'XY', 'meanpklfile':'@avgplanes.XY'}),
+             ('avgplanes',      {'name':'XY'})]
+    with pytest.raises(ValueError, match='does not match'):
+        ppeng.getTaskDependencies(units)
@@ -0,0 +1,35 @@
+import os
+import numpy as np
+import postproamrwindsample as ppsample
+
+def test_time_cache(planefiles):
+    """
+    The time index is the same with and without the sidecar cache, and
+    the cache holds only plain arrays
+    """
+    nocache = ppsample.timeIndex(planefiles, usecache=False)
+    ppsample.timeIndex(planefiles)
+    cachefile = os.path.join(os.path.dirname(os.path.realpath(planefiles[0])),
+                             ppsample.timeindexfile)
+    with np.load(cachefile, allow_pickle=False) as data:
+        assert sorted(data['names']) == sorted(os.path.basename(f) for f in planefiles)
+    cached = ppsample.timeIndex(planefiles)
+    for t1, t2 in zip(nocache.filetimes, cached.filetimes):
+        np.testing.assert_array_equal(t1, t2)
+    np.testing.assert_array_equal(nocache.times, cached.times)
+
+def test_time_cache_roundtrip(tmp_path):
+    """
+    The cache is saved and loaded back, and an unreadable one is ignored
+    """
+    cachefile = str(tmp_path/ppsample.timeindexfile)
+    cache = {'a.nc':((10, 20), np.arange(3.0)), 'b.nc':((30, 40), np.arange(5.0))}
+    ppsample.saveTimeCache(cachefile, cache)
+    loaded = ppsample.loadTimeCache(cachefile)
+    assert set(loaded) == set(cache)
+    for k in cache:
+        assert loaded[k][0] == cache[k][0]
+        np.testing.assert_array_equal(loaded[k][1], cache[k][1])
+    with open(cachefile, 'wb') as f:
+        f.write(b'not a cache')
+    assert ppsample.loadTimeCache(cachefile) == {}
@@ -4,44 +4,42 @@
 # Can this test script with 
 # ./catNC.py /gpfs/lcheung/TCF/GreensFunctionValidation/UniformCt_AMRWind/UniformCt_freespace/processtest/Ct0.2/post_processing/*.nc -o out.nc  -g blockageplane centerline  --tlims 800 1200 --varlist velocityx
 
+# Get the location where this script is being run
+import sys, os
+scriptpath = os.path.dirname(os.path.realpath(__file__))
+basepath   = os.path.dirname(scriptpath)
+
+# Add any possible locations of amr-wind-frontend here
+amrwindfedirs = ['../',
+                 basepath]
+for x in amrwindfedirs: sys.path.insert(1, x)
+
 from netCDF4 import Dataset
 import numpy as     np
-import sys
 import os.path
 import argparse
 import time
+import postproamrwindsample as ppsample
 
 #import xarray as    xr  # (Add this later)
 
-def addTime(t, timevec, timesubset):
-    checktimesubset = lambda t, tlims: True if len(tlims)==0 else ((tlims[0]<=t) and (t<=tlims[1]))
-    if t in timevec:
-        return False
-    else:
-        return checktimesubset(t, timesubset)
-
 def stitchtimes(filelist, timesubset=[]):
     """
     Construct a single time vector from individual netcdf files in the
-    filelist.
+    filelist.  Returns the time vector and a list of [file index,
+    local index, global index] for each time.
     """
-    mastertimevec = []
-    includetimes  = []
-    # Index of which file and which iter this time comes from
-    timeindex     = []
-    itime         = 0
-    for fi, f in enumerate(filelist):
-       ncdat = Dataset(f, 'r')
-       time  = np.array(ncdat.variables['time'])
-       includelist = [False]*len(time)
-       for iter, t in enumerate(time): 
-           if addTime(t, mastertimevec, timesubset):
-               mastertimevec.append(t)
-               includelist[iter] = True
-               timeindex.append([fi, iter, itime])
-               itime += 1
-       includetimes.append(includelist)
-       ncdat.close()
+    tindex = ppsample.timeIndex(filelist)
+    keep   = np.ones(len(tindex), dtype=bool)
+    if len(timesubset) > 0:
+        keep = (timesubset[0] <= tindex.times) & (tindex.times <= timesubset[1])
+    ifile  = tindex.ifile[keep]
+    ilocal = tindex.ilocal[keep]
+    # Keep the times in the order they appear in the files
+    isort  = np.lexsort((ilocal, ifile))
+    mastertimevec = list(tindex.times[keep][isort])
+    timeindex     = [[int(ifile[i]), int(ilocal[i]), itime]
+                     for itime, i in enumerate(isort)]
     return mastertimevec, timeindex
 
 def openNCfile(ncfilename, timevec, ndim=3):
@@ -13,13 +13,12 @@ for x in amrwindfedirs: sys.path.insert(1, x)
 
 # Load the libraries
 import postproamrwindsample as ppsample
+import postproamrwindsample_xarray as ppsamplexr
 import numpy             as np
 import xarray as xr
 import argparse
 from collections import OrderedDict
 
-extractvar = lambda xrds, var, i : xrds[var][i,:].data.reshape(tuple(xrds.attrs['ijk_dims'][::-1]))
-
 # See https://stackoverflow.com/questions/3173320/text-progress-bar-in-the-console
 def progress(count, total, suffix=''):
     """
@@ -33,44 +32,37 @@ def progress(count, total, suffix=''):
     sys.stdout.flush()
 
 def extractpt(ncfile, ptlist, varlist=['velocityx','velocityy','velocityz'], timesubset=None, group=None, verbose=0):
+    """
+    Extract the time series at the (i,j,k) points in ptlist.  Each
+    variable is read for all points and times in one call.
+    """
     groups=ppsample.getGroups(ppsample.loadDataset(ncfile))
     g=groups[0] if group is None else group
     datadict=OrderedDict()
+    timevec = ppsample.getFileTimes([ncfile])[0]
+    N       = len(timevec)
+    tloop   = list(range(N)) if timesubset is None else [N+i if i<0 else i for i in timesubset]
     with xr.open_dataset(ncfile, group=g) as ds:
-        xm = ds['coordinates'].data[:,0].reshape(tuple(ds.attrs['ijk_dims'][::-1]), order='C')
-        ym = ds['coordinates'].data[:,1].reshape(tuple(ds.attrs['ijk_dims'][::-1]), order='C')
-        zm = ds['coordinates'].data[:,2].reshape(tuple(ds.attrs['ijk_dims'][::-1]), order='C')
-        dtime=xr.open_dataset(ncfile)
-        ds = ds.assign_coords(coords={'xm':(['x','y','z'], xm),
-                                      'ym':(['x','y','z'], ym),
-                                      'zm':(['x','y','z'], zm),
-                                      'time':dtime['time'],
-                                     })
-        dtime.close()
-        iplane = 0
-        N=len(ds['time'])
-        for pt in ptlist:
-            ijkrev = pt[::-1]
-            ptdict=OrderedDict()
-            ptdict['time'] = []
-            ptdict['x']    = float(xm[ijkrev])
-            ptdict['y']    = float(ym[ijkrev])
-            ptdict['z']    = float(zm[ijkrev])
-            for v in varlist:
-                ptdict[v]  = []
-            datadict[pt] = ptdict
-        tloop = np.arange(N) if timesubset is None else timesubset
-        Nloop = len(tloop)   # Edit this to choose a subset
-        for itime in tloop: 
-            progress(itime+1, Nloop)
-            for pt in ptlist:
-                datadict[pt]['time'].append(float(ds['time'][itime]))
-            for v in varlist:
-                vvar = extractvar(ds, v, itime)
-                for pt in ptlist:
-                    ijkrev = pt[::-1]
-                    datadict[pt][v].append(vvar[ijkrev])
-        print()
+        xm = ds['coordinates'].data[:,0]
+        ym = ds['coordinates'].data[:,1]
+        zm = ds['coordinates'].data[:,2]
+        # Flat point indices, from (i,j,k) reversed to (k,j,i)
+        idx = ppsamplexr.getPointIndices(ds.attrs['ijk_dims'], [pt[::-1] for pt in ptlist])
+        ptdata = OrderedDict()
+        for iv, v in enumerate(varlist):
+            if verbose: progress(iv+1, len(varlist))
+            ptdata[v] = ppsamplexr.extractpoints(ds, v, tloop, idx)
+        if verbose: print()
+    tvec = np.asarray(timevec)[tloop]
+    for ipt, pt in enumerate(ptlist):
+        ptdict=OrderedDict()
+        ptdict['time'] = tvec
+        ptdict['x']    = float(xm[idx[ipt]])
+        ptdict['y']    = float(ym[idx[ipt]])
+        ptdict['z']    = float(zm[idx[ipt]])
+        for v in varlist:
+            ptdict[v]  = ptdata[v][ipt,:]
+        datadict[pt] = ptdict
     return datadict
 
 def datadict2file(datadict, filetemplate, varlist=['velocityx','velocityy','velocityz'], verbose=False):
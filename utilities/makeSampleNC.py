@@ -0,0 +1,416 @@
+#!/usr/bin/env python
+# Script to write synthetic AMR-Wind sampling files
+
+# Can test this script with
+# ./makeSampleNC.py test.nc --plane XY 128 64 --plane YZ 64 48 --line 100 --nt 200 --wake 120
+
+# Get the location where this script is being run
+import sys, os
+scriptpath = os.path.dirname(os.path.realpath(__file__))
+basepath   = os.path.dirname(scriptpath)
+
+# Add any possible locations of amr-wind-frontend here
+amrwindfedirs = ['../',
+                 basepath]
+for x in amrwindfedirs: sys.path.insert(1, x)
+
+from netCDF4 import Dataset
+import numpy as     np
+import argparse
+import time
+
+# Size of one sample value in bytes for each NetCDF type
+typesize = {'f8':8, 'f4':4}
+
+class syntheticFlow():
+    """
+    Synthetic atmospheric boundary layer flow.  The mean wind follows a
+    power law profile, and the turbulence is a sum of random Fourier
+    modes with a von Karman spectrum, frozen and advected with the hub
+    height wind.  An optional meandering Gaussian wake (a cylinder along
+    the wind direction) is subtracted from the streamwise velocity.
+    """
+    def __init__(self, Uhub=8.0, zhub=90.0, alpha=0.14, winddir=0.0,
+                 TI=0.1, lengthscale=100.0, nmodes=64, dx=10.0,
+                 wakediam=0.0, wakecenter=None, wakedeficit=0.4,
+                 meander=0.25, seed=0):
+        self.Uhub        = Uhub
+        self.zhub        = zhub
+        self.alpha       = alpha
+        self.dir         = np.array([np.cos(np.radians(winddir)),
+                                     np.sin(np.radians(winddir)), 0.0])
+        self.sigma       = TI*Uhub
+        self.wakediam    = wakediam
+        self.wakecenter  = (0.0, zhub) if wakecenter is None else wakecenter
+        self.wakedeficit = wakedeficit
+        self.meander     = meander
+        self.rng         = np.random.default_rng(seed)
+        self.nmodes      = nmodes
+        if nmodes > 0:
+            # Wavenumbers from 10x the integral length down to the grid
+            kmag = np.logspace(np.log10(0.1/lengthscale), np.log10(np.pi/dx), nmodes)
+            dk   = np.gradient(kmag)
+            E    = (kmag*lengthscale)**4/(1.0 + (kmag*lengthscale)**2)**(17.0/6.0)
+            kdir = self.rng.standard_normal((nmodes, 3))
+            kdir = kdir/np.linalg.norm(kdir, axis=1)[:,None]
+            # Mode amplitudes perpendicular to k (divergence free)
+            adir = np.cross(kdir, self.rng.standard_normal((nmodes, 3)))
+            adir = adir/np.linalg.norm(adir, axis=1)[:,None]
+            amp  = np.sqrt(E*dk)
+            self.K     = kdir*kmag[:,None]
+            self.A     = adir*amp[:,None]
+            self.phase = self.rng.uniform(0, 2*np.pi, nmodes)
+            self.omega = self.K @ (Uhub*self.dir)
+            # Scale to the requested turbulence intensity
+            var        = 0.5*(self.A**2).sum(axis=0).mean()
+            self.A     = self.A*self.sigma/np.sqrt(var)
+        return
+
+    def meanvel(self, coords):
+        """
+        Mean wind speed at coords
+        """
+        z = np.maximum(coords[:,2], 1.0e-3)
+        return self.Uhub*(z/self.zhub)**self.alpha
+
+    def wakecenterat(self, t):
+        """
+        Center (y, z) of the meandering wake at time t
+        """
+        D     = self.wakediam
+        f     = 0.2*self.Uhub/D
+        y0, z0 = self.wakecenter
+        return (y0 + self.meander*D*np.sin(2*np.pi*f*t),
+                z0 + 0.5*self.meander*D*np.sin(2*np.pi*0.6*f*t + 1.0))
+
+    def fields(self, coords, times, varnames):
+        """
+        Return a dict with each variable in varnames at coords (an
+        (npts, 3) array), with shape (len(times), npts)
+        """
+        npts = coords.shape[0]
+        Umean = self.meanvel(coords)
+        P     = coords @ self.K.T + self.phase if self.nmodes > 0 else None
+        out   = {v:np.empty((len(times), npts)) for v in varnames}
+        for it, t in enumerate(times):
+            if self.nmodes > 0:
+                up = np.cos(P - self.omega*t) @ self.A
+            else:
+                up = self.sigma*self.rng.standard_normal((npts, 3))
+            U = Umean.copy()
+            if self.wakediam > 0:
+                yc, zc = self.wakecenterat(t)
+                r2 = (coords[:,1]-yc)**2 + (coords[:,2]-zc)**2
+                s  = 0.35*self.wakediam
+                U -= self.wakedeficit*self.Uhub*np.exp(-0.5*r2/s**2)
+            vel = U[:,None]*self.dir[None,:] + up
+            for v in varnames:
+                if v == 'velocityx':
+                    out[v][it,:] = vel[:,0]
+                elif v == 'velocityy':
+                    out[v][it,:] = vel[:,1]
+                elif v == 'velocityz':
+                    out[v][it,:] = vel[:,2]
+                elif v == 'temperature':
+                    out[v][it,:] = 300.0 + 0.2*up[:,2]
+                else:
+                    raise ValueError('Unknown variable %s'%v)
+        return out
+
+def getPlaneGeometry(orientation, ni, nj, dx=10.0, zref=90.0):
+    """
+    Origin and axes of a plane with ni x nj points spaced dx apart.  An
+    XY plane sits at height zref, XZ and YZ planes start at z=dx.
+    Returns origin, axis1, axis2, axis3 (the unit normal).
+    """
+    L1, L2 = (ni-1)*dx, (nj-1)*dx
+    if orientation == 'XY':
+        return (np.array([0.0, 0.0, zref]), np.array([L1, 0.0, 0.0]),
+                np.array([0.0, L2, 0.0]), np.array([0.0, 0.0, 1.0]))
+    elif orientation == 'XZ':
+        return (np.array([0.0, 0.0, dx]), np.array([L1, 0.0, 0.0]),
+                np.array([0.0, 0.0, L2]), np.array([0.0, 1.0, 0.0]))
+    elif orientation == 'YZ':
+        return (np.array([0.0, 0.0, dx]), np.array([0.0, L1, 0.0]),
+                np.array([0.0, 0.0, L2]), np.array([1.0, 0.0, 0.0]))
+    raise ValueError('Unknown plane orientation %s'%orientation)
+
+def getPlaneCoords(ni, nj, origin, axis1, axis2, axis3, offsets):
+    """
+    Coordinates of the plane sampler points, in the AMR-Wind order
+    (i fastest, then j, then the offsets)
+    """
+    nk      = len(offsets)
+    K, J, I = np.meshgrid(np.arange(nk), np.arange(nj), np.arange(ni), indexing='ij')
+    s1      = I.ravel()/max(ni-1, 1)
+    s2      = J.ravel()/max(nj-1, 1)
+    off     = np.array(offsets, dtype=float)[K.ravel()]
+    return origin[None,:] + s1[:,None]*axis1[None,:] + s2[:,None]*axis2[None,:] \
+        + off[:,None]*axis3[None,:]
+
+def openSampleFile(ncfilename, timevec, ndim=3):
+    """
+    Create a sampling file with the time vector
+    """
+    rootgrp = Dataset(ncfilename, "w", format="NETCDF4")
+    rootgrp.created_on = time.ctime(time.time())
+    rootgrp.title      = "AMR-Wind data sampling output"
+    rootgrp.createDimension("ndim", ndim)
+    rootgrp.createDimension("num_time_steps", None)
+    nc_times    = rootgrp.createVariable("time", "f8", ("num_time_steps",))
+    nc_times[:] = timevec
+    return rootgrp
+
+def writeGroupData(grp, flow, coords, timevec, varnames, dtype='f8',
+                   blocksize=16, verbose=False):
+    """
+    Write the coordinates and the variables of a sampler group, a block
+    of timesteps at a time
+    """
+    grp.createDimension("num_points", coords.shape[0])
+    grp.createDimension("ndim", 3)
+    nc_coords = grp.createVariable("coordinates", "f8", ("num_points", "ndim",))
+    nc_coords[:,:] = coords
+    ncvars = {v:grp.createVariable(v, dtype, ("num_time_steps", "num_points",))
+              for v in varnames}
+    for i0 in range(0, len(timevec), blocksize):
+        i1   = min(i0+blocksize, len(timevec))
+        vdat = flow.fields(coords, timevec[i0:i1], varnames)
+        for v in varnames:
+            ncvars[v][i0:i1,:] = vdat[v]
+        if verbose:
+            sys.stdout.write("\r%s: %i/%i"%(grp.name, i1, len(timevec)))
+            sys.stdout.flush()
+    if verbose: print()
+    return
+
+def addPlaneGroup(rootgrp, group, flow, orientation, ni, nj, offsets=[0.0],
+                  dx=10.0, zref=90.0, varnames=['velocityx', 'velocityy', 'velocityz'],
+                  dtype='f8', verbose=False):
+    """
+    Add a PlaneSampler group with ni x nj points on each offset
+    """
+    timevec = rootgrp.variables['time'][:]
+    origin, axis1, axis2, axis3 = getPlaneGeometry(orientation, ni, nj, dx=dx, zref=zref)
+    grp = rootgrp.createGroup(group)
+    grp.sampling_type = 'PlaneSampler'
+    grp.ijk_dims = np.array([ni, nj, len(offsets)], dtype=np.int32)
+    grp.origin   = origin
+    grp.axis1    = axis1
+    grp.axis2    = axis2
+    grp.axis3    = axis3
+    grp.offsets  = np.array(offsets, dtype=float)
+    coords = getPlaneCoords(ni, nj, origin, axis1, axis2, axis3, offsets)
+    writeGroupData(grp, flow, coords, timevec, varnames, dtype=dtype, verbose=verbose)
+    return
+
+def addLineGroup(rootgrp, group, flow, npts, start=[0.0, 0.0, 10.0],
+                 end=None, dx=10.0, varnames=['velocityx', 'velocityy', 'velocityz'],
+                 dtype='f8', verbose=False):
+    """
+    Add a LineSampler group with npts points from start to end (by
+    default a vertical line with points dx apart)
+    """
+    timevec = rootgrp.variables['time'][:]
+    start   = np.array(start, dtype=float)
+    end     = start + np.array([0.0, 0.0, (npts-1)*dx]) if end is None else np.array(end, dtype=float)
+    grp = rootgrp.createGroup(group)
+    grp.sampling_type = 'LineSampler'
+    grp.ijk_dims = np.array([npts, 1, 1], dtype=np.int32)
+    grp.start    = start
+    grp.end      = end
+    s      = np.linspace(0, 1, npts)
+    coords = start[None,:] + s[:,None]*(end-start)[None,:]
+    writeGroupData(grp, flow, coords, timevec, varnames, dtype=dtype, verbose=verbose)
+    return
+
+def getGroupName(base, used):
+    """
+    base, or base_1, base_2, ... if it is already in used
+    """
+    name, i = base, 0
+    while name in used:
+        i   += 1
+        name = '%s_%i'%(base, i)
+    used.append(name)
+    return name
+
+def makeSampleFile(ncfilename, planes=[], lines=[], nt=100, dt=0.5, t0=0.0,
+                   offsets=[0.0], dx=10.0, varnames=['velocityx', 'velocityy', 'velocityz'],
+                   dtype='f8', flowargs={}, verbose=False):
+    """
+    Write a sampling file with a PlaneSampler group for each
+    (orientation, ni, nj) in planes and a LineSampler group for each
+    number of points in lines.  flowargs are passed on to
+    syntheticFlow.  Returns the names of the groups.
+    """
+    flowargs = dict(flowargs)
+    flowargs.setdefault('dx', dx)
+    flow     = syntheticFlow(**flowargs)
+    timevec  = t0 + dt*np.arange(nt)
+    used     = []
+    rootgrp  = openSampleFile(ncfilename, timevec)
+    for iplane, (orientation, ni, nj) in enumerate(planes):
+        group = getGroupName(orientation, used)
+        if (iplane == 0) and (flowargs.get('wakecenter', None) is None):
+            # Put the wake in the middle of the first plane
+            origin, axis1, axis2, axis3 = getPlaneGeometry(orientation, ni, nj, dx=dx)
+            mid = origin + 0.5*axis1 + 0.5*axis2
+            flow.wakecenter = (mid[1], flow.zhub)
+        addPlaneGroup(rootgrp, group, flow, orientation, ni, nj, offsets=offsets,
+                      dx=dx, zref=flow.zhub, varnames=varnames, dtype=dtype,
+                      verbose=verbose)
+    for npts in lines:
+        group = getGroupName('line', used)
+        addLineGroup(rootgrp, group, flow, npts, dx=dx, varnames=varnames,
+                     dtype=dtype, verbose=verbose)
+    rootgrp.close()
+    return used
+
+def getNumTimes(size, planes=[], lines=[], noffsets=1, nvars=3, dtype='f8'):
+    """
+    Number of timesteps which makes a file of about size bytes
+    """
+    npts = sum([ni*nj*noffsets for o, ni, nj in planes]) + sum(lines)
+    return max(1, int(size/(npts*nvars*typesize[dtype])))
+
+# ========================================================================
+# Main
+# ========================================================================
+if __name__ == "__main__":
+
+    helpstring = 'Write a synthetic AMR-Wind sampling netcdf file'
+    # Handle arguments
+    parser     = argparse.ArgumentParser(description=helpstring)
+    parser.add_argument(
+        "ncfile",
+        help="Output netcdf file",
+        type=str,
+    )
+    parser.add_argument(
+        "--plane",
+        help="Add a plane sampler: orientation (XY, XZ, or YZ), ni, nj",
+        nargs=3,
+        action='append',
+        metavar=('ORIENTATION', 'NI', 'NJ'),
+        default=[],
+    )
+    parser.add_argument(
+        "--line",
+        help="Add a vertical line sampler with this many points",
+        type=int,
+        action='append',
+        default=[],
+    )
+    parser.add_argument(
+        "--offsets",
+        help="Offsets of every plane [Default: 0]",
+        type=float,
+        nargs='+',
+        default=[0.0],
+    )
+    parser.add_argument(
+        "--nt",
+        help="Number of timesteps [Default: 100]",
+        type=int,
+        default=100,
+    )
+    parser.add_argument(
+        "--size",
+        help="Pick the number of timesteps to make a file of about this size (e.g., 2GB)",
+        type=str,
+        default=None,
+    )
+    parser.add_argument(
+        "--dt",
+        help="Time between samples [Default: 0.5]",
+        type=float,
+        default=0.5,
+    )
+    parser.add_argument(
+        "--t0",
+        help="First time [Default: 0]",
+        type=float,
+        default=0.0,
+    )
+    parser.add_argument(
+        "--dx",
+        help="Point spacing [Default: 10]",
+        type=float,
+        default=10.0,
+    )
+    parser.add_argument(
+        "--varlist",
+        help="Variables to write [Default: velocityx velocityy velocityz]",
+        type=str,
+        nargs='+',
+        default=['velocityx', 'velocityy', 'velocityz'],
+    )
+    parser.add_argument(
+        "--dtype",
+        help="Type of the variables [Default: f8]",
+        choices=list(typesize.keys()),
+        default='f8',
+    )
+    parser.add_argument(
+        "--WS",
+        help="Hub height wind speed [Default: 8]",
+        type=float,
+        default=8.0,
+    )
+    parser.add_argument(
+        "--WDir",
+        help="Wind direction, degrees from the x axis [Default: 0]",
+        type=float,
+        default=0.0,
+    )
+    parser.add_argument(
+        "--TI",
+        help="Turbulence intensity [Default: 0.1]",
+        type=float,
+        default=0.1,
+    )
+    parser.add_argument(
+        "--nmodes",
+        help="Number of Fourier modes in the turbulence, 0 for white noise [Default: 64]",
+        type=int,
+        default=64,
+    )
+    parser.add_argument(
+        "--wake",
+        help="Add a meandering wake with this diameter",
+        type=float,
+        default=0.0,
+    )
+    parser.add_argument(
+        "--seed",
+        help="Random seed [Default: 0]",
+        type=int,
+        default=0,
+    )
+    parser.add_argument(
+        '-v',
+        '--verbose',
+        help="Turn on verbose",
+        default=False,
+        action='store_true')
+
+    # Load the options
+    args   = parser.parse_args()
+    planes = [(p[0].upper(), int(p[1]), int(p[2])) for p in args.plane]
+    if len(planes) == 0 and len(args.line) == 0:
+        print("Error: add at least one --plane or --line")
+        sys.exit(1)
+    nt = args.nt
+    if args.size is not None:
+        import postproamrwindsample_xarray as ppsamplexr
+        nt = getNumTimes(ppsamplexr.parseBytes(args.size), planes=planes,
+                         lines=args.line, noffsets=len(args.offsets),
+                         nvars=len(args.varlist), dtype=args.dtype)
+    flowargs = {'Uhub':args.WS, 'winddir':args.WDir, 'TI':args.TI,
+                'nmodes':args.nmodes, 'wakediam':args.wake, 'seed':args.seed}
+    groups = makeSampleFile(args.ncfile, planes=planes, lines=args.line,
+                            nt=nt, dt=args.dt, t0=args.t0, offsets=args.offsets,
+                            dx=args.dx, varnames=args.varlist, dtype=args.dtype,
+                            flowargs=flowargs, verbose=args.verbose)
+    print("Wrote %i timesteps of %s to %s"%(nt, ', '.join(groups), args.ncfile))
@@ -0,0 +1,373 @@
+#!/usr/bin/env python
+# Benchmarks of the post-processing engine on synthetic sampling files
+
+# Can test this script with
+# ./ppbenchmark.py --size small --save base.json
+# ./ppbenchmark.py --size small --compare base.json
+
+# Get the location where this script is being run
+import sys, os
+scriptpath = os.path.dirname(os.path.realpath(__file__))
+basepath   = os.path.dirname(scriptpath)
+
+# Add any possible locations of amr-wind-frontend here
+amrwindfedirs = ['../',
+                 basepath,
+                 scriptpath]
+for x in amrwindfedirs: sys.path.insert(1, x)
+
+import numpy as np
+import argparse
+import contextlib
+import importlib.util
+import json
+import platform
+import shutil
+import time
+import traceback
+import types
+from collections import OrderedDict
+import makeSampleNC
+import postproamrwindsample_xarray as ppsamplexr
+import postproengine as ppeng
+
+# Data sizes.  The XY plane is split over two files (like a restarted
+# run) and has ntimes in total, the YZ plane has a meandering wake.
+# The XY plane is square since wavenumber_spectra needs that.
+sizepresets = {
+    'small':  {'XY':[96, 96],   'YZ':[48, 40],   'ntimes':240,  'yzoffsets':[0.0, 20.0]},
+    'medium': {'XY':[256, 256], 'YZ':[96, 64],   'ntimes':600,  'yzoffsets':[0.0, 20.0]},
+    'large':  {'XY':[512, 512], 'YZ':[192, 128], 'ntimes':1200, 'yzoffsets':[0.0, 20.0]},
+}
+
+# Change this when the generated data changes, so old data is remade
+dataversion = 1
+
+velnames = ['velocityx', 'velocityy', 'velocityz']
+
+class SkipBenchmark(Exception):
+    pass
+
+# The benchmarks, in the order they are run
+benchmarklist = OrderedDict()
+
+def registerbenchmark(f):
+    """
+    Add a benchmark.  f(data) does any setup, and returns the function
+    to time.  It raises SkipBenchmark if it cannot run here.
+    """
+    benchmarklist[f.__name__] = f
+    return f
+
+# ------------------------------------------------------------------
+# Test data
+# ------------------------------------------------------------------
+def makeData(workdir, size, verbose=False):
+    """
+    Write the sampling files for a size preset into workdir, unless
+    they are already there
+    """
+    preset = sizepresets[size]
+    params = {'size':size, 'preset':preset, 'dataversion':dataversion}
+    stamp  = os.path.join(workdir, 'params.json')
+    data   = {'workdir':os.path.abspath(workdir),
+              'xyfiles':[os.path.abspath(os.path.join(workdir, 'XY_%i.nc'%i)) for i in range(2)],
+              'yzfile':os.path.abspath(os.path.join(workdir, 'YZ.nc')),
+              'dt':0.5, 'ntimes':preset['ntimes'], 'preset':preset,
+              'diam':100.0, 'zhub':90.0}
+    nhalf  = preset['ntimes']//2
+    data['trange'] = [0.0, data['dt']*(preset['ntimes']-1)]
+    # Center of the wake in the YZ plane
+    origin, axis1, axis2, axis3 = makeSampleNC.getPlaneGeometry('YZ', *preset['YZ'])
+    data['wakecenter'] = [(origin + 0.5*axis1)[1], data['zhub']]
+    if os.path.isfile(stamp):
+        with open(stamp, 'r') as f:
+            if json.load(f) == params:
+                return data
+    os.makedirs(workdir, exist_ok=True)
+    flowargs = {'seed':0, 'zhub':data['zhub']}
+    for i, xyfile in enumerate(data['xyfiles']):
+        if verbose: print("Writing "+xyfile)
+        makeSampleNC.makeSampleFile(xyfile, planes=[('XY',)+tuple(preset['XY'])],
+                                    nt=nhalf, dt=data['dt'], t0=i*nhalf*data['dt'],
+                                    flowargs=flowargs, verbose=verbose)
+    if verbose: print("Writing "+data['yzfile'])
+    makeSampleNC.makeSampleFile(data['yzfile'], planes=[('YZ',)+tuple(preset['YZ'])],
+                                nt=preset['ntimes'], dt=data['dt'],
+                                offsets=preset['yzoffsets'],
+                                flowargs=dict(flowargs, wakediam=data['diam'],
+                                              wakecenter=data['wakecenter']),
+                                verbose=verbose)
+    with open(stamp, 'w') as f:
+        json.dump(params, f, indent=1)
+    return data
+
+def getDataBytes(data):
+    return sum([os.path.getsize(f) for f in data['xyfiles']+[data['yzfile']]])
+
+# ------------------------------------------------------------------
+# Benchmarks
+# ------------------------------------------------------------------
+@registerbenchmark
+def avgPlaneXR(data):
+    return lambda: ppsamplexr.avgPlaneXR(data['xyfiles'], data['trange'], varnames=velnames,
+                                         groupname='XY', includeattr=True)
+
+@registerbenchmark
+def ReynoldsStress_PlaneXR(data):
+    avgdb = ppsamplexr.avgPlaneXR(data['xyfiles'], data['trange'], varnames=velnames,
+                                  groupname='XY', includeattr=True)
+    return lambda: ppsamplexr.ReynoldsStress_PlaneXR(data['xyfiles'], data['trange'],
+                                                     avgdb=avgdb, varnames=velnames,
+                                                     groupname='XY', includeattr=True)
+
+@registerbenchmark
+def getPlaneXR(data):
+    return lambda: ppsamplexr.getPlaneXR(data['xyfiles'], [0, 1], velnames, groupname='XY',
+                                         includeattr=True, gettimes=True,
+                                         timerange=data['trange'])
+
+@registerbenchmark
+def spod(data):
+    yc, zc = data['wakecenter']
+    nperseg = min(64, data['ntimes']//2)
+    yamldict = {'spod':{'name':'bench', 'ncfile':data['yzfile'], 'group':'YZ',
+                        'trange':data['trange'], 'iplane':[0], 'nperseg':nperseg,
+                        'xc':yc, 'yc':zc, 'diam':data['diam'], 'NR':64, 'NTheta':64,
+                        'output_dir':os.path.join(data['workdir'], 'spod'),
+                        'verbose':False}}
+    return lambda: runDriver(yamldict)
+
+@registerbenchmark
+def wake_meandering(data):
+    if importlib.util.find_spec('samwich') is None:
+        raise SkipBenchmark('samwich not installed')
+    yc, zc = data['wakecenter']
+    yamldict = {'wake_meander':{'name':'bench', 'ncfile':data['yzfile'], 'group':'YZ',
+                                'trange':data['trange'], 'iplane':[0],
+                                'yhub':yc, 'zhub':zc, 'method':'ConstantArea',
+                                'diam':data['diam'], 'savefile':'wake_center_{iplane}.csv',
+                                'output_dir':os.path.join(data['workdir'], 'wake')}}
+    return lambda: runDriver(yamldict)
+
+@registerbenchmark
+def windspectra(data):
+    ni, nj = data['preset']['XY']
+    # The points come from a user defined function
+    mod = types.ModuleType('ppbenchpoints')
+    mod.getptlist = lambda: [(i, j, 0) for i in range(0, ni, ni//4) for j in range(0, nj, nj//4)]
+    sys.modules['ppbenchpoints'] = mod
+    yamldict = {'windspectra':{'name':'bench', 'ncfile':data['xyfiles'][0], 'group':'XY',
+                               'pointlocationfunction':'ppbenchpoints.getptlist',
+                               'csvfile':os.path.join(data['workdir'], 'spectra.csv')}}
+    return lambda: runDriver(yamldict)
+
+@registerbenchmark
+def wavenumberspectra(data):
+    yamldict = {'wavenumber_spectra':{'name':'bench', 'ncfile':data['xyfiles'], 'group':'XY',
+                                      'trange':data['trange'], 'iplanes':0,
+                                      'csvfile':os.path.join(data['workdir'], 'E_spectra.csv')}}
+    return lambda: runDriver(yamldict)
+
+@registerbenchmark
+def catNC(data):
+    import catNC
+    outfile = os.path.join(data['workdir'], 'catNC_out.nc')
+    def run():
+        tvec, timeindex = catNC.stitchtimes(data['xyfiles'])
+        rootgrp = catNC.openNCfile(outfile, tvec)
+        catNC.addGroup(rootgrp, 'XY', data['xyfiles'], timeindex, includevars=None)
+        rootgrp.close()
+    return run
+
+def runDriver(yamldict):
+    yamldict = dict(yamldict, globalattributes={'verbose':False})
+    ppeng.driver(yamldict, verbose=False)
+    # Close any figures the tasks made
+    if 'matplotlib.pyplot' in sys.modules:
+        sys.modules['matplotlib.pyplot'].close('all')
+    return
+
+# ------------------------------------------------------------------
+# Running and comparing
+# ------------------------------------------------------------------
+def runBenchmarks(data, names, repeat=3, verbose=False):
+    """
+    Time each benchmark in names repeat times.  Returns a dict with the
+    times of each benchmark.
+    """
+    results = OrderedDict()
+    for name in names:
+        print("Running %s..."%name, end='', flush=True)
+        result = {'status':'ok', 'times':[]}
+        quiet  = open(os.devnull, 'w') if not verbose else None
+        try:
+            with contextlib.ExitStack() as stack:
+                if quiet is not None:
+                    stack.enter_context(contextlib.redirect_stdout(quiet))
+                func = benchmarklist[name](data)
+                for i in range(repeat):
+                    t0 = time.perf_counter()
+                    func()
+                    result['times'].append(time.perf_counter() - t0)
+        except SkipBenchmark as e:
+            result['status'] = 'skipped'
+            result['note']   = str(e)
+        except (Exception, SystemExit) as e:
+            result['status'] = 'failed'
+            result['note']   = traceback.format_exc()
+        finally:
+            if quiet is not None: quiet.close()
+        if len(result['times']) > 0:
+            result['min_s']    = min(result['times'])
+            result['median_s'] = float(np.median(result['times']))
+        if result['status'] == 'ok':
+            print(" %.3f s"%result['min_s'])
+        else:
+            print(" %s"%result['status'])
+            if verbose or (result['status'] == 'failed'): print(result['note'])
+        results[name] = result
+    return results
+
+def getMachineInfo():
+    import xarray
+    return {'host':platform.node(), 'platform':platform.platform(),
+            'python':platform.python_version(), 'numpy':np.__version__,
+            'xarray':xarray.__version__, 'cpus':os.cpu_count()}
+
+def compareResults(base, new, tolerance=0.15):
+    """
+    Print how the minimum times in new compare to base.  Returns the
+    names of the benchmarks which got slower by more than tolerance.
+    """
+    if base.get('size', None) != new.get('size', None):
+        print("Warning: comparing %s data against %s data"%(new.get('size'), base.get('size')))
+    if base.get('machine', {}).get('host', None) != new.get('machine', {}).get('host', None):
+        print("Warning: the baseline was run on %s"%base.get('machine', {}).get('host'))
+    fmt = '%-24s %10s %10s %8s  %s'
+    print(fmt%('benchmark', 'base (s)', 'new (s)', 'ratio', ''))
+    slower = []
+    for name, r in new['results'].items():
+        b = base['results'].get(name, {})
+        if ('min_s' not in r) or ('min_s' not in b):
+            print(fmt%(name, '%.3f'%b['min_s'] if 'min_s' in b else '-',
+                       '%.3f'%r['min_s'] if 'min_s' in r else '-', '-', r['status']))
+            continue
+        ratio = r['min_s']/b['min_s']
+        if ratio > 1.0 + tolerance:
+            verdict = 'SLOWER'
+            slower.append(name)
+        elif ratio < 1.0/(1.0 + tolerance):
+            verdict = 'faster'
+        else:
+            verdict = ''
+        print(fmt%(name, '%.3f'%b['min_s'], '%.3f'%r['min_s'], '%.2f'%ratio, verdict))
+    return slower
+
+# ========================================================================
+# Main
+# ========================================================================
+if __name__ == "__main__":
+
+    helpstring = """
+    Time the post-processing engine on synthetic sampling files, and
+    compare the times with an earlier run
+    """
+    # Handle arguments
+    parser     = argparse.ArgumentParser(description=helpstring,
+                                         formatter_class=argparse.RawDescriptionHelpFormatter,)
+    parser.add_argument(
+        "--size",
+        help="Size of the test data [Default: small]",
+        choices=list(sizepresets.keys()),
+        default='small',
+    )
+    parser.add_argument(
+        "--only",
+        help="Only run these benchmarks",
+        nargs='+',
+        choices=list(benchmarklist.keys()),
+        default=None,
+    )
+    parser.add_argument(
+        "--repeat",
+        help="Number of times to run each benchmark [Default: 3]",
+        type=int,
+        default=3,
+    )
+    parser.add_argument(
+        "--workdir",
+        help="Where to keep the test data [Default: ppbenchmark_<size>]",
+        type=str,
+        default=None,
+    )
+    parser.add_argument(
+        "--save",
+        help="Save the results to this json file [Default: ppbenchmark_<size>_<date>.json]",
+        type=str,
+        default=None,
+    )
+    parser.add_argument(
+        "--compare",
+        help="Compare the results with this json file from an earlier run",
+        type=str,
+        default=None,
+    )
+    parser.add_argument(
+        "--tolerance",
+        help="Relative slowdown allowed before a benchmark counts as slower [Default: 0.15]",
+        type=float,
+        default=0.15,
+    )
+    parser.add_argument(
+        '--clean',
+        help="Delete the test data at the end",
+        default=False,
+        action='store_true')
+    parser.add_argument(
+        '--list',
+        help="List the benchmarks",
+        default=False,
+        action='store_true')
+    parser.add_argument(
+        '-v',
+        '--verbose',
+        help="Turn on verbose",
+        default=False,
+        action='store_true')
+
+    # Load the options
+    args = parser.parse_args()
+    if args.list:
+        for name in benchmarklist: print(name)
+        sys.exit(0)
+    names   = list(benchmarklist.keys()) if args.only is None else args.only
+    workdir = args.workdir if args.workdir is not None else 'ppbenchmark_'+args.size
+    savefile = args.save if args.save is not None else \
+        'ppbenchmark_%s_%s.json'%(args.size, time.strftime('%Y%m%d-%H%M%S'))
+
+    # Make the data and run everything
+    data    = makeData(workdir, args.size, verbose=args.verbose)
+    print("Test data: %.1f MB in %s"%(getDataBytes(data)/1024**2, workdir))
+    results = runBenchmarks(data, names, repeat=args.repeat, verbose=args.verbose)
+    output  = {'created':time.ctime(), 'size':args.size, 'repeat':args.repeat,
+               'databytes':getDataBytes(data), 'machine':getMachineInfo(),
+               'results':results}
+    with open(savefile, 'w') as f:
+        json.dump(output, f, indent=1)
+    print("Saved results to "+savefile)
+    if args.clean:
+        shutil.rmtree(workdir)
+
+    # Compare with the baseline
+    slower = []
+    if args.compare is not None:
+        with open(args.compare, 'r') as f:
+            base = json.load(f)
+        slower = compareResults(base, output, tolerance=args.tolerance)
+    failed = [n for n, r in results.items() if r['status'] == 'failed']
+    if len(failed) > 0:
+        print("Failed: "+', '.join(failed))
+    if len(slower) > 0:
+        print("Slower than %s: %s"%(args.compare, ', '.join(slower)))
+    sys.exit(1 if (len(failed) > 0) or (len(slower) > 0) else 0)
@@ -75,6 +75,79 @@ if __name__ == "__main__":
         help="print times and information about netcdf file",
         action='store_true',
     )        
+    parser.add_argument(
+        '--profile',
+        help="record the time, memory and I/O of each task and action",
+        action='store_true',
+    )
+    parser.add_argument(
+        '--profileprefix',
+        help="prefix of the profile report files (default: ppprofile)",
+        default=None,
+        type=str,
+    )
+    parser.add_argument(
+        '--cprofile',
+        help="also save a cProfile dump of each task",
+        action='store_true',
+    )
+    parser.add_argument(
+        '--cases',
+        help="run the workflow for each of these cases (glob patterns or files listing the cases), replacing {case} in the inputs",
+        nargs='+',
+        default=None,
+        type=str,
+    )
+    parser.add_argument(
+        '--caseprocs',
+        help="number of cases to run at the same time",
+        default=None,
+        type=int,
+    )
+    parser.add_argument(
+        '--caselogdir',
+        help="directory for the log of each case (default: pplogs)",
+        default=None,
+        type=str,
+    )
+    parser.add_argument(
+        '--caseretries',
+        help="number of times to try a failed case again",
+        default=None,
+        type=int,
+    )
+    parser.add_argument(
+        '--plan',
+        help="do not run anything, print the estimated timesteps, bytes read and peak memory of each task",
+        action='store_true',
+    )
+    parser.add_argument(
+        '--memorybudget',
+        help="memory available to the run (e.g., 16GB), tasks are made to fit or refused",
+        default=None,
+        type=str,
+    )
+    parser.add_argument(
+        '--follow',
+        help="keep running as the sampling files grow, checking every SECONDS (default: %i)"%ppeng.followdefault,
+        nargs='?',
+        const=True,
+        default=None,
+        type=float,
+        metavar='SECONDS',
+    )
+    parser.add_argument(
+        '--followtimeout',
+        help="with --follow, stop after this many seconds without new data",
+        default=None,
+        type=float,
+    )
+    parser.add_argument(
+        '--checkpointsteps',
+        help="with --follow, save the running statistics every this many timesteps",
+        default=None,
+        type=int,
+    )
     parser.add_argument(
         '-v', '--verbose', 
         action='count', 
@@ -87,6 +160,11 @@ if __name__ == "__main__":
     inputfile = args.inputfile
     verbose   = args.verbose
     printinfo = args.printinfo
+    profile   = args.profileprefix if args.profileprefix is not None else args.profile
+    if not (profile or args.cprofile):
+        # Leave it to the profile global attribute
+        profile = None
+    cprofile  = args.cprofile if args.cprofile else None
 
     if printinfo:
         ppeng.print_inputs()
@@ -101,5 +179,20 @@ if __name__ == "__main__":
     with open(inputfile, 'r') as fp:
         yamldict = Loader(fp, **loaderkwargs)
 
+    # Global attributes given on the command line
+    batchopts = {'cases':args.cases, 'caseprocs':args.caseprocs,
+                 'caselogdir':args.caselogdir, 'caseretries':args.caseretries}
+    batchopts = {k:v for k, v in batchopts.items() if v is not None}
+    if args.memorybudget is not None:
+        batchopts['memorybudget'] = args.memorybudget
+    followopts = {'follow':args.follow, 'followtimeout':args.followtimeout,
+                  'checkpointsteps':args.checkpointsteps}
+    batchopts.update({k:v for k, v in followopts.items() if v is not None})
+    if len(batchopts) > 0:
+        if 'globalattributes' not in yamldict:
+            yamldict['globalattributes'] = {}
+        yamldict['globalattributes'].update(batchopts)
+
     # Run the driver
-    ppeng.driver(yamldict, verbose=verbose)
+    ppeng.driver(yamldict, verbose=verbose, profile=profile, cprofile=cprofile,
+                 plan=args.plan)